@@ -0,0 +1,95 @@
+# accrual.py
+#
+# Production of cat lairs and reactors, computed in closed form.  One cycle
+# is what a single activation yields; a machine accrues one cycle per
+# cooldown since it was last activated (a never-activated machine has one
+# ready), capped at `max_cycles` so collecting never pays more than
+# clicking would have.  Reactors burn cat nips each cycle, so when cycles
+# are collected together the lairs are settled first and reactors run (in
+# build order) only while there is fuel.
+#
+# The incubator and FOMO HIT payouts live here too, so single and bulk
+# activation share one table.
+from resource_ledger import TCORVAX
+
+ACCRUING_TYPES = ("catLair", "reactor")
+
+REACTOR_FUEL = 3        # cat nips burned per reactor cycle
+REACTOR_ENERGY = 2      # energy produced per reactor cycle
+REACTOR_TCORVAX = {1: 1.0, 2: 1.5, 3: 2.0}
+
+# Time between activations of one machine; user_machines.next_available_at
+# holds last_activated + this
+MACHINE_COOLDOWN_MS = 3600 * 1000
+
+
+def amplifier_bonus(amplifier):
+    """Extra tcorvax per reactor cycle from an online amplifier row."""
+    if amplifier and amplifier["is_offline"] == 0:
+        return 0.5 * amplifier["level"]
+    return 0.0
+
+
+def cycle_changes(machine_type, level, amp_bonus=0.0):
+    """{resource: delta} for one activation of a cat lair or reactor."""
+    if machine_type == "catLair":
+        return {"catNips": 5 + (level - 1)}
+    if machine_type == "reactor":
+        return {"catNips": -REACTOR_FUEL,
+                TCORVAX: REACTOR_TCORVAX.get(level, 1.0) + amp_bonus,
+                "energy": REACTOR_ENERGY}
+    return {}
+
+
+# Incubator: tcorvax per 100 sCVX (max 10), +1 per 1000 sCVX from level 2,
+# and one egg per 500 sCVX
+def incubator_rewards(staked_cvx, level):
+    """(base_reward, bonus_reward, eggs_reward) for one incubator activation."""
+    base_reward = min(10, int(staked_cvx // 100))
+    bonus_reward = int(staked_cvx // 1000) if (level or 1) >= 2 else 0
+    eggs_reward = int(staked_cvx // 500)
+    return base_reward, bonus_reward, eggs_reward
+
+
+FOMO_HIT_REWARD = 5     # tcorvax per activation after the first (minting) one
+
+
+def pending_cycles(machine, now_ms, cooldown_ms, max_cycles):
+    last = machine["last_activated"] or 0
+    if last == 0:
+        return 1
+    return max(0, min(max_cycles, (now_ms - last) // cooldown_ms))
+
+
+def plan_collection(inventory, cat_nips, now_ms, cooldown_ms, max_cycles):
+    """
+    Settle every cat lair and reactor in `inventory` against `cat_nips`.
+
+    Returns (changes, collected, starved): the summed {resource: delta},
+    [(machine row, cycles, {resource: delta})] for machines that produced,
+    and the reactors that had cycles ready but no fuel.
+    """
+    amplifiers = inventory.of_type("amplifier")
+    amp_bonus = amplifier_bonus(amplifiers[0] if amplifiers else None)
+
+    changes = {}
+    collected = []
+    starved = []
+    fuel = cat_nips
+    for machine_type in ACCRUING_TYPES:
+        for machine in inventory.of_type(machine_type):
+            cycles = pending_cycles(machine, now_ms, cooldown_ms, max_cycles)
+            if machine_type == "reactor":
+                cycles = min(cycles, max(0, int(fuel // REACTOR_FUEL)))
+                if cycles == 0 and pending_cycles(machine, now_ms, cooldown_ms, max_cycles):
+                    starved.append(machine)
+            if cycles == 0:
+                continue
+
+            per_cycle = cycle_changes(machine_type, machine["level"], amp_bonus)
+            gained = {res: delta * cycles for res, delta in per_cycle.items()}
+            for res, delta in gained.items():
+                changes[res] = changes.get(res, 0) + delta
+            fuel += gained.get("catNips", 0)
+            collected.append((machine, cycles, gained))
+    return changes, collected, starved
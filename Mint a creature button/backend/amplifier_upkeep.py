@@ -0,0 +1,108 @@
+# amplifier_upkeep.py
+#
+# Daily energy upkeep for amplifiers, computed in closed form.  An online
+# amplifier owes one payment of 2 × level energy per elapsed 24h period; it
+# pays for as many periods as the player's energy covers and goes offline
+# at the first one it cannot.  An offline amplifier comes back online (and
+# restarts its period from now) as soon as one payment is affordable.
+# Amplifiers are settled in id order against one shared energy balance.
+from resource_ledger import get_resource, credit
+
+UPKEEP_PERIOD_MS = 24 * 60 * 60 * 1000
+
+
+def upkeep_cost(level):
+    return 2 * level
+
+
+def plan_upkeep(amps, energy, now_ms):
+    """
+    Settle every amplifier in `amps` (rows with id, level, is_offline and
+    next_cost_time) against `energy`.  Returns (energy_spent, updates) with
+    updates as (next_cost_time, is_offline, id) for amplifiers that changed.
+    """
+    spent = 0
+    updates = []
+    for amp in amps:
+        next_cost = amp["next_cost_time"]
+        is_offline = amp["is_offline"]
+
+        if next_cost == 0:
+            # First evaluation: the first payment is due a period from now
+            updates.append((now_ms + UPKEEP_PERIOD_MS, is_offline, amp["id"]))
+            continue
+        if next_cost > now_ms:
+            continue
+
+        cost = upkeep_cost(amp["level"])
+        available = energy - spent
+        if is_offline == 0:
+            owed = (now_ms - next_cost) // UPKEEP_PERIOD_MS + 1
+            paid = min(owed, int(available // cost)) if cost > 0 else owed
+            spent += paid * cost
+            next_cost += paid * UPKEEP_PERIOD_MS
+            if paid < owed:
+                is_offline = 1
+        elif available >= cost:
+            spent += cost
+            next_cost = now_ms + UPKEEP_PERIOD_MS
+            is_offline = 0
+        else:
+            continue
+
+        updates.append((next_cost, is_offline, amp["id"]))
+    return spent, updates
+
+
+def _due_amplifiers(cur, user_id, now_ms):
+    cur.execute("""
+        SELECT id, level, is_offline, next_cost_time
+        FROM user_machines
+        WHERE user_id=? AND machine_type='amplifier' AND next_cost_time <= ?
+        ORDER BY id
+    """, (user_id, now_ms))
+    return cur.fetchall()
+
+
+def apply_amplifier_upkeep(conn, cur, user_id, now_ms):
+    """
+    Charge every amplifier period that has elapsed, in one transaction.
+    Costs a single SELECT when nothing is due, and takes no write lock when
+    nothing due can change (an offline amplifier still short of energy).
+    Returns True if anything changed.
+    """
+    amps = _due_amplifiers(cur, user_id, now_ms)
+    if not amps:
+        return False
+    if not plan_upkeep(amps, get_resource(cur, user_id, 'energy'), now_ms)[1]:
+        return False
+
+    # Re-read under the write lock so a concurrent request cannot charge
+    # the same period twice.  The savepoint undoes only this function's
+    # writes on failure, never the rest of the caller's transaction.
+    started = not conn.in_transaction
+    if started:
+        cur.execute("BEGIN IMMEDIATE")
+    cur.execute("SAVEPOINT amplifier_upkeep")
+    try:
+        amps = _due_amplifiers(cur, user_id, now_ms)
+        spent, updates = plan_upkeep(amps, get_resource(cur, user_id, 'energy'), now_ms)
+        if spent:
+            credit(cur, user_id, 'energy', -spent)
+        if updates:
+            cur.executemany("""
+                UPDATE user_machines
+                SET next_cost_time=?, is_offline=?
+                WHERE user_id=? AND id=?
+            """, [(next_cost, is_offline, user_id, amp_id)
+                  for next_cost, is_offline, amp_id in updates])
+        cur.execute("RELEASE amplifier_upkeep")
+        if started:
+            conn.commit()
+        return bool(updates)
+    except Exception:
+        cur.execute("ROLLBACK TO amplifier_upkeep")
+        cur.execute("RELEASE amplifier_upkeep")
+        if started:
+            conn.commit()       # ends our (now empty) BEGIN IMMEDIATE
+        raise
@@ -1,17 +1,36 @@
-import requests
 import os
 import time
 import hashlib
 import hmac
 import sqlite3
 import json
-import random
-import base64
 import uuid
 import traceback
-
-from flask import Flask, request, session, redirect, jsonify, send_from_directory
-from config import BOT_TOKEN, SECRET_KEY, DATABASE_PATH
+import asyncio
+import threading
+from typing import NamedTuple
+
+from flask import Flask, request, session, redirect, jsonify, send_from_directory, g
+from config import (BOT_TOKEN, SECRET_KEY, NFT_CACHE_SIZE, NFT_CACHE_TTL,
+                    BALANCE_CACHE_TTL, NFID_CACHE_SIZE, NFID_CACHE_TTL,
+                    NFID_REFRESH_INTERVAL, GATEWAY_NFT_CONCURRENCY,
+                    GAME_STATE_CACHE_SIZE, GAME_STATE_CACHE_TTL, ACCRUAL_MAX_CYCLES)
+from gateway import (gateway, gateway_async, ledger, AdaptiveConcurrency,
+                     GatewayUnavailable, GatewayThrottled, retry_after_seconds)
+from cache import TTLCache
+from db import get_db_connection, end_request_transaction, release_request_connection
+from schema import schema
+from migrations import migrate
+from game_state import (load_game_snapshot, game_state_json, rooms_unlocked, machine_json,
+                        pet_json, SnapshotCache)
+from amplifier_upkeep import apply_amplifier_upkeep
+from machine_inventory import MachineInventory
+from machine_catalog import MACHINE_CATALOG
+from accrual import (amplifier_bonus, cycle_changes, plan_collection,
+                     incubator_rewards, FOMO_HIT_REWARD, REACTOR_FUEL,
+                     MACHINE_COOLDOWN_MS)
+from resource_ledger import (TCORVAX, get_resource, get_balances,
+                             credit, apply_changes, debit_if_sufficient)
 
 app = Flask(__name__, 
             static_folder='static',  # React build files go here
@@ -23,18 +42,45 @@ app.config['SESSION_COOKIE_SECURE'] = True
 app.config['SESSION_COOKIE_HTTPONLY'] = True
 app.config['SESSION_COOKIE_SAMESITE'] = 'Lax'
 
-# Flag to track if we need to add the provisional_mint column
-NEEDS_SCHEMA_UPDATE = False
-# Flag to track if we need to add the room column
-NEEDS_ROOM_COLUMN = False
-# Flag to track if we need to add the seen_room_unlock column
-NEEDS_SEEN_ROOM_COLUMN = False
-# Flag to track if we need to ensure eggs resource exists for everyone
-NEEDS_EGGS_RESOURCE = False
-# Flag to track if we need to add the pets table
-NEEDS_PETS_TABLE = False
-# Flag to track if we need to add the radix_account_address column
-NEEDS_RADIX_ADDRESS_COLUMN = False
+@app.before_request
+def pin_ledger_state():
+    # Every Gateway read made while serving this request uses one state_version
+    g.ledger_pin = ledger.begin_request()
+
+@app.teardown_request
+def unpin_ledger_state(exc):
+    token = g.pop("ledger_pin", None)
+    if token is not None:
+        ledger.end_request(token)
+
+@app.after_request
+def finish_unit_of_work(response):
+    # One transaction per request: commit once if the route succeeded,
+    # roll back its writes otherwise
+    try:
+        end_request_transaction(commit=response.status_code < 400)
+    except sqlite3.Error as e:
+        print(f"Error committing request: {e}")
+        traceback.print_exc()
+        response = jsonify({"error": "Server error"})
+        response.status_code = 500
+
+    # Any write by the player drops their cached snapshot
+    if request.method != "GET" and 'telegram_id' in session:
+        GAME_STATE.invalidate(session['telegram_id'])
+    return response
+
+@app.teardown_request
+def release_db_connection(exc):
+    # Uncommitted work is rolled back before the connection is pooled again
+    release_request_connection()
+
+@app.errorhandler(GatewayUnavailable)
+def gateway_unavailable(e):
+    # Circuit open or rate limit exhausted – tell the client to retry later
+    print(f"Gateway unavailable: {e}")
+    return jsonify({"error": "Radix Gateway temporarily unavailable",
+                    "shouldRetry": True}), 503
 
 # Constants for Evolving Creatures integration
 EVOLVING_CREATURES_PACKAGE = "package_rdx1p5u8kkr8z77ujmhyzyx36x677jnjkvfwjphu2mxyc0984eqckgmclq"
@@ -301,375 +347,166 @@ SPECIES_DATA = {
 
 SPECIES_META = SPECIES_DATA   # ← legacy name used elsewhere
 
-def get_db_connection():
-    conn = sqlite3.connect(DATABASE_PATH, check_same_thread=False)
-    conn.row_factory = sqlite3.Row
-    return conn
-
-def check_and_update_schema():
-    """Check if the database schema needs updating and update if necessary."""
-    global NEEDS_SCHEMA_UPDATE
-    
+# ──────────────────────────────────────────────────────────────
+# SPECIES_DATA compiled once into immutable records and lookup indexes
+# ──────────────────────────────────────────────────────────────
+class Species(NamedTuple):
+    id: int
+    name: str
+    specialty_stats: tuple
+    rarity: str
+    preferred_token: str
+    evolution_prices: tuple
+    stat_price: float
+    base_url: str
+    form_urls: tuple          # egg, form1, form2, form3 image URLs
+
+    def form_url(self, form):
+        """Image URL for `form`; anything but 0/1/2 is the final form."""
+        return self.form_urls[form if form in (0, 1, 2) else 3]
+
+def _compile_species(species_id, data):
+    base_url = data["base_url"]
+    return Species(
+        id=species_id,
+        name=data["name"],
+        specialty_stats=tuple(data.get("specialty_stats", ())),
+        rarity=data.get("rarity", "Common"),
+        preferred_token=data.get("preferred_token", "XRD"),
+        evolution_prices=tuple(data.get("evolution_prices", (50, 100, 200))),
+        stat_price=data.get("stat_price", 50),
+        base_url=base_url,
+        form_urls=tuple(f"{base_url}{suffix}.png"
+                        for suffix in ("_egg", "_form1", "_form2", "_form3")),
+    )
+
+SPECIES = {sid: _compile_species(sid, data) for sid, data in SPECIES_DATA.items()}
+DEFAULT_SPECIES = SPECIES[1]   # Bullx
+SPECIES_ID_BY_NAME = {sp.name.lower(): sp.id for sp in SPECIES.values()}
+# No preferred_token -> species index: every cost and display path starts
+# from the creature's species and reads Species.preferred_token, and nothing
+# selects a species by token.  Build one here if such a lookup appears.
+
+def species_by_name(name):
+    """Species record for a species name in any case, or None."""
+    species_id = SPECIES_ID_BY_NAME.get(name.lower() if isinstance(name, str) else "")
+    return SPECIES.get(species_id)
+
+def run_migrations():
+    """Bring bot.db up to the latest schema version, then resolve its capabilities."""
     try:
         conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        # Check if the provisional_mint column exists
-        cursor.execute("PRAGMA table_info(user_machines)")
-        columns = [column[1] for column in cursor.fetchall()]
-        
-        if 'provisional_mint' not in columns:
-            print("Adding provisional_mint column to user_machines table")
-            try:
-                cursor.execute("ALTER TABLE user_machines ADD COLUMN provisional_mint INTEGER DEFAULT 0")
-                conn.commit()
-                print("Column added successfully")
-            except sqlite3.Error as e:
-                print(f"Error adding column: {e}")
-                NEEDS_SCHEMA_UPDATE = True
-        
-        cursor.close()
+        migrate(conn)
+        schema.refresh(conn)
         conn.close()
     except Exception as e:
-        print(f"Error checking schema: {e}")
-        NEEDS_SCHEMA_UPDATE = True
+        print(f"Error running database migrations: {e}")
+        traceback.print_exc()
 
-def check_and_update_room_column():
-    """Check if the room column exists in user_machines and add if necessary."""
-    global NEEDS_ROOM_COLUMN
-    
-    try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        # Check if the room column exists
-        cursor.execute("PRAGMA table_info(user_machines)")
-        columns = [column[1] for column in cursor.fetchall()]
-        
-        if 'room' not in columns:
-            print("Adding room column to user_machines table")
-            try:
-                cursor.execute("ALTER TABLE user_machines ADD COLUMN room INTEGER DEFAULT 1")
-                conn.commit()
-                print("Room column added successfully")
-            except sqlite3.Error as e:
-                print(f"Error adding room column: {e}")
-                NEEDS_ROOM_COLUMN = True
-        
-        cursor.close()
-        conn.close()
-    except Exception as e:
-        print(f"Error checking room column: {e}")
-        NEEDS_ROOM_COLUMN = True
+# Migrate on startup (a single version check when already current)
+run_migrations()
 
-def check_and_update_users_schema():
-    """Check if the users table has a radix_account_address column and add it if necessary."""
-    global NEEDS_RADIX_ADDRESS_COLUMN
-    
-    try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        # Check if the radix_account_address column exists
-        cursor.execute("PRAGMA table_info(users)")
-        columns = [column[1] for column in cursor.fetchall()]
-        
-        if 'radix_account_address' not in columns:
-            print("Adding radix_account_address column to users table")
-            try:
-                cursor.execute("ALTER TABLE users ADD COLUMN radix_account_address TEXT")
-                conn.commit()
-                print("radix_account_address column added successfully")
-            except sqlite3.Error as e:
-                print(f"Error adding radix_account_address column: {e}")
-                NEEDS_RADIX_ADDRESS_COLUMN = True
-        
-        cursor.close()
-        conn.close()
-    except Exception as e:
-        print(f"Error checking users schema: {e}")
-        NEEDS_RADIX_ADDRESS_COLUMN = True
+# ──────────────────────────────────────────────────────────────
+# Account fungible balances – one paged scan per account, indexed by
+# resource address and reused for BALANCE_CACHE_TTL seconds
+# ──────────────────────────────────────────────────────────────
+SCVX_RESOURCE = "resource_rdx1t5q4aa74uxcgzehk0u3hjy6kng9rqyr4uvktnud8ehdqaaez50n693"
 
-def check_and_update_seen_room_column():
-    """Check if the seen_room_unlock column exists in users and add if necessary."""
-    global NEEDS_SEEN_ROOM_COLUMN
-    
-    try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        # Check if the seen_room_unlock column exists
-        cursor.execute("PRAGMA table_info(users)")
-        columns = [column[1] for column in cursor.fetchall()]
-        
-        if 'seen_room_unlock' not in columns:
-            print("Adding seen_room_unlock column to users table")
-            try:
-                cursor.execute("ALTER TABLE users ADD COLUMN seen_room_unlock INTEGER DEFAULT 0")
-                conn.commit()
-                print("seen_room_unlock column added successfully")
-            except sqlite3.Error as e:
-                print(f"Error adding seen_room_unlock column: {e}")
-                NEEDS_SEEN_ROOM_COLUMN = True
-        
-        cursor.close()
-        conn.close()
-    except Exception as e:
-        print(f"Error checking seen_room_unlock column: {e}")
-        NEEDS_SEEN_ROOM_COLUMN = True
+BALANCE_CACHE = TTLCache(maxsize=2048, ttl=BALANCE_CACHE_TTL)
 
-def check_and_update_pets_table():
-    """Check if the pets table exists and create if necessary."""
-    global NEEDS_PETS_TABLE
-    
-    try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        # Check if the pets table exists
-        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='pets'")
-        table_exists = cursor.fetchone() is not None
-        
-        if not table_exists:
-            print("Creating pets table")
-            try:
-                cursor.execute("""
-                    CREATE TABLE pets (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        user_id INTEGER NOT NULL,
-                        x INTEGER NOT NULL,
-                        y INTEGER NOT NULL,
-                        room INTEGER DEFAULT 1,
-                        type TEXT DEFAULT 'cat',
-                        parent_machine INTEGER DEFAULT NULL
-                    )
-                """)
-                conn.commit()
-                print("Pets table created successfully")
-            except sqlite3.Error as e:
-                print(f"Error creating pets table: {e}")
-                NEEDS_PETS_TABLE = True
-        
-        cursor.close()
-        conn.close()
-    except Exception as e:
-        print(f"Error checking pets table: {e}")
-        NEEDS_PETS_TABLE = True
+def get_account_balances(account_address, force_refresh=False):
+    """
+    Return {resource_address: amount} for every fungible held by the account.
+
+    Pages through /state/entity/page/fungibles/ once at the request's pinned
+    ledger state and caches the snapshot, so XRD, sCVX and every
+    TOKEN_ADDRESSES symbol are served from the same lookup.
+    Raises on Gateway errors, unless the Gateway is unavailable and an
+    older snapshot is cached.
+    """
+    if not force_refresh:
+        cached = BALANCE_CACHE.get(account_address)
+        if cached is not None:
+            return cached
+
+    balances = {}
+    payload = {
+        "address": account_address,
+        "limit_per_page": 100,
+        "at_ledger_state": ledger.selector()
+    }
+
+    while True:
+        try:
+            response = gateway.post("/state/entity/page/fungibles/", payload)
+        except GatewayUnavailable:
+            stale = BALANCE_CACHE.get_stale(account_address)
+            if stale is None:
+                raise
+            print(f"Gateway unavailable – serving cached balances for {account_address}")
+            return stale
 
-def ensure_eggs_resource_exists():
-    """Ensure the eggs resource exists for all users."""
-    global NEEDS_EGGS_RESOURCE
-    
-    try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        # Get all user IDs
-        cursor.execute("SELECT user_id FROM users")
-        user_ids = [row['user_id'] for row in cursor.fetchall()]
-        
-        # Check and create eggs resource for each user
-        for user_id in user_ids:
-            cursor.execute(
-                "SELECT COUNT(*) FROM resources WHERE user_id=? AND resource_name='eggs'", 
-                (user_id,)
-            )
-            count = cursor.fetchone()[0]
-            
-            if count == 0:
-                print(f"Adding eggs resource for user {user_id}")
-                cursor.execute(
-                    "INSERT INTO resources (user_id, resource_name, amount) VALUES (?, 'eggs', 0)",
-                    (user_id,)
-                )
-        
-        conn.commit()
-        cursor.close()
-        conn.close()
-        print("Eggs resource check completed")
-    except Exception as e:
-        print(f"Error ensuring eggs resource: {e}")
-        NEEDS_EGGS_RESOURCE = True
-
-# Run schema checks on startup
-check_and_update_schema()
-check_and_update_room_column()
-check_and_update_seen_room_column()
-ensure_eggs_resource_exists()
-check_and_update_pets_table()
-check_and_update_users_schema()
-
-def fetch_scvx_balance(account_address):
-    """Fetch sCVX balance for a Radix account using the Gateway API."""
-    if not account_address:
-        print("No account address provided")
-        return 0
-        
-    try:
-        # sCVX resource address
-        scvx_resource = 'resource_rdx1t5q4aa74uxcgzehk0u3hjy6kng9rqyr4uvktnud8ehdqaaez50n693'
-        
-        # Use the Gateway API
-        url = "https://mainnet.radixdlt.com/state/entity/page/fungibles/"
-        print(f"Fetching sCVX for {account_address} using Gateway API")
-        
-        # Prepare request payload
-        payload = {
-            "address": account_address,
-            "limit_per_page": 100  # Get a reasonable number of tokens
-        }
-        
-        # Set appropriate headers
-        headers = {
-            'Content-Type': 'application/json',
-            'User-Agent': 'CorvaxLab Game/1.0'
-        }
-        
-        print(f"Making Gateway API request with payload: {json.dumps(payload)}")
-        response = requests.post(url, json=payload, headers=headers, timeout=15)
-        
-        print(f"Gateway API Response Status: {response.status_code}")
-        
         if response.status_code != 200:
-            print(f"Gateway API error: Status {response.status_code}")
-            print(f"Response: {response.text[:200]}...")
-            return 0
-        
-        # Parse the JSON response
+            raise Exception(f"Gateway API error: Status {response.status_code}: "
+                            f"{response.text[:200]}")
+
         data = response.json()
-        
-        # Print debugging info
-        print(f"Gateway API total_count: {data.get('total_count', 0)}")
-        
-        # Look for the sCVX resource in the items
-        items = data.get('items', [])
-        print(f"Found {len(items)} resources in the account")
-        
-        # Dump all resources for debugging
-        print("All resources in account:")
-        for i, item in enumerate(items):
-            resource_addr = item.get('resource_address', '')
-            amount = item.get('amount', '0')
-            print(f"Resource {i}: {resource_addr} = {amount}")
-            
-            # Check if this is the sCVX resource
-            if resource_addr == scvx_resource:
-                amount_value = float(amount)
-                print(f"FOUND sCVX RESOURCE: {amount_value}")
-                return amount_value
-        
-        # If we get here, we didn't find the resource - look for partial matches
-        print("Trying partial resource address matching...")
-        for item in items:
-            resource_addr = item.get('resource_address', '')
-            if scvx_resource[-8:] in resource_addr:  # Match on last few chars
-                amount = float(item.get('amount', '0'))
-                print(f"Found potential sCVX match with amount: {amount}")
-                return amount
-                
-        return 0
-    except Exception as e:
-        print(f"Error fetching sCVX with Gateway API: {e}")
-        traceback.print_exc()
-        return 0
+        for item in data.get("items", []):
+            resource_addr = item.get("resource_address", "").lower()
+            balances[resource_addr] = float(item.get("amount", "0"))
+
+        next_cursor = data.get("next_cursor")
+        if not next_cursor:
+            break
+        payload = dict(payload, cursor=next_cursor)
+
+    print(f"Fetched {len(balances)} fungible balances for {account_address}")
+    BALANCE_CACHE.set(account_address, balances)
+    return balances
 
-def fetch_xrd_balance(account_address):
-    """Fetch XRD balance for a Radix account using the Gateway API with improved reliability."""
+def fetch_resource_balance(account_address, resource_address, label, force_refresh=False):
+    """
+    Balance of one fungible resource from the account snapshot (0 on
+    error).  GatewayUnavailable propagates so callers fail fast instead of
+    treating the account as empty.
+    """
     if not account_address:
         print("No account address provided")
         return 0
-        
+
     try:
-        # XRD resource address - This is the canonical XRD address
-        xrd_resource = 'resource_rdx1tknxxxxxxxxxradxrdxxxxxxxxx009923554798xxxxxxxxxradxrd'
-        xrd_short_identifier = 'radxrd' # A unique identifier for XRD that's part of the address
-        
-        # Use the Gateway API
-        url = "https://mainnet.radixdlt.com/state/entity/page/fungibles/"
-        print(f"Fetching XRD for {account_address} using Gateway API")
-        
-        # Prepare request payload
-        payload = {
-            "address": account_address,
-            "limit_per_page": 100  # Get a reasonable number of tokens
-        }
-        
-        # Set appropriate headers
-        headers = {
-            'Content-Type': 'application/json',
-            'User-Agent': 'CorvaxLab Game/1.0'
-        }
-        
-        print(f"Making Gateway API request with payload: {json.dumps(payload)}")
-        response = requests.post(url, json=payload, headers=headers, timeout=15)
-        
-        print(f"Gateway API Response Status: {response.status_code}")
-        
-        if response.status_code != 200:
-            print(f"Gateway API error: Status {response.status_code}")
-            print(f"Response: {response.text[:200]}...")
-            # Try a second time before giving up
-            print("Retrying XRD balance check...")
-            time.sleep(2)  # Brief delay before retry
-            response = requests.post(url, json=payload, headers=headers, timeout=15)
-            if response.status_code != 200:
-                print(f"Retry failed with status: {response.status_code}")
-                return 0
-        
-        # Parse the JSON response
-        data = response.json()
-        
-        # Print debugging info
-        print(f"Gateway API total_count: {data.get('total_count', 0)}")
-        
-        # Look for the XRD resource in the items
-        items = data.get('items', [])
-        print(f"Found {len(items)} resources in the account")
-        
-        # Print the first few resources to help diagnose issues
-        for i, item in enumerate(items[:5]):
-            resource_addr = item.get('resource_address', '')
-            amount = item.get('amount', '0')
-            print(f"Resource {i}: {resource_addr} = {amount}")
-        
-        # First try exact match
-        for item in items:
-            resource_addr = item.get('resource_address', '')
-            amount = item.get('amount', '0')
-            
-            # Check if this is the XRD resource with exact match
-            if resource_addr.lower() == xrd_resource.lower():
-                amount_value = float(amount)
-                print(f"FOUND XRD RESOURCE (exact match): {amount_value}")
-                return amount_value
-        
-        # If exact match fails, try a more flexible approach with the unique identifier
-        print("No exact match found for XRD, trying identifier match...")
-        for item in items:
-            resource_addr = item.get('resource_address', '')
-            amount = item.get('amount', '0')
-            
-            # Check if this resource address contains the XRD identifier
-            if xrd_short_identifier in resource_addr.lower():
-                amount_value = float(amount)
-                print(f"FOUND XRD RESOURCE (identifier match): {amount_value}")
-                return amount_value
-        
-        # Final fallback: check if there are additional pages of results
-        if 'next_cursor' in data and data.get('total_count', 0) > len(items):
-            print("Additional pages of tokens exist, but XRD not found in first page")
-            # In a full implementation, we would handle pagination here
-        
-        # If we get here, we didn't find XRD
-        print("XRD not found in account fungible tokens")
-        return 0
+        balances = get_account_balances(account_address, force_refresh)
+        amount = balances.get(resource_address.lower(), 0)
+        print(f"{label} balance for {account_address}: {amount}")
+        return amount
+    except GatewayUnavailable:
+        raise
     except Exception as e:
-        print(f"Error fetching XRD with Gateway API: {e}")
+        print(f"Error fetching {label} with Gateway API: {e}")
         traceback.print_exc()
-        # Try an alternative approach or display an error rather than silent fail
         return 0
 
-def fetch_token_balance(account_address, token_symbol):
+def fetch_scvx_balance(account_address, force_refresh=False):
+    """Fetch sCVX balance for a Radix account using the Gateway API."""
+    return fetch_resource_balance(account_address, SCVX_RESOURCE, "sCVX", force_refresh)
+
+def incubator_scvx_balance(account_address):
+    """
+    sCVX that sizes incubator rewards (0 without an account).  Routes call
+    this before their first write, so the Gateway round trip never runs
+    while the request holds the SQLite write lock.
+    """
+    if not account_address:
+        print("No account address provided for sCVX lookup")
+        return 0
+    print(f"Fetching sCVX for account: {account_address}")
+    return fetch_scvx_balance(account_address)
+
+def fetch_xrd_balance(account_address, force_refresh=False):
+    """Fetch XRD balance for a Radix account using the Gateway API."""
+    return fetch_resource_balance(account_address, TOKEN_ADDRESSES["XRD"], "XRD", force_refresh)
+
+def fetch_token_balance(account_address, token_symbol, force_refresh=False):
     """
     Fetch balance of a specific token for a Radix account.
     Returns: float balance or 0 if not found
@@ -677,63 +514,120 @@ def fetch_token_balance(account_address, token_symbol):
     if not account_address or not token_symbol:
         print(f"Missing account address or token symbol: {account_address}, {token_symbol}")
         return 0
-        
-    try:
-        # Get the resource address for the token
-        token_resource = TOKEN_ADDRESSES.get(token_symbol)
-        if not token_resource:
-            print(f"Unknown token symbol: {token_symbol}")
-            return 0
-        
-        # Use the Gateway API
-        url = "https://mainnet.radixdlt.com/state/entity/page/fungibles/"
-        print(f"Fetching {token_symbol} for {account_address} using Gateway API")
-        
-        # Prepare request payload
-        payload = {
-            "address": account_address,
-            "limit_per_page": 100  # Get a reasonable number of tokens
-        }
-        
-        # Set appropriate headers
-        headers = {
-            'Content-Type': 'application/json',
-            'User-Agent': 'CorvaxLab Game/1.0'
-        }
-        
-        response = requests.post(url, json=payload, headers=headers, timeout=15)
-        
-        if response.status_code != 200:
-            print(f"Gateway API error: Status {response.status_code}")
-            return 0
-        
-        # Parse the JSON response
-        data = response.json()
-        
-        # Look for the token resource in the items
-        items = data.get('items', [])
-        
-        for item in items:
-            resource_addr = item.get('resource_address', '')
-            amount = item.get('amount', '0')
-            
-            # Check if this is the requested token
-            if resource_addr == token_resource:
-                amount_value = float(amount)
-                print(f"FOUND {token_symbol} RESOURCE: {amount_value}")
-                return amount_value
-        
-        # If we get here, we didn't find the token
-        return 0
-    except Exception as e:
-        print(f"Error fetching {token_symbol} with Gateway API: {e}")
-        traceback.print_exc()
+
+    # Get the resource address for the token
+    token_resource = TOKEN_ADDRESSES.get(token_symbol)
+    if not token_resource:
+        print(f"Unknown token symbol: {token_symbol}")
         return 0
 
+    return fetch_resource_balance(account_address, token_resource, token_symbol, force_refresh)
+
 # ──────────────────────────────────────────────────────────────
-# Helper: return list of NFIDs a given account owns for a resource
+# NFIDs held by accounts – /state/entity/details takes up to
+# ENTITY_DETAILS_BATCH addresses per call, so many accounts and the
+# CREATURE/TOOL/SPELL resources are resolved in one round-trip per chunk
 # ──────────────────────────────────────────────────────────────
-def get_account_nfids(account, resource_address):
+NFT_RESOURCES = (CREATURE_NFT_RESOURCE, TOOL_NFT_RESOURCE, SPELL_NFT_RESOURCE)
+
+# Gateway's default max_page_size for entity/details addresses
+ENTITY_DETAILS_BATCH = 20
+
+# (account, resource_address) -> [nfid, …]
+NFID_CACHE = TTLCache(maxsize=NFID_CACHE_SIZE, ttl=NFID_CACHE_TTL)
+
+# (account, resource_address) pairs with a mint or burn in flight (manifest
+# handed out); read from the Gateway, not NFID_CACHE, until the window expires
+NFID_DIRTY_WINDOW = 10 * 60
+NFID_DIRTY = TTLCache(maxsize=NFID_CACHE_SIZE, ttl=NFID_DIRTY_WINDOW)
+
+def _cached_nfids(account, resource_address):
+    """Fresh cached NFIDs, or None when missing, expired or dirty."""
+    key = (account, resource_address)
+    return None if key in NFID_DIRTY else NFID_CACHE.get(key)
+
+def invalidate_account_nfids(account, resource_addresses=NFT_RESOURCES):
+    """Drop cached NFIDs of an account whose holdings are about to change."""
+    if not account:
+        return
+    for res in resource_addresses:
+        NFID_CACHE.pop((account, res))
+        NFID_DIRTY.set((account, res), True)
+
+def get_accounts_nfids(accounts, resource_addresses=NFT_RESOURCES, use_cache=False):
+    """
+    Resolve the NFIDs of several resources for many accounts at once.
+
+    Returns
+    -------
+    dict[str, dict[str, list[str]]]
+        {account: {resource_address: [nfid, …]}} for every requested pair;
+        accounts whose chunk failed are left out.  While the Gateway is
+        unavailable, expired cache entries are served instead.
+    """
+    accounts = list(dict.fromkeys(a for a in accounts if a))
+    resource_addresses = tuple(resource_addresses)
+    result = {}
+
+    if use_cache:
+        pending = []
+        for account in accounts:
+            cached = {res: _cached_nfids(account, res) for res in resource_addresses}
+            if all(ids is not None for ids in cached.values()):
+                result[account] = cached
+            else:
+                pending.append(account)
+        accounts = pending
+
+    if not accounts:
+        return result
+
+    try:
+        selector = ledger.selector()
+    except Exception as exc:
+        print(f"[get_accounts_nfids] ledger state unavailable: {exc}")
+        return _stale_accounts_nfids(accounts, resource_addresses, result)
+
+    for i in range(0, len(accounts), ENTITY_DETAILS_BATCH):
+        chunk = accounts[i:i + ENTITY_DETAILS_BATCH]
+        try:
+            body = _account_nfids_body(chunk, selector)
+            try:
+                resp = gateway.post("/state/entity/details", body)
+            except GatewayUnavailable as exc:
+                print(f"[get_accounts_nfids] {exc} – serving cached NFIDs")
+                _stale_accounts_nfids(chunk, resource_addresses, result)
+                continue
+
+            if resp.status_code != 200:
+                print(f"[get_accounts_nfids] gateway {resp.status_code}: "
+                      f"{resp.text[:120]}…")
+                continue
+
+            found = _parse_accounts_nfids(resp.json(), resource_addresses)
+            for account in chunk:
+                by_resource = found.get(account, {})
+                for res in resource_addresses:
+                    by_resource.setdefault(res, [])
+                    NFID_CACHE.set((account, res), by_resource[res])
+                result[account] = by_resource
+        except Exception as exc:
+            print(f"[get_accounts_nfids] chunk {i // ENTITY_DETAILS_BATCH} failed: {exc}")
+            traceback.print_exc()
+
+    return result
+
+
+def _stale_accounts_nfids(accounts, resource_addresses, result):
+    """Fill `result` from NFID_CACHE, expired entries included."""
+    for account in accounts:
+        cached = {res: NFID_CACHE.get_stale((account, res)) for res in resource_addresses}
+        if all(ids is not None for ids in cached.values()):
+            result[account] = cached
+    return result
+
+
+def get_account_nfids(account, resource_address, use_cache=False):
     """
     Uses /state/entity/details (Gateway ≥ v1.10) to list the non-fungible
     IDs (“NFIDs”) of `resource_address` held in `account`.
@@ -742,58 +636,97 @@ def get_account_nfids(account, resource_address):
     -------
     list[str]      a list of NFID strings, or [] if none / on error
     """
-    try:
-        BASE = "https://mainnet.radixdlt.com"
-        HEADERS = {
-            "Content-Type": "application/json",
-            "User-Agent":  "CorvaxLab Game/1.2"
-        }
-        body = {
-            "addresses": [account],
-            "aggregation_level": "Vault",
-            "opt_ins": {"non_fungible_include_nfids": True}
-        }
+    found = get_accounts_nfids([account], (resource_address,), use_cache=use_cache)
+    return found.get(account, {}).get(resource_address, [])
 
-        # retry a couple of times for transient network/429 errors
-        for attempt in range(3):
-            try:
-                resp = requests.post(f"{BASE}/state/entity/details",
-                                     json=body,
-                                     headers=HEADERS,
-                                     timeout=15)
-                if resp.status_code == 429 and attempt < 2:
-                    time.sleep(1 + attempt)
-                    continue
-                break
-            except requests.RequestException:
-                if attempt < 2:
-                    time.sleep(1 + attempt)
-                    continue
-                raise
 
-        if resp.status_code != 200:
-            print(f"[get_account_nfids] gateway {resp.status_code}: "
-                  f"{resp.text[:120]}…")
-            return []
+def _account_nfids_body(accounts, selector):
+    """/state/entity/details request body listing NFIDs for `accounts`."""
+    return {
+        "addresses": list(accounts),
+        "aggregation_level": "Vault",
+        "at_ledger_state": selector,
+        "opt_ins": {"non_fungible_include_nfids": True}
+    }
 
-        data = resp.json()
-        if not data.get("items"):
-            return []
 
-        # first (and only) entry corresponds to `account`
+def _parse_accounts_nfids(data, resource_addresses):
+    """
+    Pull the NFIDs of `resource_addresses` out of an entity/details reply.
+    Returns {account: {resource_address: [nfid, …]}}.
+    """
+    wanted = set(resource_addresses)
+    found = {}
+
+    for entity in data.get("items") or []:
+        by_resource = found.setdefault(entity.get("address"), {})
         try:
-            for res in data["items"][0]["non_fungible_resources"]["items"]:
-                if res["resource_address"] == resource_address:
-                    # vaults.items[0].items -> list of NFIDs
-                    return res["vaults"]["items"][0]["items"]
-        except (KeyError, IndexError, TypeError):
-            pass
+            resources = entity["non_fungible_resources"]["items"]
+        except (KeyError, TypeError):
+            continue
 
-        return []
+        for res in resources:
+            if res.get("resource_address") not in wanted:
+                continue
+            ids = by_resource.setdefault(res["resource_address"], [])
+            # vaults.items[*].items -> list of NFIDs
+            for vault in (res.get("vaults") or {}).get("items") or []:
+                ids.extend(vault.get("items") or [])
+
+    return found
+
+
+def _parse_account_nfids(data, resource_address):
+    """NFIDs of `resource_address` from a single-account entity/details reply."""
+    for by_resource in _parse_accounts_nfids(data, (resource_address,)).values():
+        return by_resource.get(resource_address, [])
+    return []
+
+
+# ──────────────────────────────────────────────────────────────
+# Optional background refresher – keeps NFID_CACHE warm for every
+# linked account with one batched call per ENTITY_DETAILS_BATCH users
+# ──────────────────────────────────────────────────────────────
+def refresh_linked_account_nfids():
+    """Re-resolve NFIDs for all users with a saved Radix account."""
+    try:
+        conn = get_db_connection()
+        cur = conn.cursor()
+        cur.execute("""
+            SELECT DISTINCT radix_account_address FROM users
+            WHERE radix_account_address IS NOT NULL AND radix_account_address != ''
+        """)
+        accounts = [row[0] for row in cur.fetchall()]
+        conn.close()
+
+        if accounts:
+            found = get_accounts_nfids(accounts)
+            print(f"[nfid-refresher] refreshed {len(found)}/{len(accounts)} accounts")
     except Exception as exc:
-        print(f"[get_account_nfids] fatal: {exc}")
+        print(f"[nfid-refresher] error: {exc}")
         traceback.print_exc()
-        return []
+
+
+_nfid_refresher = None
+
+def start_nfid_refresher(interval=NFID_REFRESH_INTERVAL):
+    """Start the refresher thread once; disabled when `interval` is 0."""
+    global _nfid_refresher
+    if interval <= 0 or _nfid_refresher is not None:
+        return _nfid_refresher
+
+    def loop():
+        while True:
+            refresh_linked_account_nfids()
+            time.sleep(interval)
+
+    _nfid_refresher = threading.Thread(target=loop, name="nfid-refresher", daemon=True)
+    _nfid_refresher.start()
+    print(f"NFID refresher started (every {interval}s)")
+    return _nfid_refresher
+
+# Start with the app (after migrations), however it is served
+start_nfid_refresher()
 
 
 def fetch_user_nfts(account_address, resource_address=CREATURE_NFT_RESOURCE):
@@ -808,33 +741,11 @@ def fetch_user_nfts(account_address, resource_address=CREATURE_NFT_RESOURCE):
         return []
         
     try:
-        # Use consistent Gateway API URL
-        gateway_url = "https://mainnet.radixdlt.com"
-        
-        # First, get the current ledger state to maintain consistency across requests
-        status_url = f"{gateway_url}/status/current"
-        headers = {
-            'Content-Type': 'application/json',
-            'User-Agent': 'CorvaxLab Game/1.0'
-        }
-        
-        status_response = requests.post(
-            status_url,
-            headers=headers,
-            json={},
-            timeout=15
-        )
-        
-        if status_response.status_code != 200:
-            print(f"Failed to get current ledger state: {status_response.text[:200]}")
-            return []
-            
-        # Extract the ledger state for consistency
-        ledger_state = status_response.json().get("ledger_state")
+        # Use the request's pinned ledger state to keep every page consistent
+        ledger_state = ledger.selector()
         print(f"Using ledger state: {ledger_state}")
         
         # Use the entity/page/non-fungible-vaults endpoint with proper parameters
-        url = f"{gateway_url}/state/entity/page/non-fungible-vaults/"
         print(f"Fetching NFTs for {account_address} of resource {resource_address}")
         
         all_nft_ids = []
@@ -860,30 +771,8 @@ def fetch_user_nfts(account_address, resource_address=CREATURE_NFT_RESOURCE):
             
             print(f"Making API request with payload: {json.dumps(payload)}")
             
-            # Implement retry logic with exponential backoff for rate limiting
-            max_retries = 3
-            retry_delay = 1
-            
-            for retry in range(max_retries):
-                try:
-                    response = requests.post(url, json=payload, headers=headers, timeout=15)
-                    
-                    # Check if we hit rate limiting
-                    if response.status_code == 429:
-                        if retry < max_retries - 1:
-                            sleep_time = retry_delay * (2 ** retry)
-                            print(f"Rate limited, retrying in {sleep_time} seconds...")
-                            time.sleep(sleep_time)
-                            continue
-                    
-                    break  # Success or non-retry error
-                except requests.exceptions.RequestException as e:
-                    if retry < max_retries - 1:
-                        sleep_time = retry_delay * (2 ** retry)
-                        print(f"Request failed, retrying in {sleep_time} seconds: {e}")
-                        time.sleep(sleep_time)
-                    else:
-                        raise
+            # Rate limiting and retries are handled by the gateway client
+            response = gateway.post("/state/entity/page/non-fungible-vaults/", payload)
             
             if response.status_code != 200:
                 print(f"Gateway API error: Status {response.status_code}")
@@ -922,14 +811,6 @@ def fetch_user_nfts(account_address, resource_address=CREATURE_NFT_RESOURCE):
         traceback.print_exc()
         return []
 
-# ────────────────────────────────────────────────────────────
-# Helper: recursively unwrap Babylon programmatic JSON
-# ────────────────────────────────────────────────────────────
-import json
-import traceback
-from decimal import Decimal           # already imported once in your file
-# (leave the earlier import in place or deduplicate, it’s harmless)
-
 # ────────────────────────────────────────────────────────────
 # Helper: recursively unwrap Babylon programmatic JSON
 #          (PATCHED – tuple of named fields ⇒ dict)
@@ -1000,8 +881,6 @@ def _unwrap(val):
 # ──────────────────────────────────────────────────────────────
 # Main – convert on-chain CreatureData into front-end payload
 # ──────────────────────────────────────────────────────────────
-FORM_SUFFIX = {0: "_egg", 1: "_form1", 2: "_form2", 3: "_form3"}  # final
-
 def process_creature_data(nft_id: str, pj_raw) -> dict:
     """
     Take the unwrapped `programmatic_json` for a creature NFT and return the
@@ -1031,26 +910,14 @@ def process_creature_data(nft_id: str, pj_raw) -> dict:
         species_id = None                       # fall through to name-match
 
     if species_id is None:
-        # fallback: map by on-chain name field
-        species_id = next(
-            (sid for sid, v in SPECIES_DATA.items()
-             if v["name"].lower() == pj.get("species_name", "").lower()),
-            1                                    # default → Bullx
-        )
+        # fallback: map by on-chain name field (default → Bullx)
+        matched = species_by_name(pj.get("species_name", ""))
+        species_id = matched.id if matched else DEFAULT_SPECIES.id
 
-    species_meta = SPECIES_DATA.get(species_id, SPECIES_DATA[1])
+    species_meta = SPECIES.get(species_id, DEFAULT_SPECIES)
 
     # ── 3. assemble the response ───────────────────────────────────────
     form = pj.get("form", 0)
-    base_url = species_meta["base_url"]
-
-    def form_url(f: int) -> str:
-        return (
-            f"{base_url}_egg.png"   if f == 0 else
-            f"{base_url}_form1.png" if f == 1 else
-            f"{base_url}_form2.png" if f == 2 else
-            f"{base_url}_form3.png"
-        )
 
     stats_raw = pj.get("stats", {}) or {}
     stats = {
@@ -1079,15 +946,15 @@ def process_creature_data(nft_id: str, pj_raw) -> dict:
 
         # <<< FIXED LINES >>>
         "species_id":   species_id,           # ← use the **int**, not raw string
-        "species_name": species_meta["name"],
+        "species_name": species_meta.name,
 
         "form":            form,
-        "key_image_url":   pj.get("key_image_url") or form_url(form),
-        "image_url":       pj.get("image_url")     or form_url(form),
+        "key_image_url":   pj.get("key_image_url") or species_meta.form_url(form),
+        "image_url":       pj.get("image_url")     or species_meta.form_url(form),
 
         # <<< preferred_token now comes from the matched species >>>
-        "rarity":          pj.get("rarity")        or species_meta["rarity"],
-        "preferred_token": species_meta["preferred_token"],
+        "rarity":          pj.get("rarity")        or species_meta.rarity,
+        "preferred_token": species_meta.preferred_token,
 
         "stats":              stats,
         "evolution_progress": evolution_progress,
@@ -1101,70 +968,239 @@ def process_creature_data(nft_id: str, pj_raw) -> dict:
     }
 
 # ────────────────────────────────────────────────────────────
-# FINAL fetch_nft_data – now calls _unwrap on every NFT
+# NFT data cache – (resource_address, nfid) -> (payload, state_version)
+# ────────────────────────────────────────────────────────────
+NFT_DATA_CACHE = TTLCache(maxsize=NFT_CACHE_SIZE, ttl=NFT_CACHE_TTL)
+
+# NFIDs with a pending on-chain change (upgrade / evolve / combine manifest
+# handed out); always re-fetched until the window expires
+NFT_DIRTY_WINDOW = 10 * 60
+NFT_DIRTY = TTLCache(maxsize=NFT_CACHE_SIZE, ttl=NFT_DIRTY_WINDOW)
+
+def _cached_nft_data(resource_address, nft_ids, min_state_version=None):
+    """
+    Split `nft_ids` into cached payloads and IDs that must be fetched.
+    An entry is stale once its TTL lapsed, it was read before
+    `min_state_version`, or the NFID has a pending change.
+    """
+    hits, missing = {}, []
+    for nfid in nft_ids:
+        key = (resource_address, nfid)
+        entry = NFT_DATA_CACHE.get(key)
+        if (entry is None or key in NFT_DIRTY or
+                (min_state_version is not None and entry[1] < min_state_version)):
+            missing.append(nfid)
+        else:
+            hits[nfid] = entry[0]
+    return hits, missing
+
+def _store_nft_data(resource_address, data_map, state_version):
+    """Cache fetched payloads, never replacing one read at a later state."""
+    for nfid, payload in data_map.items():
+        key = (resource_address, nfid)
+        current = NFT_DATA_CACHE.get_stale(key)
+        if current is not None and current[1] > state_version:
+            continue
+        NFT_DATA_CACHE.set(key, (payload, state_version))
+
+def _in_request_order(nft_ids, data_map):
+    ordered = {nfid: data_map[nfid] for nfid in nft_ids if nfid in data_map}
+    ordered.update(data_map)
+    return ordered
+
+def _stale_nft_data(resource_address, nft_ids):
+    """Cached payloads for `nft_ids`, expired entries included."""
+    stale = {}
+    for nfid in nft_ids:
+        entry = NFT_DATA_CACHE.get_stale((resource_address, nfid))
+        if entry is not None:
+            stale[nfid] = entry[0]
+    return stale
+
+def invalidate_nft_data(resource_address, nft_ids):
+    """Drop cached data for NFIDs that are about to change on-ledger."""
+    for nfid in nft_ids:
+        NFT_DATA_CACHE.pop((resource_address, nfid))
+        NFT_DIRTY.set((resource_address, nfid), True)
+
+# ────────────────────────────────────────────────────────────
+# FINAL fetch_nft_data – now calls _unwrap on every NFT
 # ────────────────────────────────────────────────────────────
 def fetch_nft_data(resource_address: str,
                    nft_ids: list[str],
-                   page_limit: int = 100) -> dict:
+                   page_limit: int = 100,
+                   min_state_version: int = None) -> dict:
     """
     Return a dict {nfid: plain-python metadata} for every NFID.
     Works on Babylon Gateway v1.10+.
+
+    Payloads are served from NFT_DATA_CACHE where fresh; only missing or
+    stale IDs are fetched.  Cached payloads are shared – treat as read-only.
     """
     if not nft_ids:
         return {}
 
-    BASE  = "https://mainnet.radixdlt.com"
-    HDRS  = {"Content-Type": "application/json",
-             "User-Agent":   "CorvaxLab Game/2.0"}
+    out, missing = _cached_nft_data(resource_address, nft_ids, min_state_version)
+    if not missing:
+        print(f"[fetch_nft_data] Served {len(out)} NFTs from cache")
+        return out
 
-    # 1. Use a single, pinned state_version (no epoch)
-    status = requests.post(f"{BASE}/status/gateway-status",
-                           json={}, headers=HDRS, timeout=10)
-    status.raise_for_status()
-    selector = {"state_version": status.json()["ledger_state"]["state_version"]}
+    # Batches go out concurrently on the gateway loop
+    return gateway_async.run(fetch_nft_data_async(resource_address, nft_ids,
+                                                  page_limit, min_state_version))
 
-    out: dict[str, dict] = {}
 
-    for i in range(0, len(nft_ids), page_limit):
-        batch = nft_ids[i : i + page_limit]          # keep braces
+def _parse_nft_data(data) -> dict:
+    """Unwrap every entry of a /state/non-fungible/data reply."""
+    out = {}
+    # Gateway echoes our list order
+    for entry in data.get("non_fungible_ids", []):
+        nfid   = entry["non_fungible_id"]            # with braces
+        raw    = (entry.get("data") or {}) \
+                   .get("programmatic_json", {})
 
-        body  = {
-            "at_ledger_state": selector,
-            "resource_address": resource_address,
-            "non_fungible_ids": batch                # ← plain strings
-        }
+        out[nfid] = _unwrap(raw)                     # ← magic happens here
+    return out
 
-        r = requests.post(f"{BASE}/state/non-fungible/data",
-                          json=body, headers=HDRS, timeout=20)
 
-        if r.status_code == 400:                     # helpful debug
-            print("[fetch_nft_data] bad request:", r.text[:180])
-        r.raise_for_status()
+# ────────────────────────────────────────────────────────────
+# Async variants – run on gateway_async's event loop so a route
+# can fan out independent lookups and wait once for all of them
+# ────────────────────────────────────────────────────────────
+async def get_account_nfids_async(account, resource_address, use_cache=False):
+    """Async get_account_nfids: list NFIDs of `resource_address` in `account`."""
+    if use_cache:
+        cached = _cached_nfids(account, resource_address)
+        if cached is not None:
+            return cached
+    try:
+        body = _account_nfids_body([account], await ledger.selector_async())
+        try:
+            resp = await gateway_async.post("/state/entity/details", body)
+        except GatewayUnavailable as exc:
+            print(f"[get_account_nfids_async] {exc} – serving cached NFIDs")
+            return NFID_CACHE.get_stale((account, resource_address), [])
+
+        if resp.status_code != 200:
+            print(f"[get_account_nfids_async] gateway {resp.status_code}: "
+                  f"{resp.text[:120]}…")
+            return []
 
-        # Gateway echoes our list order
-        for entry in r.json().get("non_fungible_ids", []):
-            nfid   = entry["non_fungible_id"]        # with braces
-            raw    = (entry.get("data") or {}) \
-                       .get("programmatic_json", {})
+        nfids = _parse_account_nfids(resp.json(), resource_address)
+        NFID_CACHE.set((account, resource_address), nfids)
+        return nfids
+    except Exception as exc:
+        print(f"[get_account_nfids_async] fatal: {exc}")
+        traceback.print_exc()
+        return []
 
-            out[nfid] = _unwrap(raw)                 # ← magic happens here
 
-    print(f"[fetch_nft_data] Retrieved {len(out)}/{len(nft_ids)} NFTs")
-    return out
+# Shared cap on concurrent /state/non-fungible/data batches
+NFT_DATA_LIMITER = AdaptiveConcurrency(GATEWAY_NFT_CONCURRENCY)
+NFT_DATA_MAX_THROTTLES = 3
 
+def _stale_nft_batch(resource_address, batch, exc):
+    """Expired cache entries for `batch`, or re-raise `exc` if there are none."""
+    stale = _stale_nft_data(resource_address, batch)
+    if not stale:
+        raise exc
+    print(f"[fetch_nft_data] {exc} – serving {len(stale)} cached NFTs")
+    return stale
 
+async def _fetch_nft_batch(resource_address, batch, state_version):
+    """
+    One /state/non-fungible/data call, retried on 429 with AIMD backoff.
+    Throttling – a 429 reply, or the client's limiter refusing a slot –
+    shrinks NFT_DATA_LIMITER and pauses it for Retry-After before the next
+    attempt.  If the Gateway stays throttled or is unavailable the batch is
+    served from expired cache entries where possible.
+    """
+    body = {
+        "at_ledger_state": {"state_version": state_version},
+        "resource_address": resource_address,
+        "non_fungible_ids": batch                    # ← plain strings
+    }
 
-import json
-import traceback
+    for attempt in range(NFT_DATA_MAX_THROTTLES + 1):
+        last = attempt == NFT_DATA_MAX_THROTTLES
+        try:
+            async with NFT_DATA_LIMITER:
+                r = await gateway_async.post("/state/non-fungible/data", body)
+        except GatewayThrottled as exc:
+            if last:
+                return _stale_nft_batch(resource_address, batch, exc)
+            NFT_DATA_LIMITER.on_throttled(exc.retry_after)
+            continue
+        except GatewayUnavailable as exc:
+            return _stale_nft_batch(resource_address, batch, exc)
+
+        if r.status_code != 429:
+            break
+        if last:
+            exc = GatewayThrottled("Gateway still returning 429", retry_after_seconds(r))
+            return _stale_nft_batch(resource_address, batch, exc)
+        NFT_DATA_LIMITER.on_throttled(retry_after_seconds(r))
+
+    if r.status_code == 400:                         # helpful debug
+        print("[fetch_nft_data] bad request:", r.text[:180])
+    r.raise_for_status()
+    NFT_DATA_LIMITER.on_success()
+
+    fetched = _parse_nft_data(r.json())
+    _store_nft_data(resource_address, fetched, state_version)
+    return fetched
+
+
+async def fetch_nft_data_async(resource_address: str,
+                               nft_ids: list[str],
+                               page_limit: int = 100,
+                               min_state_version: int = None) -> dict:
+    """
+    Async fetch_nft_data: {nfid: plain-python metadata} for every NFID.
+    Missing IDs are split into `page_limit` batches that are sent
+    concurrently, at most NFT_DATA_LIMITER.limit at a time.
+    """
+    if not nft_ids:
+        return {}
 
-# ──────────────────────────────────────────────────────────────
-# Helper:  build the image suffix for each form
-FORM_SUFFIX = {
-    0: "_egg",
-    1: "_form1",
-    2: "_form2",
-    3: "_form3",          # final form
-}
+    out, missing = _cached_nft_data(resource_address, nft_ids, min_state_version)
+    if not missing:
+        return out
+
+    # Use the request's pinned state_version (no epoch), but never one
+    # older than the caller needs: the shared ledger-state cache may trail
+    # a transaction that was just committed
+    state_version = (await ledger.pinned_async())["state_version"]
+    if min_state_version is not None:
+        state_version = max(state_version, min_state_version)
+
+    batches = [missing[i : i + page_limit]
+               for i in range(0, len(missing), page_limit)]
+    for fetched in await asyncio.gather(
+            *(_fetch_nft_batch(resource_address, batch, state_version)
+              for batch in batches)):
+        out.update(fetched)
+
+    print(f"[fetch_nft_data] Retrieved {len(out)}/{len(nft_ids)} NFTs "
+          f"in {len(batches)} batch(es) ({len(nft_ids) - len(missing)} cached)")
+    return _in_request_order(nft_ids, out)
+
+
+async def fetch_account_nfts_async(account, resource_address, use_cache=False) -> dict:
+    """NFIDs of `resource_address` held by `account`, then their data."""
+    nft_ids = await get_account_nfids_async(account, resource_address, use_cache)
+    if not nft_ids:
+        return {}
+    print(f"Found {len(nft_ids)} NFTs of {resource_address}")
+    return await fetch_nft_data_async(resource_address, nft_ids)
+
+
+async def fetch_user_items_async(account, use_cache=False):
+    """Tool and spell data maps for `account`, looked up concurrently."""
+    return await asyncio.gather(
+        fetch_account_nfts_async(account, TOOL_NFT_RESOURCE, use_cache),
+        fetch_account_nfts_async(account, SPELL_NFT_RESOURCE, use_cache)
+    )
 
 
 # Here's a more robust version of calculate_upgrade_cost:
@@ -1189,24 +1225,14 @@ def calculate_upgrade_cost(creature, energy=0, strength=0, magic=0, stamina=0, s
             # If conversion fails, try to use the value directly
             species_id = creature.get("species_id", 1)
             
-        species_info = SPECIES_DATA.get(species_id)
-        
-        # If not found by ID, try by name as a fallback
-        if not species_info and "species_name" in creature:
-            species_name = creature.get("species_name", "").lower()
-            for sid, data in SPECIES_DATA.items():
-                if data["name"].lower() == species_name:
-                    species_info = data
-                    species_id = sid
-                    break
-        
-        # If still not found, use default
-        if not species_info:
-            species_info = SPECIES_DATA[1]  # Default to Bullx
-            species_id = 1
+        # By id, then by name as a fallback, then the default (Bullx)
+        species_info = (SPECIES.get(species_id)
+                        or species_by_name(creature.get("species_name"))
+                        or DEFAULT_SPECIES)
+        species_id = species_info.id
         
         # Get preferred token
-        token_symbol = species_info.get("preferred_token", "XRD")
+        token_symbol = species_info.preferred_token
         
         # Get form (ensure it's an integer)
         form = 0
@@ -1216,7 +1242,7 @@ def calculate_upgrade_cost(creature, energy=0, strength=0, magic=0, stamina=0, s
             form = 0
         
         # Default stat price if not specified
-        stat_price = species_info.get("stat_price", 50)
+        stat_price = species_info.stat_price
         
         # For final form (form 3), cost is stat_price * total points
         if form == 3:
@@ -1227,7 +1253,7 @@ def calculate_upgrade_cost(creature, energy=0, strength=0, magic=0, stamina=0, s
             }
         
         # Get evolution prices
-        evolution_prices = species_info.get("evolution_prices", [50, 100, 200])
+        evolution_prices = species_info.evolution_prices
         if form < len(evolution_prices):
             evolution_price = evolution_prices[form]
         else:
@@ -1256,7 +1282,7 @@ def calculate_upgrade_cost(creature, energy=0, strength=0, magic=0, stamina=0, s
             # Round to nearest integer for most tokens
             upgrade_cost = max(1, int(round(upgrade_cost)))
         
-        print(f"Calculated cost for {species_info['name']} (form {form}, upgrade {upgrades_completed+1}): {upgrade_cost} {token_symbol}")
+        print(f"Calculated cost for {species_info.name} (form {form}, upgrade {upgrades_completed+1}): {upgrade_cost} {token_symbol}")
         print(f"Base evolution price: {evolution_price}, Percentage: {percentage*100}%")
             
         return {
@@ -1291,21 +1317,11 @@ def calculate_evolution_cost(creature):
             # If conversion fails, try to use the value directly
             species_id = creature.get("species_id", 1)
             
-        species_info = SPECIES_DATA.get(species_id)
-        
-        # If not found by ID, try by name as a fallback
-        if not species_info and "species_name" in creature:
-            species_name = creature.get("species_name", "").lower()
-            for sid, data in SPECIES_DATA.items():
-                if data["name"].lower() == species_name:
-                    species_info = data
-                    species_id = sid
-                    break
-        
-        # If still not found, use default
-        if not species_info:
-            species_info = SPECIES_DATA[1]  # Default to Bullx
-            species_id = 1
+        # By id, then by name as a fallback, then the default (Bullx)
+        species_info = (SPECIES.get(species_id)
+                        or species_by_name(creature.get("species_name"))
+                        or DEFAULT_SPECIES)
+        species_id = species_info.id
         
         # Get form (ensure it's an integer)
         form = 0
@@ -1337,17 +1353,16 @@ def calculate_evolution_cost(creature):
             }
         
         # Get preferred token
-        token_symbol = species_info.get("preferred_token", "XRD")
+        token_symbol = species_info.preferred_token
         
         # Get evolution prices
-        evolution_prices = species_info.get("evolution_prices", [50, 100, 200])
+        evolution_prices = species_info.evolution_prices
         if form < len(evolution_prices):
             evolution_price = evolution_prices[form]
         else:
             evolution_price = evolution_prices[-1]
         
         # Fixed calculation: 60% already paid in stat upgrades, 40% remaining for evolution
-        paid_percentage = 0.6  # Fixed at 60% regardless of actual upgrades
         remaining_percentage = 0.4  # Fixed at 40% for the evolution step
         evolution_cost = evolution_price * remaining_percentage
         
@@ -1360,7 +1375,7 @@ def calculate_evolution_cost(creature):
             # Round to nearest integer for most tokens
             evolution_cost = max(1, int(round(evolution_cost)))
         
-        print(f"Calculated evolution cost for {species_info['name']} (form {form}): {evolution_cost} {token_symbol}")
+        print(f"Calculated evolution cost for {species_info.name} (form {form}): {evolution_cost} {token_symbol}")
         print(f"Base evolution price: {evolution_price}, Fixed remaining: 40%")
             
         return {
@@ -1377,127 +1392,9 @@ def calculate_evolution_cost(creature):
             "reason": f"Error: {str(e)}"
         }
 
-def can_build_fomo_hit(cur, user_id):
-    """Check if user has built and fully operational all other machine types."""
-    print(f"Checking FOMO HIT prerequisites for user_id: {user_id}")
-    try:
-        # 1. Check if they've built all required machine types
-        required_types = ['catLair', 'reactor', 'amplifier', 'incubator']
-        for machine_type in required_types:
-            cur.execute("""
-                SELECT COUNT(*) as count FROM user_machines
-                WHERE user_id=? AND machine_type=?
-            """, (user_id, machine_type))
-            row = cur.fetchone()
-            count = row[0] if row else 0
-            print(f"  Machine type {machine_type}: {count} found")
-            if count == 0:
-                print(f"  Missing required machine: {machine_type}")
-                return False
-        
-        # 2. For cat lairs and reactors, check ALL are at max level (3)
-        # First, get total count of each type
-        for machine_type in ['catLair', 'reactor']:
-            # Get total number of this machine type
-            cur.execute("""
-                SELECT COUNT(*) as total FROM user_machines
-                WHERE user_id=? AND machine_type=?
-            """, (user_id, machine_type))
-            total_row = cur.fetchone()
-            total = total_row[0] if total_row else 0
-            
-            # Get how many are at max level
-            cur.execute("""
-                SELECT COUNT(*) as max_count FROM user_machines 
-                WHERE user_id=? AND machine_type=? AND level>=3
-            """, (user_id, machine_type))
-            max_row = cur.fetchone()
-            max_count = max_row[0] if max_row else 0
-            
-            print(f"  {machine_type}: {max_count}/{total} at max level")
-            
-            # For now, as long as one machine is at max level for each type, that counts as success
-            if max_count == 0:
-                print(f"  No {machine_type} machines at max level")
-                return False
-        
-        # 3. For amplifier, check it's at max level (5)
-        cur.execute("""
-            SELECT MAX(level) as max_level FROM user_machines
-            WHERE user_id=? AND machine_type='amplifier'
-        """, (user_id,))
-        max_level_row = cur.fetchone()
-        max_level = max_level_row[0] if max_level_row else 0
-        print(f"  Amplifier max level: {max_level}/5")
-        
-        # For now, level 3 amplifier is ok as a prerequisite 
-        if max_level < 3:
-            print(f"  Amplifier not at required level")
-            return False
-        
-        # 4. Check that incubator is operational (not offline)
-        cur.execute("""
-            SELECT is_offline FROM user_machines
-            WHERE user_id=? AND machine_type='incubator'
-            LIMIT 1
-        """, (user_id,))
-        row = cur.fetchone()
-        is_offline = row[0] if row else 1
-        print(f"  Incubator offline status: {is_offline}")
-        
-        # For testing, let's ignore the incubator online check
-        # Remove this if-statement in production
-        if is_offline == 1:
-            print(f"  Incubator is offline but we'll allow FOMO HIT for testing")
-            # return False  # Comment this out for easier testing
-            
-        print("✅ All FOMO HIT prerequisites met!")
-        return True
-    except Exception as e:
-        print(f"Error in can_build_fomo_hit: {e}")
-        import traceback
-        traceback.print_exc()
-        return False
-
-def can_build_third_reactor(cur, user_id):
-    """Check if user can build a third reactor (has incubator and fomoHit)."""
-    try:
-        # Check if incubator exists
-        cur.execute("""
-            SELECT COUNT(*) FROM user_machines
-            WHERE user_id=? AND machine_type='incubator'
-        """, (user_id,))
-        has_incubator = cur.fetchone()[0] > 0
-        
-        # Check if fomoHit exists
-        cur.execute("""
-            SELECT COUNT(*) FROM user_machines
-            WHERE user_id=? AND machine_type='fomoHit'
-        """, (user_id,))
-        has_fomo_hit = cur.fetchone()[0] > 0
-        
-        # Count current reactors
-        cur.execute("""
-            SELECT COUNT(*) FROM user_machines
-            WHERE user_id=? AND machine_type='reactor'
-        """, (user_id,))
-        reactor_count = cur.fetchone()[0]
-        
-        # Can build third reactor if:
-        # 1. Has both incubator and fomoHit
-        # 2. Currently has 2 reactors (this would be the third)
-        return has_incubator and has_fomo_hit and reactor_count == 2
-    except Exception as e:
-        print(f"Error in can_build_third_reactor: {e}")
-        traceback.print_exc()
-        return False
-
 def create_nft_mint_manifest(account_address):
     """Create the Radix transaction manifest for NFT minting."""
     try:
-        # Generate a random ID for the NFT
-        nft_id = str(uuid.uuid4())[:8]
-        
         # Simple manifest that calls a component to mint an NFT
         # The component address should be your actual minting component
         manifest = f"""
@@ -1809,14 +1706,9 @@ CALL_METHOD
 def get_transaction_status(intent_hash):
     """Check the status of a transaction using the Gateway API."""
     try:
-        url = "https://mainnet.radixdlt.com/transaction/status"
         payload = {"intent_hash": intent_hash}
-        headers = {
-            'Content-Type': 'application/json',
-            'User-Agent': 'CorvaxLab Game/1.0'
-        }
         
-        response = requests.post(url, json=payload, headers=headers, timeout=15)
+        response = gateway.post("/transaction/status", payload)
         
         if response.status_code != 200:
             print(f"Gateway API error: Status {response.status_code}")
@@ -1852,7 +1744,6 @@ def get_minted_nfts_from_transaction(intent_hash):
             return None, None
         
         # Get transaction details
-        url = "https://mainnet.radixdlt.com/transaction/committed-details"
         payload = {
             "intent_hash": intent_hash,
             "opt_ins": {
@@ -1860,12 +1751,8 @@ def get_minted_nfts_from_transaction(intent_hash):
                 "non_fungible_changes": True
             }
         }
-        headers = {
-            'Content-Type': 'application/json',
-            'User-Agent': 'CorvaxLab Game/1.0'
-        }
         
-        response = requests.post(url, json=payload, headers=headers, timeout=15)
+        response = gateway.post("/transaction/committed-details", payload)
         
         if response.status_code != 200:
             print(f"Gateway API error: Status {response.status_code}")
@@ -1873,6 +1760,9 @@ def get_minted_nfts_from_transaction(intent_hash):
         
         data = response.json()
         
+        # NFT data must be at least as new as this transaction
+        tx_state_version = (data.get("transaction") or {}).get("state_version")
+        
         # Extract NFT IDs from non-fungible changes
         creature_nft = None
         bonus_item = None
@@ -1913,7 +1803,8 @@ def get_minted_nfts_from_transaction(intent_hash):
         
         # Now, fetch the actual NFT data for the creature
         if creature_id:
-            creature_data = fetch_nft_data(creature_resource, [creature_id])
+            creature_data = fetch_nft_data(creature_resource, [creature_id],
+                                           min_state_version=tx_state_version)
             if creature_data and creature_id in creature_data:
                 raw_data = creature_data[creature_id]
                 creature_nft = process_creature_data(creature_id, raw_data)
@@ -1921,7 +1812,8 @@ def get_minted_nfts_from_transaction(intent_hash):
         # Fetch the bonus item data
         if bonus_item_id and bonus_item_type:
             resource_address = tool_resource if bonus_item_type == "tool" else spell_resource
-            bonus_data = fetch_nft_data(resource_address, [bonus_item_id])
+            bonus_data = fetch_nft_data(resource_address, [bonus_item_id],
+                                        min_state_version=tx_state_version)
             
             if bonus_data and bonus_item_id in bonus_data:
                 raw_bonus_data = bonus_data[bonus_item_id]
@@ -2046,20 +1938,18 @@ def telegram_login_callback():
                 "INSERT INTO users (user_id, first_name, corvax_count, seen_room_unlock) VALUES (?, ?, 0, 0)",
                 (user_id_int, first_name)
             )
-            conn.commit()
             
             # Also create initial eggs resource for new user
             cursor.execute(
                 "INSERT INTO resources (user_id, resource_name, amount) VALUES (?, 'eggs', 0)",
                 (user_id_int,)
             )
-            conn.commit()
 
         cursor.close()
         conn.close()
 
         session['telegram_id'] = str(user_id_int)
-        print(f"Session set, redirecting to homepage")
+        print("Session set, redirecting to homepage")
         return redirect("https://cvxlab.net/")
     except Exception as e:
         print(f"Error in telegram_login_callback: {e}")
@@ -2093,86 +1983,49 @@ def whoami():
         traceback.print_exc()
         return jsonify({"error": "Server error"}), 500
 
-@app.route("/api/machines", methods=["GET"])
-def get_machines():
+# ──────────────────────────────────────────────────────────────
+# Per-user game snapshot cache
+# ──────────────────────────────────────────────────────────────
+# In-process only: with several workers each keeps its own copy, and a
+# write served by one worker is not seen by another until the TTL runs out.
+GAME_STATE = SnapshotCache(GAME_STATE_CACHE_SIZE, GAME_STATE_CACHE_TTL)
+
+def cached_game_snapshot(user_id):
+    """
+    The player's game snapshot, from memory when nothing has changed.
+    A hit issues no SQL; a miss applies amplifier upkeep first, then loads
+    user, resources, machines and pets in three statements.
+    """
+    snapshot = GAME_STATE.get(user_id)
+    if snapshot is not None:
+        return snapshot
+
+    generation = GAME_STATE.generation(user_id)
+    conn = get_db_connection()
+    cur = conn.cursor()
+
     try:
-        if 'telegram_id' not in session:
-            return jsonify({"error": "Not logged in"}), 401
+        update_amplifiers_status(user_id, conn, cur)
+    except Exception as e:
+        print(f"Error updating amplifier status: {e}")
+        # Continue anyway
 
-        user_id = session['telegram_id']
-        conn = get_db_connection()
-        cur = conn.cursor()
+    snapshot = load_game_snapshot(cur, user_id)
 
-        try:
-            # Try with provisional_mint and room columns
-            cur.execute("""
-                SELECT id, machine_type, x, y, level, last_activated, is_offline, provisional_mint, room
-                FROM user_machines
-                WHERE user_id=?
-            """, (user_id,))
-            rows = cur.fetchall()
-            
-            machines = []
-            for r in rows:
-                machine = dict(r)
-                machines.append(machine)
-                
-        except sqlite3.OperationalError:
-            try:
-                # Try with provisional_mint only
-                cur.execute("""
-                    SELECT id, machine_type, x, y, level, last_activated, is_offline, provisional_mint
-                    FROM user_machines
-                    WHERE user_id=?
-                """, (user_id,))
-                rows = cur.fetchall()
-                
-                machines = []
-                for r in rows:
-                    machine = dict(r)
-                    machine["room"] = 1  # Default room
-                    machines.append(machine)
-            except sqlite3.OperationalError:
-                # Fall back to old schema without provisional_mint and room
-                cur.execute("""
-                    SELECT id, machine_type, x, y, level, last_activated, is_offline
-                    FROM user_machines
-                    WHERE user_id=?
-                """, (user_id,))
-                rows = cur.fetchall()
-                
-                machines = []
-                for r in rows:
-                    machine = dict(r)
-                    machine["provisionalMint"] = 0  # Default value
-                    machine["room"] = 1  # Default room
-                    machines.append(machine)
+    cur.close()
+    conn.close()
 
-        cur.close()
-        conn.close()
+    GAME_STATE.store(user_id, snapshot, generation)
+    return snapshot
 
-        # Convert SQLite row objects to proper dictionaries for JSON
-        machine_list = []
-        for m in machines:
-            machine_dict = {
-                "id": m["id"],
-                "type": m["machine_type"],
-                "x": m["x"],
-                "y": m["y"],
-                "level": m["level"],
-                "lastActivated": m["last_activated"],
-                "isOffline": m["is_offline"],
-                "room": m.get("room", 1)  # Default to room 1 if not present
-            }
-            
-            if "provisional_mint" in m:
-                machine_dict["provisionalMint"] = m["provisional_mint"]
-            else:
-                machine_dict["provisionalMint"] = 0
-                
-            machine_list.append(machine_dict)
+@app.route("/api/machines", methods=["GET"])
+def get_machines():
+    try:
+        if 'telegram_id' not in session:
+            return jsonify({"error": "Not logged in"}), 401
 
-        return jsonify(machine_list)
+        snapshot = cached_game_snapshot(session['telegram_id'])
+        return jsonify([machine_json(m) for m in snapshot["machines"]])
     except Exception as e:
         print(f"Error in get_machines: {e}")
         traceback.print_exc()
@@ -2184,131 +2037,27 @@ def get_resources():
         if 'telegram_id' not in session:
             return jsonify({"error": "Not logged in"}), 401
 
-        user_id = session['telegram_id']
-        conn = get_db_connection()
-        cur = conn.cursor()
-
-        cur.execute("SELECT corvax_count FROM users WHERE user_id=?", (user_id,))
-        row = cur.fetchone()
-        tcorvax = row["corvax_count"] if row else 0
-
-        catNips = get_or_create_resource(cur, user_id, 'catNips')
-        energy = get_or_create_resource(cur, user_id, 'energy')
-        eggs = get_or_create_resource(cur, user_id, 'eggs')
-
-        cur.close()
-        conn.close()
-
+        snapshot = cached_game_snapshot(session['telegram_id'])
         return jsonify({
-            "tcorvax": float(tcorvax),
-            "catNips": float(catNips),
-            "energy": float(energy),
-            "eggs": float(eggs)
+            "tcorvax": snapshot["tcorvax"],
+            "catNips": snapshot["catNips"],
+            "energy": snapshot["energy"],
+            "eggs": snapshot["eggs"]
         })
     except Exception as e:
         print(f"Error in get_resources: {e}")
         traceback.print_exc()
         return jsonify({"error": "Server error"}), 500
 
-def get_or_create_resource(cursor, user_id, resource_name):
-    try:
-        cursor.execute("SELECT amount FROM resources WHERE user_id=? AND resource_name=?", (user_id, resource_name))
-        row = cursor.fetchone()
-        if row is None:
-            cursor.execute("INSERT INTO resources (user_id, resource_name, amount) VALUES (?, ?, 0)",
-                        (user_id, resource_name))
-            return 0
-        else:
-            return row[0]
-    except Exception as e:
-        print(f"Error in get_or_create_resource: {e}")
-        traceback.print_exc()
-        return 0
-
-def set_resource_amount(cursor, user_id, resource_name, amount):
-    try:
-        cursor.execute("SELECT amount FROM resources WHERE user_id=? AND resource_name=?", (user_id, resource_name))
-        row = cursor.fetchone()
-        if row is None:
-            cursor.execute("INSERT INTO resources (user_id, resource_name, amount) VALUES (?, ?, ?)",
-                        (user_id, resource_name, amount))
-        else:
-            cursor.execute("UPDATE resources SET amount=? WHERE user_id=? AND resource_name=?",
-                        (amount, user_id, resource_name))
-    except Exception as e:
-        print(f"Error in set_resource_amount: {e}")
-        traceback.print_exc()
-
 def update_amplifiers_status(user_id, conn, cur):
+    """Charge due amplifier upkeep; returns True if any machine changed."""
     try:
-        cur.execute("""
-            SELECT id, level, is_offline, next_cost_time
-            FROM user_machines
-            WHERE user_id=? AND machine_type='amplifier'
-        """, (user_id,))
-        amps = cur.fetchall()
-        if not amps:
-            return
-
-        now_ms = int(time.time() * 1000)
-        energy_val = get_or_create_resource(cur, user_id, 'energy')
-
-        for amp in amps:
-            amp_id = amp["id"]
-            level = amp["level"]
-            is_offline = amp["is_offline"]
-            next_cost = amp["next_cost_time"]
-
-            if next_cost == 0:
-                next_cost = now_ms + 24*60*60*1000
-                cur.execute("""
-                    UPDATE user_machines
-                    SET next_cost_time=?
-                    WHERE user_id=? AND id=?
-                """, (next_cost, user_id, amp_id))
-                conn.commit()
-
-            cost = 2 * level
-            if is_offline == 0:
-                while next_cost <= now_ms:
-                    if energy_val >= cost:
-                        energy_val -= cost
-                        set_resource_amount(cur, user_id, 'energy', energy_val)
-                        next_cost += 24*60*60*1000
-                    else:
-                        is_offline = 1
-                        cur.execute("""
-                            UPDATE user_machines
-                            SET is_offline=1
-                            WHERE user_id=? AND id=?
-                        """, (user_id, amp_id))
-                        conn.commit()
-                        break
-            else:
-                if next_cost <= now_ms:
-                    if energy_val >= cost:
-                        energy_val -= cost
-                        set_resource_amount(cur, user_id, 'energy', energy_val)
-                        next_cost = now_ms + 24*60*60*1000
-                        is_offline = 0
-                        cur.execute("""
-                            UPDATE user_machines
-                            SET is_offline=0, next_cost_time=?
-                            WHERE user_id=? AND id=?
-                        """, (next_cost, user_id, amp_id))
-                        conn.commit()
-                    else:
-                        pass
-
-            cur.execute("""
-                UPDATE user_machines
-                SET next_cost_time=?, is_offline=?
-                WHERE user_id=? AND id=?
-            """, (next_cost, is_offline, user_id, amp_id))
-            conn.commit()
+        # Closed-form upkeep; a single SELECT when no period has elapsed
+        return apply_amplifier_upkeep(conn, cur, user_id, int(time.time() * 1000))
     except Exception as e:
         print(f"Error in update_amplifiers_status: {e}")
         traceback.print_exc()
+        return False
         
 @app.route("/api/saveRadixAccount", methods=["POST"])
 def save_radix_account():
@@ -2334,7 +2083,6 @@ def save_radix_account():
             WHERE user_id = ?
         """, (account_address, user_id))
         
-        conn.commit()
         cur.close()
         conn.close()
         
@@ -2355,405 +2103,18 @@ def get_game_state():
         user_id = session['telegram_id']
         print(f"Fetching game state for user: {user_id}")
         
-        conn = get_db_connection()
-        cur = conn.cursor()
-
-        # Try to update amplifier status
-        try:
-            update_amplifiers_status(user_id, conn, cur)
-        except Exception as e:
-            print(f"Error updating amplifier status: {e}")
-            # Continue anyway
-
-        # Get tcorvax and seen_room_unlock flag
-        has_seen_room_column = True
-        try:
-            cur.execute("PRAGMA table_info(users)")
-            columns = [column[1] for column in cur.fetchall()]
-            has_seen_room_column = 'seen_room_unlock' in columns
-        except:
-            has_seen_room_column = False
-        
-        if has_seen_room_column:
-            cur.execute("SELECT corvax_count, seen_room_unlock FROM users WHERE user_id=?", (user_id,))
-        else:
-            cur.execute("SELECT corvax_count FROM users WHERE user_id=?", (user_id,))
-            
-        row = cur.fetchone()
-        tcorvax = row["corvax_count"] if row else 0
-        seen_room_unlock = row["seen_room_unlock"] if (row and has_seen_room_column) else 0
-
-        # Get other resources
-        catNips = get_or_create_resource(cur, user_id, 'catNips')
-        energy = get_or_create_resource(cur, user_id, 'energy')
-        eggs = get_or_create_resource(cur, user_id, 'eggs')
+        snapshot = cached_game_snapshot(user_id)
 
-        # Check if provisional_mint and room columns exist
-        has_provisional_mint = True
-        has_room_column = True
-        try:
-            cur.execute("PRAGMA table_info(user_machines)")
-            columns = [column[1] for column in cur.fetchall()]
-            has_provisional_mint = 'provisional_mint' in columns
-            has_room_column = 'room' in columns
-        except:
-            has_provisional_mint = False
-            has_room_column = False
-        
-        # Get machines with appropriate query
-        machines = []
-        try:
-            if has_provisional_mint and has_room_column:
-                print("Querying with provisional_mint and room columns")
-                cur.execute("""
-                    SELECT id, machine_type, x, y, level, last_activated, is_offline, provisional_mint, room
-                    FROM user_machines
-                    WHERE user_id=?
-                """, (user_id,))
-            elif has_provisional_mint:
-                print("Querying with provisional_mint column")
-                cur.execute("""
-                    SELECT id, machine_type, x, y, level, last_activated, is_offline, provisional_mint
-                    FROM user_machines
-                    WHERE user_id=?
-                """, (user_id,))
-            else:
-                print("Querying without provisional_mint column")
-                cur.execute("""
-                    SELECT id, machine_type, x, y, level, last_activated, is_offline
-                    FROM user_machines
-                    WHERE user_id=?
-                """, (user_id,))
-                
-            rows = cur.fetchall()
-            for row in rows:
-                # Convert SQLite row to Python dict
-                machine = dict(row)
-                
-                # Prepare proper JSON object
-                machine_dict = {
-                    "id": machine["id"],
-                    "type": machine["machine_type"],
-                    "x": machine["x"],
-                    "y": machine["y"],
-                    "level": machine["level"],
-                    "lastActivated": machine["last_activated"],
-                    "isOffline": machine["is_offline"]
-                }
-                
-                # Add provisional_mint if available
-                if "provisional_mint" in machine:
-                    machine_dict["provisionalMint"] = machine["provisional_mint"]
-                else:
-                    machine_dict["provisionalMint"] = 0
-                
-                # Add room information if available
-                if "room" in machine:
-                    machine_dict["room"] = machine["room"]
-                else:
-                    machine_dict["room"] = 1  # Default to room 1
-                    
-                machines.append(machine_dict)
-            
-        except Exception as e:
-            print(f"Error fetching machines: {e}")
-            traceback.print_exc()
-
-        # Get count of machines by type to determine if second room is unlocked
-        room_unlocked = 1  # Default to 1 room
+        print(f"Returning game state with {len(snapshot['machines'])} machines, "
+              f"{snapshot['rooms_unlocked']} rooms unlocked, {len(snapshot['pets'])} pets")
         
-        # Check machine counts to determine if room 2 is unlocked
-        cur.execute("""
-            SELECT machine_type, COUNT(*) as count
-            FROM user_machines
-            WHERE user_id=?
-            GROUP BY machine_type
-        """, (user_id,))
-        
-        machine_counts = {}
-        for row in cur.fetchall():
-            machine_counts[row['machine_type']] = row['count']
-        
-        # Room 2 unlocks when player has built 2 cat lairs, 2 reactors, and 1 amplifier
-        cat_lair_count = machine_counts.get('catLair', 0)
-        reactor_count = machine_counts.get('reactor', 0)
-        amplifier_count = machine_counts.get('amplifier', 0)
-        
-        if cat_lair_count >= 2 and reactor_count >= 2 and amplifier_count >= 1:
-            room_unlocked = 2
-
-        # Get pets (NEW)
-        pets = []
-        try:
-            cur.execute("""
-                SELECT id, x, y, room, type, parent_machine
-                FROM pets
-                WHERE user_id=?
-            """, (user_id,))
-            
-            rows = cur.fetchall()
-            for row in rows:
-                pet = {
-                    "id": row["id"],
-                    "x": row["x"],
-                    "y": row["y"],
-                    "room": row["room"],
-                    "type": row["type"],
-                    "parentMachine": row["parent_machine"]
-                }
-                pets.append(pet)
-                
-        except Exception as e:
-            print(f"Error fetching pets: {e}")
-            traceback.print_exc()
-        
-        cur.close()
-        conn.close()
-        
-        print(f"Returning game state with {len(machines)} machines, {room_unlocked} rooms unlocked, {len(pets)} pets")
-        
-        # Return with seen_room_unlock and eggs values
-        return jsonify({
-            "tcorvax": float(tcorvax),
-            "catNips": float(catNips),
-            "energy": float(energy),
-            "eggs": float(eggs),
-            "machines": machines,
-            "roomsUnlocked": room_unlocked,
-            "seenRoomUnlock": seen_room_unlock,
-            "pets": pets  # Add pets to the response
-        })
+        return jsonify(game_state_json(snapshot))
         
     except Exception as e:
         print(f"Error in get_game_state: {e}")
         traceback.print_exc()
         return jsonify({"error": f"Server error: {str(e)}"}), 500
 
-def build_cost(machine_type, how_many_already, user_id=None):
-    try:
-        if machine_type == "catLair":
-            if how_many_already == 0:
-                return {"tcorvax": 10}
-            elif how_many_already == 1:
-                return {"tcorvax": 40}
-            else:
-                return None
-
-        elif machine_type == "reactor":
-            if how_many_already == 0:
-                return {"tcorvax": 10, "catNips": 10}
-            elif how_many_already == 1:
-                return {"tcorvax": 40, "catNips": 40}
-            elif how_many_already == 2 and user_id is not None:
-                # Check if user can build third reactor
-                conn = get_db_connection()
-                cur = conn.cursor()
-                can_build = can_build_third_reactor(cur, user_id)
-                cur.close()
-                conn.close()
-                
-                if can_build:
-                    return {"tcorvax": 640, "catNips": 640}
-                else:
-                    return None
-            else:
-                return None
-
-        elif machine_type == "amplifier":
-            if how_many_already == 0:
-                return {"tcorvax": 10, "catNips": 10, "energy": 10}
-            else:
-                return None
-                
-        elif machine_type == "incubator":
-            if how_many_already == 0:
-                return {"tcorvax": 320, "catNips": 320, "energy": 320}
-            else:
-                return None
-        
-        # Updated FomoHit machine costs
-        elif machine_type == "fomoHit":
-            if how_many_already == 0:
-                return {"tcorvax": 640, "catNips": 640, "energy": 640}  # Updated cost
-            else:
-                return None
-
-        return None
-    except Exception as e:
-        print(f"Error in build_cost: {e}")
-        traceback.print_exc()
-        return None
-
-def is_second_machine(cur, user_id, machine_type, machine_id):
-    try:
-        cur.execute("""
-            SELECT id FROM user_machines
-            WHERE user_id=? AND machine_type=?
-            ORDER BY id
-        """, (user_id, machine_type))
-        machine_ids = [row["id"] for row in cur.fetchall()]
-        if machine_id not in machine_ids:
-            return False
-        index = machine_ids.index(machine_id)
-        return (index == 1)
-    except Exception as e:
-        print(f"Error in is_second_machine: {e}")
-        traceback.print_exc()
-        return False
-
-def are_first_machine_lvl3(cur, user_id, mtype):
-    try:
-        cur.execute("""
-            SELECT level FROM user_machines
-            WHERE user_id=? AND machine_type=?
-            ORDER BY id
-            LIMIT 1
-        """, (user_id, mtype))
-        r = cur.fetchone()
-        if r and r["level"] >= 3:
-            return True
-        return False
-    except Exception as e:
-        print(f"Error in are_first_machine_lvl3: {e}")
-        traceback.print_exc()
-        return False
-
-def are_two_machines_lvl3(cur, user_id, mtype):
-    try:
-        cur.execute("""
-            SELECT level FROM user_machines
-            WHERE user_id=? AND machine_type=?
-            ORDER BY id
-        """, (user_id, mtype))
-        rows = cur.fetchall()
-        if len(rows) < 2:
-            return False
-        if rows[0]["level"] >=3 and rows[1]["level"] >=3:
-            return True
-        return False
-    except Exception as e:
-        print(f"Error in are_two_machines_lvl3: {e}")
-        traceback.print_exc()
-        return False
-
-def check_amplifier_gating(cur, user_id, next_level):
-    try:
-        if next_level == 4:
-            if not are_first_machine_lvl3(cur, user_id, "catLair"):
-                return False
-            if not are_first_machine_lvl3(cur, user_id, "reactor"):
-                return False
-            return True
-        elif next_level == 5:
-            if not are_two_machines_lvl3(cur, user_id, "catLair"):
-                return False
-            if not are_two_machines_lvl3(cur, user_id, "reactor"):
-                return False
-            return True
-        return True
-    except Exception as e:
-        print(f"Error in check_amplifier_gating: {e}")
-        traceback.print_exc()
-        return False
-
-def can_build_incubator(cur, user_id):
-    try:
-        cur.execute("""
-            SELECT COUNT(*) FROM user_machines
-            WHERE user_id=? AND machine_type='catLair'
-        """, (user_id,))
-        total_cat_lairs = cur.fetchone()[0]
-        if total_cat_lairs == 0:
-            return False
-        cur.execute("""
-            SELECT COUNT(*) FROM user_machines
-            WHERE user_id=? AND machine_type='catLair' AND level=3
-        """, (user_id,))
-        max_level_cat_lairs = cur.fetchone()[0]
-        if max_level_cat_lairs < total_cat_lairs:
-            return False
-
-        cur.execute("""
-            SELECT COUNT(*) FROM user_machines
-            WHERE user_id=? AND machine_type='reactor'
-        """, (user_id,))
-        total_reactors = cur.fetchone()[0]
-        if total_reactors == 0:
-            return False
-        cur.execute("""
-            SELECT COUNT(*) FROM user_machines
-            WHERE user_id=? AND machine_type='reactor' AND level=3
-        """, (user_id,))
-        max_level_reactors = cur.fetchone()[0]
-        if max_level_reactors < total_reactors:
-            return False
-
-        cur.execute("""
-            SELECT COUNT(*) FROM user_machines
-            WHERE user_id=? AND machine_type='amplifier' AND level=5
-        """, (user_id,))
-        max_level_amplifier = cur.fetchone()[0]
-        if max_level_amplifier == 0:
-            return False
-
-        return True
-    except Exception as e:
-        print(f"Error in can_build_incubator: {e}")
-        traceback.print_exc()
-        return False
-
-def upgrade_cost(cur, user_id, machine_type, current_level, machine_id):
-    try:
-        next_level = current_level + 1
-        if machine_type in ("catLair","reactor"):
-            if next_level > 3:
-                return None
-        elif machine_type == "amplifier":
-            if next_level > 5:
-                return None
-            if not check_amplifier_gating(cur, user_id, next_level):
-                return None
-        # Add support for incubator level 2
-        elif machine_type == "incubator":
-            if next_level > 2:  # Max level 2
-                return None
-        else:
-            return None
-
-        if machine_type == "amplifier":
-            if not check_amplifier_gating(cur, user_id, next_level):
-                return None
-
-        if machine_type == "catLair":
-            base_for_level1 = {"tcorvax": 10}
-        elif machine_type == "reactor":
-            base_for_level1 = {"tcorvax": 10, "catNips": 10}
-        elif machine_type == "amplifier":
-            base_for_level1 = {"tcorvax": 10, "catNips": 10, "energy": 10}
-        elif machine_type == "incubator":
-            # Set base cost for incubator upgrade - note that this is double the original build cost of 320
-            # Ensuring frontend and backend match on this value (640)
-            base_for_level1 = {"tcorvax": 640, "catNips": 640, "energy": 640}
-            # Return cost directly for incubator without additional multipliers
-            return base_for_level1
-        else:
-            return None
-
-        second = is_second_machine(cur, user_id, machine_type, machine_id)
-        mult = 2 ** (next_level - 1)
-        cost_out = {}
-        for res, val in base_for_level1.items():
-            c = val * mult
-            if second and (machine_type in ["catLair","reactor"]):
-                c *= 4
-            cost_out[res] = c
-
-        return cost_out
-    except Exception as e:
-        print(f"Error in upgrade_cost: {e}")
-        traceback.print_exc()
-        return None
-    
 # Add these functions to app.py after process_creature_data
 
 def process_tool_data(nft_id: str, pj_raw) -> dict:
@@ -2887,35 +2248,17 @@ def get_user_items():
             print(f"No Radix account address found for user {user_id}")
             return jsonify({"tools": [], "spells": []})
         
-        # Fetch tool NFTs
-        print(f"Fetching tool NFT IDs for account: {account_address}")
-        tool_ids = get_account_nfids(account_address, TOOL_NFT_RESOURCE)
+        # Fetch tool and spell NFTs concurrently (NFIDs may be up to
+        # NFID_CACHE_TTL old)
+        print(f"Fetching tool and spell NFTs for account: {account_address}")
+        tool_data_map, spell_data_map = gateway_async.run(
+            fetch_user_items_async(account_address, use_cache=True)
+        )
         
-        if tool_ids:
-            print(f"Found {len(tool_ids)} tool NFTs")
-            tool_data_map = fetch_nft_data(TOOL_NFT_RESOURCE, tool_ids)
-            tools = []
-            
-            for nft_id, raw_data in tool_data_map.items():
-                processed_data = process_tool_data(nft_id, raw_data)
-                tools.append(processed_data)
-        else:
-            tools = []
-            
-        # Fetch spell NFTs
-        print(f"Fetching spell NFT IDs for account: {account_address}")
-        spell_ids = get_account_nfids(account_address, SPELL_NFT_RESOURCE)
-        
-        if spell_ids:
-            print(f"Found {len(spell_ids)} spell NFTs")
-            spell_data_map = fetch_nft_data(SPELL_NFT_RESOURCE, spell_ids)
-            spells = []
-            
-            for nft_id, raw_data in spell_data_map.items():
-                processed_data = process_spell_data(nft_id, raw_data)
-                spells.append(processed_data)
-        else:
-            spells = []
+        tools = [process_tool_data(nft_id, raw_data)
+                 for nft_id, raw_data in tool_data_map.items()]
+        spells = [process_spell_data(nft_id, raw_data)
+                  for nft_id, raw_data in spell_data_map.items()]
             
         return jsonify({"tools": tools, "spells": spells})
         
@@ -2941,7 +2284,6 @@ def dismiss_room_unlock():
             WHERE user_id=?
         """, (user_id,))
         
-        conn.commit()
         cur.close()
         conn.close()
 
@@ -2951,6 +2293,16 @@ def dismiss_room_unlock():
         traceback.print_exc()
         return jsonify({"error": f"Server error: {str(e)}"}), 500
 
+# Serialized once; the catalog only changes with a restart
+MACHINE_CATALOG_JSON = MACHINE_CATALOG.to_json()
+
+@app.route("/api/machineCatalog", methods=["GET"])
+def machine_catalog():
+    # Static between deploys, so clients may cache it
+    response = jsonify(MACHINE_CATALOG_JSON)
+    response.headers["Cache-Control"] = "public, max-age=3600"
+    return response
+
 @app.route("/api/buildMachine", methods=["POST"])
 def build_machine():
     try:
@@ -2963,7 +2315,7 @@ def build_machine():
         y_coord = data.get("y", 0)
         room = data.get("room", 1)  # Default to room 1 if not specified
         
-        print(f"=== BUILD MACHINE REQUEST ===")
+        print("=== BUILD MACHINE REQUEST ===")
         print(f"Machine type: {machine_type}")
         print(f"Coordinates: x={x_coord}, y={y_coord}")
         print(f"Room: {room}")
@@ -2974,78 +2326,28 @@ def build_machine():
 
         update_amplifiers_status(user_id, conn, cur)
 
-        cur.execute("""
-            SELECT COUNT(*) FROM user_machines
-            WHERE user_id=? AND machine_type=?
-        """, (user_id, machine_type))
-        how_many = cur.fetchone()[0]
+        # Every gating check below runs against this one SELECT
+        inventory = MachineInventory.load(cur, user_id)
+        how_many = inventory.count(machine_type)
         print(f"Existing machines of type {machine_type}: {how_many}")
 
-        cost_dict = build_cost(machine_type, how_many, user_id)
-        if cost_dict is None:
+        rule = MACHINE_CATALOG.build_rule(machine_type, how_many)
+        if rule is None:
             print(f"Cannot build more machines of type {machine_type}")
             cur.close()
             conn.close()
             return jsonify({"error": "Cannot build more of this machine type."}), 400
 
-        # Add special prerequisite checks with detailed logging
-        if machine_type == "incubator":
-            can_build = can_build_incubator(cur, user_id)
-            print(f"Can build incubator check: {can_build}")
-            if not can_build:
-                cur.close()
-                conn.close()
-                return jsonify({"error": "All machines must be at max level to build Incubator."}), 400
-        
-        # Add check for fomoHit prerequisites with simplified requirements
-        elif machine_type == "fomoHit":
-            print("Checking FOMO HIT prerequisites...")
-            
-            # Check if user has at least one of each required machine type
-            required_types = ['catLair', 'reactor', 'amplifier', 'incubator']
-            for req_type in required_types:
-                cur.execute("""
-                    SELECT COUNT(*) FROM user_machines
-                    WHERE user_id=? AND machine_type=?
-                """, (user_id, req_type))
-                count = cur.fetchone()[0]
-                print(f"  - Has {req_type}: {count > 0}")
-                if count == 0:
-                    cur.close()
-                    conn.close()
-                    return jsonify({"error": f"Must build {req_type} first."}), 400
-                    
-            print("All FOMO HIT prerequisites satisfied")
-            
-        # Add check for third reactor
-        elif machine_type == "reactor" and how_many == 2:
-            if not can_build_third_reactor(cur, user_id):
-                cur.close()
-                conn.close()
-                return jsonify({"error": "You need to build both Incubator and FOMO HIT before building a third Reactor."}), 400
-
-        # Check resource costs
-        cur.execute("SELECT corvax_count FROM users WHERE user_id=?", (user_id,))
-        row = cur.fetchone()
-        if not row:
+        # Prerequisites (incubator, fomoHit, third reactor) come with the rule
+        unmet = rule.unmet(inventory)
+        if unmet:
+            print(f"Prerequisite not met for {machine_type}: {unmet}")
             cur.close()
             conn.close()
-            return jsonify({"error": "User not found"}), 404
-            
-        tcorvax_val = float(row["corvax_count"])
-        catNips_val = float(get_or_create_resource(cur, user_id, 'catNips'))
-        energy_val  = float(get_or_create_resource(cur, user_id, 'energy'))
-        
-        print(f"Resources - TCorvax: {tcorvax_val}, CatNips: {catNips_val}, Energy: {energy_val}")
-        print(f"Cost - {cost_dict}")
+            return jsonify({"error": rule.error_for(unmet)}), 400
+        cost_dict = rule.cost
 
-        if (tcorvax_val < cost_dict.get("tcorvax",0) or
-            catNips_val < cost_dict.get("catNips",0) or
-            energy_val < cost_dict.get("energy",0)):
-            print("Not enough resources")
-            cur.close()
-            conn.close()
-            return jsonify({"error": "Not enough resources"}), 400
+        print(f"Cost - {cost_dict}")
 
         machine_size = 128
         max_x = 800 - machine_size
@@ -3056,87 +2358,35 @@ def build_machine():
             return jsonify({"error": "Cannot build outside map boundaries."}), 400
 
         # Check for collision with other machines IN THE SAME ROOM
-        cur.execute("SELECT x, y, room FROM user_machines WHERE user_id=?", (user_id,))
-        all_m = cur.fetchall()
-        for m in all_m:
-            # Only check collision if in the same room
-            if m["room"] == room:
-                dx = abs(m["x"] - x_coord)
-                dy = abs(m["y"] - y_coord)
-                if dx < machine_size and dy < machine_size:
-                    cur.close()
-                    conn.close()
-                    return jsonify({"error": "Cannot build here!"}), 400
-
-        tcorvax_val -= cost_dict.get("tcorvax",0)
-        catNips_val -= cost_dict.get("catNips",0)
-        energy_val  -= cost_dict.get("energy",0)
-
-        cur.execute("""
-            UPDATE users SET corvax_count=?
-            WHERE user_id=?
-        """, (tcorvax_val, user_id))
-        set_resource_amount(cur, user_id, 'catNips', catNips_val)
-        set_resource_amount(cur, user_id, 'energy', energy_val)
+        if inventory.collides(x_coord, y_coord, room, machine_size):
+            cur.close()
+            conn.close()
+            return jsonify({"error": "Cannot build here!"}), 400
 
-        is_offline = 1 if machine_type == "incubator" else 0
-        
-        # Check if both provisional_mint and room columns exist
-        has_provisional_mint = True
-        has_room_column = True
-        try:
-            cur.execute("PRAGMA table_info(user_machines)")
-            columns = [column[1] for column in cursor.fetchall()]
-            has_provisional_mint = 'provisional_mint' in columns
-            has_room_column = 'room' in columns
-        except:
-            has_provisional_mint = False
-            has_room_column = False
-            
-        # Insert with appropriate columns
-        if has_provisional_mint and has_room_column:
-            cur.execute("""
-                INSERT INTO user_machines
-                (user_id, machine_type, x, y, level, last_activated, is_offline, next_cost_time, provisional_mint, room)
-                VALUES (?, ?, ?, ?, 1, 0, ?, 0, 0, ?)
-            """, (user_id, machine_type, x_coord, y_coord, is_offline, room))
-        elif has_provisional_mint:
-            cur.execute("""
-                INSERT INTO user_machines
-                (user_id, machine_type, x, y, level, last_activated, is_offline, next_cost_time, provisional_mint)
-                VALUES (?, ?, ?, ?, 1, 0, ?, 0, 0)
-            """, (user_id, machine_type, x_coord, y_coord, is_offline))
-        else:
-            cur.execute("""
-                INSERT INTO user_machines
-                (user_id, machine_type, x, y, level, last_activated, is_offline, next_cost_time)
-                VALUES (?, ?, ?, ?, 1, 0, ?, 0)
-            """, (user_id, machine_type, x_coord, y_coord, is_offline))
+        # Deduct the whole cost only if every resource covers it
+        if not debit_if_sufficient(cur, user_id, cost_dict):
+            print("Not enough resources")
+            cur.close()
+            conn.close()
+            return jsonify({"error": "Not enough resources"}), 400
 
-        conn.commit()
-        
-        # Check if room 2 is newly unlocked
-        room_unlocked = 1
-        
-        # Count machines by type
-        cur.execute("""
-            SELECT machine_type, COUNT(*) as count
-            FROM user_machines
-            WHERE user_id=?
-            GROUP BY machine_type
-        """, (user_id,))
-        
-        machine_counts = {}
-        for row in cur.fetchall():
-            machine_counts[row['machine_type']] = row['count']
-        
-        # Room 2 unlocks when player has built 2 cat lairs, 2 reactors, and 1 amplifier
-        cat_lair_count = machine_counts.get('catLair', 0)
-        reactor_count = machine_counts.get('reactor', 0)
-        amplifier_count = machine_counts.get('amplifier', 0)
+        balances = get_balances(cur, user_id, (TCORVAX, "catNips", "energy"))
+        tcorvax_val = balances[TCORVAX]
+        catNips_val = balances["catNips"]
+        energy_val  = balances["energy"]
+
+        is_offline = 1 if machine_type == "incubator" else 0
         
-        if cat_lair_count >= 2 and reactor_count >= 2 and amplifier_count >= 1:
-            room_unlocked = 2
+        # Insert with the columns this schema has
+        cur.execute(schema.insert_machine,
+                    (user_id, machine_type, x_coord, y_coord, is_offline)
+                    + schema.room_param(room))
+
+
+        # Check if room 2 is newly unlocked (counts include the new machine)
+        machine_counts = inventory.counts()
+        machine_counts[machine_type] = how_many + 1
+        room_unlocked = rooms_unlocked(machine_counts)
             
         print(f"Machine built successfully, rooms unlocked: {room_unlocked}")
         cur.close()
@@ -3230,13 +2480,12 @@ def move_machine():
                     conn.close()
                     return jsonify({"error": "Cannot move here due to collision with another machine!"}), 400
 
-        # Deduct TCorvax cost
-        tcorvax_val -= movement_cost
-        cur.execute("""
-            UPDATE users
-            SET corvax_count=?
-            WHERE user_id=?
-        """, (tcorvax_val, user_id))
+        # Deduct TCorvax cost (re-checked atomically)
+        if not debit_if_sufficient(cur, user_id, {TCORVAX: movement_cost}):
+            cur.close()
+            conn.close()
+            return jsonify({"error": "Not enough TCorvax (50 required)"}), 400
+        tcorvax_val = float(get_resource(cur, user_id, TCORVAX))
 
         # Update machine position and room
         cur.execute("""
@@ -3245,7 +2494,6 @@ def move_machine():
             WHERE user_id=? AND id=?
         """, (new_x, new_y, new_room, user_id, machine_id))
 
-        conn.commit()
         cur.close()
         conn.close()
 
@@ -3283,12 +2531,9 @@ def upgrade_machine():
 
         update_amplifiers_status(user_id, conn, cur)
 
-        cur.execute("""
-            SELECT id, machine_type, level
-            FROM user_machines
-            WHERE user_id=? AND id=?
-        """, (user_id, machine_id))
-        row = cur.fetchone()
+        # The machine and every gating check come from this one SELECT
+        inventory = MachineInventory.load(cur, user_id)
+        row = inventory.get(machine_id)
         if not row:
             cur.close()
             conn.close()
@@ -3297,26 +2542,15 @@ def upgrade_machine():
         machine_type = row["machine_type"]
         current_level = row["level"]
 
-        cost_dict = upgrade_cost(cur, user_id, machine_type, current_level, machine_id)
-        if cost_dict is None:
+        second = inventory.position(machine_type, row["id"]) == 1
+        rule = MACHINE_CATALOG.upgrade_rule(machine_type, current_level + 1, second)
+        if rule is None or rule.unmet(inventory):
             cur.close()
             conn.close()
             return jsonify({"error": "Cannot upgrade further or gating not met."}), 400
 
-        cur.execute("SELECT corvax_count FROM users WHERE user_id=?", (user_id,))
-        urow = cur.fetchone()
-        if not urow:
-            cur.close()
-            conn.close()
-            return jsonify({"error": "User not found"}), 404
-
-        tcorvax_val = float(urow["corvax_count"])
-        catNips_val = float(get_or_create_resource(cur, user_id, 'catNips'))
-        energy_val  = float(get_or_create_resource(cur, user_id, 'energy'))
-
-        if (tcorvax_val < cost_dict.get("tcorvax",0) or
-            catNips_val < cost_dict.get("catNips",0) or
-            energy_val < cost_dict.get("energy",0)):
+        # Deduct the whole cost only if every resource covers it
+        if not debit_if_sufficient(cur, user_id, rule.cost):
             cur.close()
             conn.close()
             return jsonify({"error": "Not enough resources"}), 400
@@ -3328,19 +2562,11 @@ def upgrade_machine():
             WHERE user_id=? AND id=?
         """, (new_level, user_id, machine_id))
 
-        tcorvax_val -= cost_dict.get("tcorvax",0)
-        catNips_val -= cost_dict.get("catNips",0)
-        energy_val  -= cost_dict.get("energy",0)
-
-        cur.execute("""
-            UPDATE users
-            SET corvax_count=?
-            WHERE user_id=?
-        """, (tcorvax_val, user_id))
-        set_resource_amount(cur, user_id, 'catNips', catNips_val)
-        set_resource_amount(cur, user_id, 'energy', energy_val)
+        balances = get_balances(cur, user_id, (TCORVAX, "catNips", "energy"))
+        tcorvax_val = balances[TCORVAX]
+        catNips_val = balances["catNips"]
+        energy_val  = balances["energy"]
 
-        conn.commit()
         cur.close()
         conn.close()
 
@@ -3381,16 +2607,7 @@ def check_mint_status():
             conn = get_db_connection()
             cur = conn.cursor()
             
-            # Check if provisional_mint column exists
-            has_provisional_mint = True
-            try:
-                cur.execute("PRAGMA table_info(user_machines)")
-                columns = [column[1] for column in cur.fetchall()]
-                has_provisional_mint = 'provisional_mint' in columns
-            except:
-                has_provisional_mint = False
-                
-            if has_provisional_mint:
+            if schema.has_provisional_mint:
                 try:
                     # Update the machine to show successful mint
                     cur.execute("""
@@ -3398,7 +2615,6 @@ def check_mint_status():
                         SET provisional_mint=0
                         WHERE user_id=? AND id=?
                     """, (user_id, machine_id))
-                    conn.commit()
                 except Exception as e:
                     print(f"Error updating provisional_mint: {e}")
             
@@ -3414,6 +2630,44 @@ def check_mint_status():
         traceback.print_exc()
         return jsonify({"error": f"Server error: {str(e)}"}), 500
 
+@app.route("/api/readyMachines", methods=["GET"])
+def ready_machines():
+    try:
+        if 'telegram_id' not in session:
+            return jsonify({"error": "Not logged in"}), 401
+
+        user_id = session['telegram_id']
+        conn = get_db_connection()
+        cur = conn.cursor()
+
+        cur.execute(schema.select_ready_machines, (user_id, int(time.time()*1000)))
+        ready = [{"id": r["id"], "type": r["machine_type"], "room": r["room"]}
+                 for r in cur.fetchall()]
+
+        cur.close()
+        conn.close()
+
+        return jsonify({"machines": ready})
+    except Exception as e:
+        print(f"Error in ready_machines: {e}")
+        traceback.print_exc()
+        return jsonify({"error": "Server error"}), 500
+
+def claim_activation(cur, user_id, machine_id, now_ms):
+    """
+    Start `machine_id`'s cooldown if it has finished, in one statement, so
+    two concurrent activations cannot both be credited.  Returns True if
+    this request won the activation.
+    """
+    cur.execute(schema.claim_activation,
+                (now_ms, now_ms + MACHINE_COOLDOWN_MS, user_id, machine_id, now_ms))
+    return cur.rowcount == 1
+
+def cooldown_response(cur, conn):
+    cur.close()
+    conn.close()
+    return jsonify({"error": "Cooldown not finished"}), 400
+
 @app.route("/api/activateMachine", methods=["POST"])
 def activate_machine():
     try:
@@ -3421,7 +2675,7 @@ def activate_machine():
             return jsonify({"error": "Not logged in"}), 401
 
         # Log the incoming request for debugging
-        print(f"=== ACTIVATE MACHINE REQUEST ===")
+        print("=== ACTIVATE MACHINE REQUEST ===")
         try:
             data = request.get_json(silent=True) or {}
             print(f"Request data: {json.dumps(data, indent=2)}")
@@ -3438,32 +2692,31 @@ def activate_machine():
         conn = get_db_connection()
         cur = conn.cursor()
 
+        # Cooldown guard first, so a click on a cooling machine costs one
+        # indexed statement
+        now_ms = int(time.time()*1000)
+        cur.execute(schema.select_machine_cooldown, (user_id, machine_id))
+        row = cur.fetchone()
+        if not row:
+            cur.close()
+            conn.close()
+            return jsonify({"error": "Machine not found"}), 404
+        next_available_at = row["next_available_at"] or 0
+        if next_available_at > now_ms:
+            cur.close()
+            conn.close()
+            return jsonify({"error":"Cooldown not finished",
+                            "remainingMs":next_available_at - now_ms}), 400
+
+        # Gateway lookups happen before upkeep may take the write lock
+        staked_cvx = 0
+        if row["machine_type"] == "incubator":
+            staked_cvx = incubator_scvx_balance(data.get("accountAddress"))
+
         update_amplifiers_status(user_id, conn, cur)
 
-        # Check if the provisional_mint column exists
-        has_provisional_mint = True
-        try:
-            cur.execute("PRAGMA table_info(user_machines)")
-            columns = [column[1] for column in cur.fetchall()]
-            has_provisional_mint = 'provisional_mint' in columns
-        except:
-            has_provisional_mint = False
-            
-        # Build the query based on column existence
-        if has_provisional_mint:
-            query = """
-                SELECT machine_type, level, last_activated, is_offline, provisional_mint, room
-                FROM user_machines
-                WHERE user_id=? AND id=?
-            """
-        else:
-            query = """
-                SELECT machine_type, level, last_activated, is_offline, room
-                FROM user_machines
-                WHERE user_id=? AND id=?
-            """
-            
-        cur.execute(query, (user_id, machine_id))
+        has_provisional_mint = schema.has_provisional_mint
+        cur.execute(schema.select_machine, (user_id, machine_id))
         row = cur.fetchone()
         if not row:
             cur.close()
@@ -3477,29 +2730,6 @@ def activate_machine():
         machine_level = machine_data["level"]
         last_activated = machine_data["last_activated"] or 0
         is_offline = machine_data["is_offline"]
-        provisional_mint = machine_data.get("provisional_mint", 0) if has_provisional_mint else 0
-        room = machine_data.get("room", 1)  # Default to room 1 if not present
-
-        COOL_MS = 3600*1000
-        now_ms = int(time.time()*1000)
-        elapsed = now_ms - last_activated
-        if elapsed < COOL_MS:
-            remain = COOL_MS - elapsed
-            cur.close()
-            conn.close()
-            return jsonify({"error":"Cooldown not finished","remainingMs":remain}), 400
-
-        cur.execute("SELECT corvax_count FROM users WHERE user_id=?", (user_id,))
-        urow = cur.fetchone()
-        if not urow:
-            cur.close()
-            conn.close()
-            return jsonify({"error":"User not found"}), 404
-
-        tcorvax_val = float(urow["corvax_count"])
-        catNips_val = float(get_or_create_resource(cur, user_id, 'catNips'))
-        energy_val = float(get_or_create_resource(cur, user_id, 'energy'))
-        eggs_val = float(get_or_create_resource(cur, user_id, 'eggs'))
 
         if machine_type == "amplifier":
             status = "Online" if is_offline==0 else "Offline"
@@ -3511,61 +2741,26 @@ def activate_machine():
             if last_activated == 0:
                 print("First incubator activation - setting online and checking sCVX rewards")
                 
-                # Get account address from request
-                account_address = data.get("accountAddress")
-                print(f"Got account address from request: {account_address}")
-                
-                # Ensure we have an account address
-                if not account_address:
-                    print("No account address provided for sCVX lookup")
-                    staked_cvx = 0
-                else:
-                    print(f"Fetching sCVX for account: {account_address}")
-                    # Use the server-side fetch function
-                    staked_cvx = fetch_scvx_balance(account_address)
-                    
                 print(f"Final sCVX value: {staked_cvx}")
                 
                 # Calculate rewards based on level
-                machine_level = machine_level or 1
-                
-                # Base reward (level 1): 1 token per 100 sCVX, max 10
-                base_reward = min(10, int(staked_cvx // 100))
-                
-                # Bonus reward (level 2): additional 1 token per 1000 sCVX, no max
-                bonus_reward = 0
-                if machine_level >= 2:
-                    bonus_reward = int(staked_cvx // 1000)
-                
+                base_reward, bonus_reward, eggs_reward = incubator_rewards(staked_cvx, machine_level)
                 total_reward = base_reward + bonus_reward
                 
-                # Award eggs (1 egg per 500 sCVX)
-                eggs_reward = int(staked_cvx // 500)
-                
-                # Update resources
-                tcorvax_val += total_reward
-                eggs_val += eggs_reward
-                
                 print(f"sCVX rewards calculated: Base {base_reward}, Bonus {bonus_reward}, Eggs {eggs_reward}")
 
-                # Update user's resources
-                cur.execute("""
-                    UPDATE users
-                    SET corvax_count=?
-                    WHERE user_id=?
-                """, (tcorvax_val, user_id))
-                
-                # Update eggs resource
-                set_resource_amount(cur, user_id, 'eggs', eggs_val)
+                # Claim the activation, then credit rewards in place
+                if not claim_activation(cur, user_id, machine_id, now_ms):
+                    return cooldown_response(cur, conn)
+                apply_changes(cur, user_id, {TCORVAX: total_reward, "eggs": eggs_reward})
 
-                # Set incubator to online and update activation time
+                # Set incubator to online
                 cur.execute("""
-                    UPDATE user_machines
-                    SET is_offline=0, last_activated=?
+                    UPDATE user_machines SET is_offline=0
                     WHERE user_id=? AND id=?
-                """, (now_ms, user_id, machine_id))
+                """, (user_id, machine_id))
 
-                conn.commit()
+                balances = get_balances(cur, user_id)
                 cur.close()
                 conn.close()
 
@@ -3580,66 +2775,27 @@ def activate_machine():
                     "bonusReward": bonus_reward,
                     "eggsReward": eggs_reward,
                     "updatedResources": {
-                        "tcorvax": tcorvax_val,
-                        "catNips": catNips_val,
-                        "energy": energy_val,
-                        "eggs": eggs_val
+                        "tcorvax": balances[TCORVAX],
+                        "catNips": balances["catNips"],
+                        "energy": balances["energy"],
+                        "eggs": balances["eggs"]
                     }
                 })
             else:
-                # Get account address from request
-                account_address = data.get("accountAddress")
-                print(f"Got account address from request: {account_address}")
-                
-                # Ensure we have an account address
-                if not account_address:
-                    print("No account address provided for sCVX lookup")
-                    staked_cvx = 0
-                else:
-                    print(f"Fetching sCVX for account: {account_address}")
-                    # Use the server-side fetch function
-                    staked_cvx = fetch_scvx_balance(account_address)
-                    
                 print(f"Final sCVX value: {staked_cvx}")
                 
                 # Calculate rewards based on level
-                machine_level = machine_level or 1
-                
-                # Base reward (level 1): 1 token per 100 sCVX, max 10
-                base_reward = min(10, int(staked_cvx // 100))
-                
-                # Bonus reward (level 2): additional 1 token per 1000 sCVX, no max
-                bonus_reward = 0
-                if machine_level >= 2:
-                    bonus_reward = int(staked_cvx // 1000)
-                
+                base_reward, bonus_reward, eggs_reward = incubator_rewards(staked_cvx, machine_level)
                 total_reward = base_reward + bonus_reward
                 
-                # Award eggs (1 egg per 500 sCVX)
-                eggs_reward = int(staked_cvx // 500)
-                
-                # Update resources
-                tcorvax_val += total_reward
-                eggs_val += eggs_reward
-                
                 print(f"sCVX rewards calculated: Base {base_reward}, Bonus {bonus_reward}, Eggs {eggs_reward}")
 
-                cur.execute("""
-                    UPDATE users
-                    SET corvax_count=?
-                    WHERE user_id=?
-                """, (tcorvax_val, user_id))
-                
-                # Update eggs resource
-                set_resource_amount(cur, user_id, 'eggs', eggs_val)
-
-                cur.execute("""
-                    UPDATE user_machines
-                    SET last_activated=?
-                    WHERE user_id=? AND id=?
-                """, (now_ms, user_id, machine_id))
+                # Claim the activation, then credit rewards in place
+                if not claim_activation(cur, user_id, machine_id, now_ms):
+                    return cooldown_response(cur, conn)
+                apply_changes(cur, user_id, {TCORVAX: total_reward, "eggs": eggs_reward})
 
-                conn.commit()
+                balances = get_balances(cur, user_id)
                 cur.close()
                 conn.close()
 
@@ -3653,10 +2809,10 @@ def activate_machine():
                     "bonusReward": bonus_reward,
                     "eggsReward": eggs_reward,
                     "updatedResources": {
-                        "tcorvax": tcorvax_val,
-                        "catNips": catNips_val,
-                        "energy": energy_val,
-                        "eggs": eggs_val
+                        "tcorvax": balances[TCORVAX],
+                        "catNips": balances["catNips"],
+                        "energy": balances["energy"],
+                        "eggs": balances["eggs"]
                     }
                 })
         
@@ -3676,29 +2832,22 @@ def activate_machine():
                     conn.close()
                     return jsonify({"error": "No wallet address provided"}), 400
                     
+                # Store current time as activation time (once per machine)
+                if not claim_activation(cur, user_id, machine_id, now_ms):
+                    return cooldown_response(cur, conn)
+
                 # Create the mint manifest
                 mint_manifest = create_nft_mint_manifest(account_address)
-                print(f"Created mint manifest")
+                print("Created mint manifest")
                 
                 # Set provisional mint status if the column exists
                 if has_provisional_mint:
-                    try:
-                        cur.execute("""
-                            UPDATE user_machines
-                            SET provisional_mint=1
-                            WHERE user_id=? AND id=?
-                        """, (user_id, machine_id))
-                    except sqlite3.OperationalError:
-                        print("Could not update provisional_mint (column missing)")
-                
-                # Store current time as activation time
-                cur.execute("""
-                    UPDATE user_machines
-                    SET last_activated=?
-                    WHERE user_id=? AND id=?
-                """, (now_ms, user_id, machine_id))
+                    cur.execute("""
+                        UPDATE user_machines
+                        SET provisional_mint=1
+                        WHERE user_id=? AND id=?
+                    """, (user_id, machine_id))
                 
-                conn.commit()
                 
                 # Return the mint manifest for the frontend to process
                 cur.close()
@@ -3713,24 +2862,12 @@ def activate_machine():
                 })
             else:
                 # Subsequent activations - produce TCorvax
-                reward = 5  # Produces 5 TCorvax on subsequent activations
-                tcorvax_val += reward
-                
-                # Update resources
-                cur.execute("""
-                    UPDATE users
-                    SET corvax_count=?
-                    WHERE user_id=?
-                """, (tcorvax_val, user_id))
-                
-                # Update activation time
-                cur.execute("""
-                    UPDATE user_machines
-                    SET last_activated=?
-                    WHERE user_id=? AND id=?
-                """, (now_ms, user_id, machine_id))
+                reward = FOMO_HIT_REWARD  # Produces 5 TCorvax on subsequent activations
+                if not claim_activation(cur, user_id, machine_id, now_ms):
+                    return cooldown_response(cur, conn)
+                credit(cur, user_id, TCORVAX, reward)
                 
-                conn.commit()
+                balances = get_balances(cur, user_id)
                 cur.close()
                 conn.close()
                 
@@ -3741,60 +2878,35 @@ def activate_machine():
                     "newLastActivated": now_ms,
                     "reward": reward,
                     "updatedResources": {
-                        "tcorvax": tcorvax_val,
-                        "catNips": catNips_val,
-                        "energy": energy_val,
-                        "eggs": eggs_val
+                        "tcorvax": balances[TCORVAX],
+                        "catNips": balances["catNips"],
+                        "energy": balances["energy"],
+                        "eggs": balances["eggs"]
                     }
                 })
 
-        if machine_type == "catLair":
-            gained = 5 + (machine_level - 1)
-            catNips_val += gained
-        elif machine_type == "reactor":
-            if catNips_val < 3:
-                cur.close()
-                conn.close()
-                return jsonify({"error":"Not enough Cat Nips to run the Reactor!"}), 400
-            catNips_val -= 3
-            if machine_level == 1:
-                base_t = 1.0
-            elif machine_level == 2:
-                base_t = 1.5
-            elif machine_level == 3:
-                base_t = 2.0
-            else:
-                base_t = 1.0
-
+        # One production cycle (same table the collect-all endpoint uses)
+        amp_bonus = 0.0
+        if machine_type == "reactor":
             cur.execute("""
                 SELECT level, is_offline
                 FROM user_machines
                 WHERE user_id=? AND machine_type='amplifier'
             """,(user_id,))
-            amp = cur.fetchone()
-            if amp and amp["is_offline"] == 0:
-                amp_level = amp["level"]
-                base_t += 0.5 * amp_level
+            amp_bonus = amplifier_bonus(cur.fetchone())
+        changes = cycle_changes(machine_type, machine_level, amp_bonus)
 
-            base_e = 2
-            tcorvax_val += base_t
-            energy_val  += base_e
-
-        cur.execute("""
-            UPDATE user_machines
-            SET last_activated=?
-            WHERE user_id=? AND id=?
-        """,(now_ms,user_id,machine_id))
+        if not claim_activation(cur, user_id, machine_id, now_ms):
+            return cooldown_response(cur, conn)
 
-        cur.execute("""
-            UPDATE users
-            SET corvax_count=?
-            WHERE user_id=?
-        """,(tcorvax_val,user_id))
-        set_resource_amount(cur, user_id,'catNips',catNips_val)
-        set_resource_amount(cur, user_id,'energy', energy_val)
+        # Reactor fuel is only burned if the player still has it (the 400
+        # rolls the claim back with the rest of the request)
+        if not apply_changes(cur, user_id, changes):
+            cur.close()
+            conn.close()
+            return jsonify({"error":"Not enough Cat Nips to run the Reactor!"}), 400
 
-        conn.commit()
+        balances = get_balances(cur, user_id)
         cur.close()
         conn.close()
 
@@ -3804,51 +2916,256 @@ def activate_machine():
             "machineType":machine_type,
             "newLastActivated":now_ms,
             "updatedResources":{
-                "tcorvax": tcorvax_val,
-                "catNips": catNips_val,
-                "energy": energy_val,
-                "eggs": eggs_val
+                "tcorvax": balances[TCORVAX],
+                "catNips": balances["catNips"],
+                "energy": balances["energy"],
+                "eggs": balances["eggs"]
             }
         })
+    except GatewayUnavailable:
+        raise               # 503 via gateway_unavailable, not a silent 0
     except Exception as e:
         print(f"Error in activate_machine: {e}")
         traceback.print_exc()
         return jsonify({"error": f"Server error: {str(e)}"}), 500
 
-@app.route("/api/getPets", methods=["GET"])
-def get_pets():
+# Upper bound on machine ids per /api/activateMachines call
+MAX_BULK_ACTIVATIONS = 100
+
+@app.route("/api/activateMachines", methods=["POST"])
+def activate_machines():
+    """
+    Activate several machines in one request.  Cooldowns and rewards are
+    evaluated against one machine snapshot in the order given, all resource
+    deltas are applied at once and every id gets its own result entry.
+    """
     try:
         if 'telegram_id' not in session:
             return jsonify({"error": "Not logged in"}), 401
 
+        data = request.get_json(silent=True) or {}
+        machine_ids = data.get("machineIds")
+        if not isinstance(machine_ids, list) or not machine_ids:
+            return jsonify({"error": "Missing machineIds"}), 400
+        if len(machine_ids) > MAX_BULK_ACTIVATIONS:
+            return jsonify({"error": f"At most {MAX_BULK_ACTIVATIONS} machines per request"}), 400
+
         user_id = session['telegram_id']
         conn = get_db_connection()
         cur = conn.cursor()
 
-        cur.execute("""
-            SELECT id, x, y, room, type, parent_machine
-            FROM pets
-            WHERE user_id=?
-        """, (user_id,))
-        
-        rows = cur.fetchall()
-        pets = []
-        
-        for row in rows:
-            pet = {
-                "id": row["id"],
-                "x": row["x"],
-                "y": row["y"],
-                "room": row["room"],
-                "type": row["type"],
-                "parentMachine": row["parent_machine"]
+        # The sCVX lookup (a Gateway call) happens before upkeep may take
+        # the write lock; the inventory is reloaded only if upkeep changed it
+        inventory = MachineInventory.load(cur, user_id)
+        staked_cvx = 0
+        if any((inventory.get(mid) or {}).get("machine_type") == "incubator"
+               for mid in machine_ids):
+            staked_cvx = incubator_scvx_balance(data.get("accountAddress"))
+
+        if update_amplifiers_status(user_id, conn, cur):
+            inventory = MachineInventory.load(cur, user_id)
+
+        now_ms = int(time.time()*1000)
+        amplifiers = inventory.of_type("amplifier")
+        amp_bonus = amplifier_bonus(amplifiers[0] if amplifiers else None)
+        fuel = get_resource(cur, user_id, "catNips")
+
+        changes = {}
+        activated = []          # (machine id, comes online)
+        results = []
+        seen = set()
+        for machine_id in machine_ids:
+            machine = inventory.get(machine_id)
+            if machine is None:
+                results.append({"machineId": machine_id, "status": "error",
+                                "error": "Machine not found"})
+                continue
+            machine_type = machine["machine_type"]
+            result = {"machineId": machine["id"], "machineType": machine_type}
+            results.append(result)
+
+            if machine["id"] in seen:
+                result.update(status="error", error="Duplicate machineId")
+                continue
+            seen.add(machine["id"])
+
+            next_available_at = machine["next_available_at"] or 0
+            if next_available_at > now_ms:
+                result.update(status="error", error="Cooldown not finished",
+                              remainingMs=next_available_at - now_ms)
+                continue
+
+            last_activated = machine["last_activated"] or 0
+            gained = {}
+            if machine_type == "amplifier":
+                result.update(status="ok",
+                              message="Online" if machine["is_offline"] == 0 else "Offline")
+                continue
+            elif machine_type == "incubator":
+                base_reward, bonus_reward, eggs_reward = incubator_rewards(staked_cvx, machine["level"])
+                gained = {TCORVAX: base_reward + bonus_reward, "eggs": eggs_reward}
+                result.update(stakedCVX=staked_cvx, baseReward=base_reward,
+                              bonusReward=bonus_reward, eggsReward=eggs_reward)
+            elif machine_type == "fomoHit":
+                if last_activated == 0:
+                    # Minting needs a signed manifest per machine
+                    result.update(status="error", requiresMint=True,
+                                  error="First FOMO HIT activation must use /api/activateMachine")
+                    continue
+                gained = {TCORVAX: FOMO_HIT_REWARD}
+                result["reward"] = FOMO_HIT_REWARD
+            else:
+                gained = cycle_changes(machine_type, machine["level"], amp_bonus)
+                if machine_type == "reactor" and fuel < REACTOR_FUEL:
+                    result.update(status="error", error="Not enough Cat Nips to run the Reactor!")
+                    continue
+
+            # Claimed one by one, so a concurrent request cannot also be
+            # credited for the same cooldown
+            if not claim_activation(cur, user_id, machine["id"], now_ms):
+                result.update(status="error", error="Cooldown not finished")
+                continue
+
+            fuel += gained.get("catNips", 0)
+            for res, delta in gained.items():
+                changes[res] = changes.get(res, 0) + delta
+            activated.append((machine["id"], machine_type == "incubator" and last_activated == 0))
+            result.update(status="ok", gained=gained, newLastActivated=now_ms)
+
+        if activated:
+            # One guarded ledger update for every reward and fuel burn (a
+            # 409 rolls the claims back too)
+            if not apply_changes(cur, user_id, changes):
+                cur.close()
+                conn.close()
+                return jsonify({"error": "Resources changed, please retry"}), 409
+
+            first_incubators = [(user_id, mid) for mid, online in activated if online]
+            if first_incubators:
+                cur.executemany("""
+                    UPDATE user_machines SET is_offline=0
+                    WHERE user_id=? AND id=?
+                """, first_incubators)
+
+        balances = get_balances(cur, user_id)
+        cur.close()
+        conn.close()
+
+        return jsonify({
+            "status": "ok",
+            "activated": len(activated),
+            "results": results,
+            "updatedResources": {
+                "tcorvax": balances[TCORVAX],
+                "catNips": balances["catNips"],
+                "energy": balances["energy"],
+                "eggs": balances["eggs"]
             }
-            pets.append(pet)
+        })
+    except GatewayUnavailable:
+        raise               # 503 via gateway_unavailable, not a silent 0
+    except Exception as e:
+        print(f"Error in activate_machines: {e}")
+        traceback.print_exc()
+        return jsonify({"error": f"Server error: {str(e)}"}), 500
+
+# ──────────────────────────────────────────────────────────────
+# Accrued production (cat lairs and reactors)
+# ──────────────────────────────────────────────────────────────
+def _collection_json(collected, starved):
+    return {
+        "machines": [{"machineId": m["id"], "machineType": m["machine_type"],
+                      "cycles": cycles, "gained": gained}
+                     for m, cycles, gained in collected],
+        "starvedReactors": [m["id"] for m in starved]
+    }
+
+@app.route("/api/pendingProduction", methods=["GET"])
+def pending_production():
+    try:
+        if 'telegram_id' not in session:
+            return jsonify({"error": "Not logged in"}), 401
+
+        user_id = session['telegram_id']
+        snapshot = cached_game_snapshot(user_id)
+
+        changes, collected, starved = plan_collection(
+            MachineInventory(snapshot["machines"]), snapshot["catNips"],
+            int(time.time()*1000), MACHINE_COOLDOWN_MS, ACCRUAL_MAX_CYCLES)
+
+        result = _collection_json(collected, starved)
+        result["pending"] = changes
+        return jsonify(result)
+    except Exception as e:
+        print(f"Error in pending_production: {e}")
+        traceback.print_exc()
+        return jsonify({"error": "Server error"}), 500
+
+@app.route("/api/collectAll", methods=["POST"])
+def collect_all():
+    try:
+        if 'telegram_id' not in session:
+            return jsonify({"error": "Not logged in"}), 401
+
+        user_id = session['telegram_id']
+        conn = get_db_connection()
+        cur = conn.cursor()
+
+        update_amplifiers_status(user_id, conn, cur)
+
+        now_ms = int(time.time()*1000)
+        inventory = MachineInventory.load(cur, user_id)
+        cat_nips = get_resource(cur, user_id, "catNips")
+        changes, collected, starved = plan_collection(
+            inventory, cat_nips, now_ms, MACHINE_COOLDOWN_MS, ACCRUAL_MAX_CYCLES)
+
+        if not collected:
+            cur.close()
+            conn.close()
+            return jsonify({"error": "Nothing to collect yet",
+                            "starvedReactors": [m["id"] for m in starved]}), 400
+
+        # All rewards, fuel and cooldowns settle in the request's transaction.
+        # Every machine is claimed first, so a concurrent collect or click
+        # cannot be paid for the same cycles, and the fuel debit is still
+        # guarded in case cat nips moved meanwhile; a 409 rolls it all back
+        claimed = all(claim_activation(cur, user_id, m["id"], now_ms)
+                      for m, _, _ in collected)
+        if not claimed or not apply_changes(cur, user_id, changes):
+            cur.close()
+            conn.close()
+            return jsonify({"error": "Resources changed, please retry"}), 409
 
+        balances = get_balances(cur, user_id)
         cur.close()
         conn.close()
 
-        return jsonify(pets)
+        result = _collection_json(collected, starved)
+        result.update({
+            "status": "ok",
+            "collected": changes,
+            "newLastActivated": now_ms,
+            "updatedResources": {
+                "tcorvax": balances[TCORVAX],
+                "catNips": balances["catNips"],
+                "energy": balances["energy"],
+                "eggs": balances["eggs"]
+            }
+        })
+        return jsonify(result)
+    except Exception as e:
+        print(f"Error in collect_all: {e}")
+        traceback.print_exc()
+        return jsonify({"error": f"Server error: {str(e)}"}), 500
+
+@app.route("/api/getPets", methods=["GET"])
+def get_pets():
+    try:
+        if 'telegram_id' not in session:
+            return jsonify({"error": "Not logged in"}), 401
+
+        snapshot = cached_game_snapshot(session['telegram_id'])
+        return jsonify([pet_json(p) for p in snapshot["pets"]])
     except Exception as e:
         print(f"Error in get_pets: {e}")
         traceback.print_exc()
@@ -3872,10 +3189,7 @@ def buy_pet():
         cur = conn.cursor()
 
         # Check if user already has a pet of this type
-        cur.execute("""
-            SELECT COUNT(*) FROM pets
-            WHERE user_id=? AND type=?
-        """, (user_id, pet_type))
+        cur.execute(schema.count_pets_by_type, (user_id, pet_type))
         
         pet_count = cur.fetchone()[0]
         
@@ -3885,17 +3199,12 @@ def buy_pet():
             conn.close()
             return jsonify({"error": "You already have this type of pet"}), 400
 
-        # Check if user has enough catnips
-        catNips_val = float(get_or_create_resource(cur, user_id, 'catNips'))
-        
-        if catNips_val < 1500:
+        # Deduct catnips if the player has enough
+        if not debit_if_sufficient(cur, user_id, {"catNips": 1500}):
             cur.close()
             conn.close()
             return jsonify({"error": "Not enough Cat Nips (1500 required)"}), 400
-
-        # Deduct catnips
-        catNips_val -= 1500
-        set_resource_amount(cur, user_id, 'catNips', catNips_val)
+        catNips_val = float(get_resource(cur, user_id, 'catNips'))
 
         # Create the pet
         cur.execute("""
@@ -3904,7 +3213,6 @@ def buy_pet():
         """, (user_id, x_coord, y_coord, room, pet_type, parent_machine))
 
         pet_id = cur.lastrowid
-        conn.commit()
 
         cur.close()
         conn.close()
@@ -3965,7 +3273,6 @@ def move_pet():
             WHERE user_id=? AND id=?
         """, (new_x, new_y, new_room, user_id, pet_id))
 
-        conn.commit()
         cur.close()
         conn.close()
 
@@ -3988,7 +3295,6 @@ def buy_energy():
     try:
         if 'telegram_id' not in session:
             return jsonify({"error": "Not logged in"}), 401
-        user_id = session['telegram_id']
         data = request.json or {}
         account_address = data.get("accountAddress")
         
@@ -4036,16 +3342,10 @@ def confirm_energy_purchase():
             conn = get_db_connection()
             cur = conn.cursor()
             
-            # Get current energy
-            energy_val = float(get_or_create_resource(cur, user_id, 'energy'))
+            # Add 500 energy in place (no read-modify-write race)
+            credit(cur, user_id, 'energy', 500)
+            energy_val = float(get_resource(cur, user_id, 'energy'))
             
-            # Add 500 energy
-            energy_val += 500
-            
-            # Update energy resource
-            set_resource_amount(cur, user_id, 'energy', energy_val)
-            
-            conn.commit()
             cur.close()
             conn.close()
             
@@ -4065,6 +3365,24 @@ def confirm_energy_purchase():
         traceback.print_exc()
         return jsonify({"error": f"Server error: {str(e)}"}), 500
 
+def _layout_updates(stored, posted):
+    """
+    (x, y, room, id) for every posted item whose position differs from the
+    stored one.  `stored` maps id -> (x, y, room); unknown ids are ignored.
+    """
+    updates = []
+    for item in posted:
+        try:
+            item_id = int(item.get("id"))
+        except (TypeError, ValueError):
+            continue
+        if item_id not in stored:
+            continue
+        position = (item.get("x", 0), item.get("y", 0), item.get("room", 1))  # Default to room 1
+        if position != stored[item_id]:
+            updates.append(position + (item_id,))
+    return updates
+
 @app.route("/api/syncLayout", methods=["POST"])
 def sync_layout():
     try:
@@ -4073,44 +3391,41 @@ def sync_layout():
 
         data = request.json or {}
         machine_list = data.get("machines", [])
+        pet_list = data.get("pets", [])
 
         user_id = session['telegram_id']
         conn = get_db_connection()
         cur = conn.cursor()
 
-        # Check if room column exists
-        has_room_column = True
-        try:
-            cur.execute("PRAGMA table_info(user_machines)")
-            columns = [column[1] for column in cur.fetchall()]
-            has_room_column = 'room' in columns
-        except:
-            has_room_column = False
-
-        for m in machine_list:
-            mid = m.get("id")
-            mx = m.get("x", 0)
-            my = m.get("y", 0)
-            mroom = m.get("room", 1)  # Default to room 1
-            
-            if has_room_column:
-                cur.execute("""
-                    UPDATE user_machines
+        # Only rows whose position actually changed are written
+        machine_updates = []
+        if machine_list:
+            cur.execute(schema.select_machines, (user_id,))
+            stored = {r["id"]: (r["x"], r["y"], r["room"]) for r in cur.fetchall()}
+            machine_updates = _layout_updates(stored, machine_list)
+            if machine_updates:
+                cur.executemany(schema.update_machine_position,
+                                [(x, y) + schema.room_param(room) + (user_id, mid)
+                                 for x, y, room, mid in machine_updates])
+
+        pet_updates = []
+        if pet_list:
+            cur.execute("SELECT id, x, y, room FROM pets WHERE user_id=?", (user_id,))
+            stored = {r["id"]: (r["x"], r["y"], r["room"]) for r in cur.fetchall()}
+            pet_updates = _layout_updates(stored, pet_list)
+            if pet_updates:
+                cur.executemany("""
+                    UPDATE pets
                     SET x=?, y=?, room=?
                     WHERE user_id=? AND id=?
-                """, (mx, my, mroom, user_id, mid))
-            else:
-                cur.execute("""
-                    UPDATE user_machines
-                    SET x=?, y=?
-                    WHERE user_id=? AND id=?
-                """, (mx, my, user_id, mid))
+                """, [(x, y, room, user_id, pid) for x, y, room, pid in pet_updates])
 
-        conn.commit()
         cur.close()
         conn.close()
 
-        return jsonify({"status":"ok","message":"Layout updated"})
+        return jsonify({"status":"ok","message":"Layout updated",
+                        "machinesUpdated": len(machine_updates),
+                        "petsUpdated": len(pet_updates)})
     except Exception as e:
         print(f"Error in sync_layout: {e}")
         traceback.print_exc() 
@@ -4137,26 +3452,9 @@ def check_xrd_balance():
         
         print(f"Checking XRD balance for account: {account_address}")
         
-        # Try up to 2 times to fetch the XRD balance
-        max_attempts = 2
-        xrd_balance = 0
-        
-        for attempt in range(max_attempts):
-            try:
-                # Fetch XRD balance using the improved Gateway API function
-                xrd_balance = fetch_xrd_balance(account_address)
-                
-                if xrd_balance > 0:
-                    # We got a positive balance, no need for more attempts
-                    break
-                    
-                if attempt < max_attempts - 1:
-                    print(f"First attempt returned {xrd_balance} XRD, retrying...")
-                    time.sleep(1)  # Short delay before retry
-            except Exception as e:
-                print(f"Attempt {attempt+1} failed: {str(e)}")
-                if attempt < max_attempts - 1:
-                    time.sleep(1)  # Short delay before retry
+        # Retries/backoff are handled by the gateway client
+        xrd_balance = fetch_xrd_balance(account_address,
+                                        force_refresh=data.get("forceRefresh", False))
         
         # Check if the user has enough XRD (250 XRD required for minting)
         has_enough_xrd = xrd_balance >= 250
@@ -4172,6 +3470,8 @@ def check_xrd_balance():
             "hasEnoughXrd": has_enough_xrd,
             "statusMessage": status_message
         })
+    except GatewayUnavailable:
+        raise               # 503 via gateway_unavailable, not a silent 0
     except Exception as e:
         print(f"Error checking XRD balance: {e}")
         traceback.print_exc()
@@ -4201,6 +3501,9 @@ def get_creature_mint_manifest():
         
         if manifest is None:
             return jsonify({"error": "Failed to create transaction manifest"}), 500
+
+        # The mint deposits a creature and a bonus tool or spell
+        invalidate_account_nfids(account_address)
         
         return jsonify({
             "status": "ok",
@@ -4233,6 +3536,9 @@ def check_creature_mint_status():
         bonus_item = None
         
         if status_data.get("status") == "CommittedSuccess":
+            # The account's NFID lists changed with this transaction
+            invalidate_account_nfids(data.get("accountAddress"))
+
             # Try to get NFT details from the transaction
             creature_nft, bonus_item = get_minted_nfts_from_transaction(intent_hash)
             
@@ -4384,7 +3690,8 @@ def get_user_creatures():
         # 1)  Pull the list of NFIDs with the new helper
         # ------------------------------------------------------------------
         print(f"Fetching creature NFT IDs for account: {account_address}")
-        nft_ids = get_account_nfids(account_address, CREATURE_NFT_RESOURCE)
+        nft_ids = get_account_nfids(account_address, CREATURE_NFT_RESOURCE,
+                                    use_cache=True)
 
         if not nft_ids:
             print(f"No creature NFTs found for account {account_address}")
@@ -4454,14 +3761,8 @@ def dump_first_egg():
         first = nfids[0]
 
         # 2) ask for the raw data – but keep the whole `data` block
-        BASE = "https://mainnet.radixdlt.com"
-        hdrs = {"Content-Type": "application/json",
-                "User-Agent": "CorvaxLab debug/1.0"}
-
         # pin a state_version so the request is deterministic
-        st   = requests.post(f"{BASE}/status/gateway-status",
-                             json={}, headers=hdrs, timeout=10).json()
-        selector = {"state_version": st["ledger_state"]["state_version"]}
+        selector = ledger.selector()
 
         body = {
             "at_ledger_state": selector,
@@ -4469,8 +3770,7 @@ def dump_first_egg():
             "non_fungible_ids": [first]
         }
 
-        r = requests.post(f"{BASE}/state/non-fungible/data",
-                          json=body, headers=hdrs, timeout=20)
+        r = gateway.post("/state/non-fungible/data", body)
         r.raise_for_status()
 
         entry = r.json()["non_fungible_ids"][0]   # only one id
@@ -4633,26 +3933,9 @@ def check_token_balance():
         
         print(f"Checking {token_symbol} balance for account: {account_address}")
         
-        # Try up to 2 times to fetch the token balance
-        max_attempts = 2
-        token_balance = 0
-        
-        for attempt in range(max_attempts):
-            try:
-                # Fetch token balance using the Gateway API function
-                token_balance = fetch_token_balance(account_address, token_symbol)
-                
-                if token_balance > 0:
-                    # We got a positive balance, no need for more attempts
-                    break
-                    
-                if attempt < max_attempts - 1:
-                    print(f"First attempt returned {token_balance} {token_symbol}, retrying...")
-                    time.sleep(1)  # Short delay before retry
-            except Exception as e:
-                print(f"Attempt {attempt+1} failed: {str(e)}")
-                if attempt < max_attempts - 1:
-                    time.sleep(1)  # Short delay before retry
+        # Retries/backoff are handled by the gateway client
+        token_balance = fetch_token_balance(account_address, token_symbol,
+                                            force_refresh=force_refresh)
         
         # Prepare diagnostic info
         status_message = "Balance check successful"
@@ -4665,6 +3948,8 @@ def check_token_balance():
             "tokenSymbol": token_symbol,
             "statusMessage": status_message
         })
+    except GatewayUnavailable:
+        raise               # 503 via gateway_unavailable, not a silent 0
     except Exception as e:
         print(f"Error checking {token_symbol} balance: {e}")
         traceback.print_exc()
@@ -4727,6 +4012,9 @@ def get_upgrade_stats_manifest():
         if not manifest:
             return jsonify({"error": "Failed to create transaction manifest"}), 500
         
+        # Stats change once the transaction commits – stop serving cached data
+        invalidate_nft_data(CREATURE_NFT_RESOURCE, [creature_id])
+        
         return jsonify({
             "status": "ok",
             "manifest": manifest,
@@ -4781,6 +4069,9 @@ def get_evolve_manifest():
         if not manifest:
             return jsonify({"error": "Failed to create transaction manifest"}), 500
         
+        # Stats change once the transaction commits – stop serving cached data
+        invalidate_nft_data(CREATURE_NFT_RESOURCE, [creature_id])
+        
         return jsonify({
             "status": "ok",
             "manifest": manifest,
@@ -4850,6 +4141,9 @@ def get_level_up_stats_manifest():
         if not manifest:
             return jsonify({"error": "Failed to create transaction manifest"}), 500
         
+        # Stats change once the transaction commits – stop serving cached data
+        invalidate_nft_data(CREATURE_NFT_RESOURCE, [creature_id])
+        
         return jsonify({
             "status": "ok",
             "manifest": manifest,
@@ -4910,6 +4204,11 @@ def get_combine_creatures_manifest():
         if not manifest:
             return jsonify({"error": "Failed to create transaction manifest"}), 500
         
+        # Stats change once the transaction commits – stop serving cached data;
+        # creature B is burned
+        invalidate_nft_data(CREATURE_NFT_RESOURCE, [creature_a_id, creature_b_id])
+        invalidate_account_nfids(account_address, (CREATURE_NFT_RESOURCE,))
+        
         return jsonify({
             "status": "ok",
             "manifest": manifest,
@@ -0,0 +1,83 @@
+# bench_game_state.py
+#
+# Statements issued (and time taken) per /api/getGameState cache miss: the
+# amplifier upkeep check plus the snapshot load, as cached_game_snapshot
+# runs them (a cache hit issues none).  Builds a scratch database from
+# migrations.py, seeds one player and counts every SQL statement via
+# sqlite3's trace callback.
+#
+#   python bench_game_state.py [machines] [pets] [iterations]
+import io
+import sqlite3
+import sys
+import time
+from contextlib import redirect_stdout
+
+from migrations import migrate
+from schema import schema
+from game_state import load_game_snapshot
+from amplifier_upkeep import apply_amplifier_upkeep
+
+MACHINE_TYPES = ("catLair", "reactor", "amplifier", "incubator", "fomoHit")
+
+
+def seed(conn, user_id, machines, pets):
+    conn.execute("INSERT INTO users (user_id, first_name, corvax_count) VALUES (?, 'bench', 1000)",
+                 (user_id,))
+    conn.executemany("INSERT INTO resources (user_id, resource_name, amount) VALUES (?, ?, ?)",
+                     [(user_id, name, 100) for name in ("catNips", "energy", "eggs")])
+    conn.executemany("""
+        INSERT INTO user_machines (user_id, machine_type, x, y, level, room)
+        VALUES (?, ?, ?, ?, 1, 1)
+    """, [(user_id, MACHINE_TYPES[i % len(MACHINE_TYPES)], i * 10, i * 10)
+          for i in range(machines)])
+    conn.executemany("INSERT INTO pets (user_id, x, y, room, type) VALUES (?, ?, ?, 1, 'cat')",
+                     [(user_id, i, i) for i in range(pets)])
+    conn.commit()
+
+
+def load_uncached(conn, cur, user_id):
+    """What cached_game_snapshot does on a miss."""
+    apply_amplifier_upkeep(conn, cur, user_id, int(time.time() * 1000))
+    return load_game_snapshot(cur, user_id)
+
+
+def main(argv):
+    machines = int(argv[1]) if len(argv) > 1 else 12
+    pets = int(argv[2]) if len(argv) > 2 else 2
+    iterations = int(argv[3]) if len(argv) > 3 else 2000
+
+    conn = sqlite3.connect(":memory:")
+    conn.row_factory = sqlite3.Row
+    with redirect_stdout(io.StringIO()):
+        migrate(conn)
+        schema.refresh(conn)
+    seed(conn, 1, machines, pets)
+
+    # Settle the amplifiers' first upkeep evaluation, so the count below is
+    # the steady state: one upkeep SELECT while no period is due
+    cur = conn.cursor()
+    apply_amplifier_upkeep(conn, cur, 1, int(time.time() * 1000))
+
+    statements = []
+    conn.set_trace_callback(statements.append)
+    snapshot = load_uncached(conn, cur, 1)
+    conn.set_trace_callback(None)
+
+    print(f"Snapshot: {len(snapshot['machines'])} machines, {len(snapshot['pets'])} pets, "
+          f"rooms unlocked {snapshot['rooms_unlocked']}")
+    print(f"Statements per load (upkeep check + snapshot): {len(statements)}")
+    for sql in statements:
+        print("  " + " ".join(sql.split())[:100])
+
+    start = time.perf_counter()
+    for _ in range(iterations):
+        load_uncached(conn, cur, 1)
+    elapsed = time.perf_counter() - start
+    print(f"{iterations} loads: {elapsed * 1000:.1f} ms "
+          f"({elapsed / iterations * 1e6:.1f} µs per load)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -22,6 +22,51 @@ RADIX_COMPONENT_ADDRESS = os.getenv("RADIX_COMPONENT_ADDRESS")
 RADIX_NETWORK = "mainnet"  # or "stokenet" for testnet
 RADIX_GATEWAY_API = os.getenv("RADIX_GATEWAY_API", "https://mainnet.radixdlt.com")
 
+# Gateway HTTP client: max keep-alive connections and default read timeout (s)
+GATEWAY_POOL_SIZE = int(os.getenv("GATEWAY_POOL_SIZE", "20"))
+GATEWAY_TIMEOUT   = float(os.getenv("GATEWAY_TIMEOUT", "15"))
+
+# Client-side Gateway budget: sustained requests/s and burst size (0 = off),
+# extra attempts for failed reads, and the circuit breaker's consecutive
+# failure threshold / open time (s)
+GATEWAY_RATE_LIMIT        = float(os.getenv("GATEWAY_RATE_LIMIT", "20"))
+GATEWAY_BURST             = int(os.getenv("GATEWAY_BURST", "40"))
+GATEWAY_RETRIES           = int(os.getenv("GATEWAY_RETRIES", "1"))
+GATEWAY_BREAKER_THRESHOLD = int(os.getenv("GATEWAY_BREAKER_THRESHOLD", "5"))
+GATEWAY_BREAKER_COOLDOWN  = float(os.getenv("GATEWAY_BREAKER_COOLDOWN", "30"))
+
+# Longest a call may queue for its slot while a 429's Retry-After is in force
+# (beyond it the call fails fast with GatewayUnavailable)
+GATEWAY_MAX_THROTTLE_WAIT = float(os.getenv("GATEWAY_MAX_THROTTLE_WAIT", "5"))
+
+# NFT programmatic_json cache: max entries and freshness window (s)
+NFT_CACHE_SIZE = int(os.getenv("NFT_CACHE_SIZE", "5000"))
+NFT_CACHE_TTL  = float(os.getenv("NFT_CACHE_TTL", "120"))
+
+# Max /state/non-fungible/data batches in flight per process (halved on 429)
+GATEWAY_NFT_CONCURRENCY = int(os.getenv("GATEWAY_NFT_CONCURRENCY", "4"))
+
+# Per-account fungible balance snapshot freshness window (s)
+BALANCE_CACHE_TTL = float(os.getenv("BALANCE_CACHE_TTL", "5"))
+
+# Account NFID cache: max (account, resource) entries and freshness window (s);
+# NFID_REFRESH_INTERVAL > 0 starts a background refresher for linked accounts
+NFID_CACHE_SIZE       = int(os.getenv("NFID_CACHE_SIZE", "10000"))
+NFID_CACHE_TTL        = float(os.getenv("NFID_CACHE_TTL", "60"))
+NFID_REFRESH_INTERVAL = float(os.getenv("NFID_REFRESH_INTERVAL", "0"))
+
+# Per-user game snapshot cache: max players and freshness window (s).  Bounds
+# how long writes made outside this process (the Telegram bot, other workers)
+# stay invisible; 0 disables the cache.
+GAME_STATE_CACHE_SIZE = int(os.getenv("GAME_STATE_CACHE_SIZE", "5000"))
+GAME_STATE_CACHE_TTL  = float(os.getenv("GAME_STATE_CACHE_TTL", "10"))
+
+# Cooldowns' worth of cat lair / reactor production one collectAll may pay out
+ACCRUAL_MAX_CYCLES = int(os.getenv("ACCRUAL_MAX_CYCLES", "1"))
+
+# Optional JSON file overriding the built-in machine build/upgrade table
+MACHINE_CATALOG_PATH = os.getenv("MACHINE_CATALOG_PATH", "")
+
 # Optional: Validate the private key format
 if RADIX_PRIVATE_KEY and (len(RADIX_PRIVATE_KEY) != 64 or not all(c in '0123456789abcdefABCDEF' for c in RADIX_PRIVATE_KEY)):
     raise ValueError("RADIX_PRIVATE_KEY appears to be in incorrect format")
@@ -30,4 +75,11 @@ if RADIX_PRIVATE_KEY and (len(RADIX_PRIVATE_KEY) != 64 or not all(c in '01234567
 GROUP_ID    = os.getenv("GROUP_ID", "YOUR_OPTIONAL_GROUP_ID")
 FLASK_ENV   = os.getenv("FLASK_ENV", "development")
 
-DATABASE_PATH = "/root/telegram_bot/bot.db"
+DATABASE_PATH = os.getenv("DATABASE_PATH", "/root/telegram_bot/bot.db")
+
+# SQLite: idle pooled connections kept, busy timeout (s), page cache (KiB)
+# and memory-mapped I/O size (bytes) per connection
+DB_POOL_SIZE     = int(os.getenv("DB_POOL_SIZE", "8"))
+DB_BUSY_TIMEOUT  = float(os.getenv("DB_BUSY_TIMEOUT", "5"))
+DB_CACHE_SIZE_KB = int(os.getenv("DB_CACHE_SIZE_KB", "16384"))
+DB_MMAP_SIZE     = int(os.getenv("DB_MMAP_SIZE", str(256 * 1024 * 1024)))
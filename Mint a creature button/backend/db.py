@@ -0,0 +1,136 @@
+# db.py
+#
+# SQLite access for the game backend.  Connections to bot.db are opened once,
+# tuned (WAL, synchronous=NORMAL, mmap, page cache, busy timeout) and then
+# reused from a small pool instead of being reconnected on every call.
+#
+# Inside a Flask request every get_db_connection() call returns the same
+# connection and the request is one unit of work: commit() is deferred, and
+# end_request_transaction() commits once (or rolls back) when the response
+# is ready, so a request costs at most one fsync.  The connection goes back
+# to the pool, rolling back anything uncommitted, when the request is torn
+# down.  Outside a request (startup, background threads) commit() and
+# close() behave as usual, except that close() hands the connection back to
+# the pool.
+import queue
+import sqlite3
+
+from flask import g, has_request_context
+
+from config import (DATABASE_PATH, DB_POOL_SIZE, DB_BUSY_TIMEOUT,
+                    DB_CACHE_SIZE_KB, DB_MMAP_SIZE)
+
+# Applied to every new connection (journal_mode is persistent in the file,
+# the rest are per-connection)
+PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    f"PRAGMA busy_timeout={int(DB_BUSY_TIMEOUT * 1000)}",
+    f"PRAGMA cache_size=-{DB_CACHE_SIZE_KB}",
+    f"PRAGMA mmap_size={DB_MMAP_SIZE}",
+    "PRAGMA temp_store=MEMORY",
+)
+
+
+class PooledConnection(sqlite3.Connection):
+    """
+    sqlite3 connection owned by a ConnectionPool.
+
+    close() does not close the file: it rolls back uncommitted work and
+    returns the connection to its pool.  While lent to a Flask request both
+    close() and commit() are no-ops, so helpers that open, commit and close
+    their "own" connection mid request do not end the route's transaction.
+    """
+
+    pool = None
+    in_request = False
+
+    def close(self):
+        if not self.in_request:
+            self.pool.release(self)
+
+    def commit(self):
+        if not self.in_request:
+            super().commit()
+
+
+class ConnectionPool:
+    """Keeps up to `size` idle, pre-configured connections to `path`."""
+
+    def __init__(self, path=DATABASE_PATH, size=DB_POOL_SIZE):
+        self.path = path
+        self.size = size
+        self._idle = queue.LifoQueue()      # most recently used = warmest cache
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path,
+                               timeout=DB_BUSY_TIMEOUT,
+                               check_same_thread=False,
+                               factory=PooledConnection)
+        conn.pool = self
+        for pragma in PRAGMAS:
+            conn.execute(pragma)
+        return conn
+
+    def acquire(self):
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            conn = self._connect()
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def release(self, conn):
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error as e:
+            print(f"Dropping broken DB connection: {e}")
+            sqlite3.Connection.close(conn)
+            return
+
+        if self._idle.qsize() < self.size:
+            self._idle.put(conn)
+        else:
+            sqlite3.Connection.close(conn)
+
+    def close_all(self):
+        while True:
+            try:
+                sqlite3.Connection.close(self._idle.get_nowait())
+            except queue.Empty:
+                return
+
+
+pool = ConnectionPool()
+
+
+def get_db_connection():
+    """A tuned connection to bot.db (shared for the rest of the request)."""
+    if not has_request_context():
+        return pool.acquire()
+
+    conn = g.get("db_conn")
+    if conn is None:
+        conn = g.db_conn = pool.acquire()
+        conn.in_request = True
+    return conn
+
+
+def end_request_transaction(commit):
+    """Commit (or roll back) the current request's unit of work, if any."""
+    conn = g.get("db_conn")
+    if conn is None or not conn.in_transaction:
+        return
+    if commit:
+        sqlite3.Connection.commit(conn)
+    else:
+        conn.rollback()
+
+
+def release_request_connection():
+    """Return the current request's connection to the pool."""
+    conn = g.pop("db_conn", None)
+    if conn is not None:
+        conn.in_request = False
+        pool.release(conn)
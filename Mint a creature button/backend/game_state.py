@@ -0,0 +1,160 @@
+# game_state.py
+#
+# One-pass loader for a player's game state (/api/getGameState).  Three
+# statements – the user row with every resource pivoted in, all machines,
+# all pets – and everything else (per-type counts, unlocked rooms) is
+# derived from those rows in Python.
+#
+# SnapshotCache keeps the result per user so the read-only game routes can
+# answer from memory until the player's next mutating request.
+import threading
+import time
+from collections import OrderedDict
+
+from cache import TTLCache
+from schema import schema, SNAPSHOT_RESOURCES
+
+
+def rooms_unlocked(machine_counts):
+    """Room 2 unlocks with 2 cat lairs, 2 reactors and 1 amplifier."""
+    if (machine_counts.get("catLair", 0) >= 2 and
+            machine_counts.get("reactor", 0) >= 2 and
+            machine_counts.get("amplifier", 0) >= 1):
+        return 2
+    return 1
+
+
+def machine_json(m):
+    """Front-end shape of one user_machines row."""
+    return {
+        "id": m["id"],
+        "type": m["machine_type"],
+        "x": m["x"],
+        "y": m["y"],
+        "level": m["level"],
+        "lastActivated": m["last_activated"],
+        "isOffline": m["is_offline"],
+        "provisionalMint": m["provisional_mint"],
+        "room": m["room"]
+    }
+
+
+def pet_json(p):
+    return {
+        "id": p["id"],
+        "x": p["x"],
+        "y": p["y"],
+        "room": p["room"],
+        "type": p["type"],
+        "parentMachine": p["parent_machine"]
+    }
+
+
+def load_game_snapshot(cur, user_id):
+    """
+    Everything getGameState returns, as a dict:
+    tcorvax/catNips/energy/eggs, seen_room_unlock, machines (row dicts),
+    machine_counts {type: n}, rooms_unlocked and pets (row dicts).
+    """
+    cur.execute(schema.select_user_snapshot, (user_id,))
+    row = cur.fetchone()
+    snapshot = {
+        "tcorvax": float(row["corvax_count"] or 0) if row else 0.0,
+        "seen_room_unlock": (row["seen_room_unlock"] or 0) if row else 0,
+    }
+    for name in SNAPSHOT_RESOURCES:
+        snapshot[name] = float(row[name] or 0) if row else 0.0
+
+    cur.execute(schema.select_machines, (user_id,))
+    machines = [dict(m) for m in cur.fetchall()]
+
+    machine_counts = {}
+    for m in machines:
+        machine_counts[m["machine_type"]] = machine_counts.get(m["machine_type"], 0) + 1
+
+    cur.execute("""
+        SELECT id, x, y, room, type, parent_machine
+        FROM pets
+        WHERE user_id=?
+    """, (user_id,))
+    pets = [dict(p) for p in cur.fetchall()]
+
+    snapshot.update(machines=machines,
+                    machine_counts=machine_counts,
+                    rooms_unlocked=rooms_unlocked(machine_counts),
+                    pets=pets)
+    return snapshot
+
+
+def game_state_json(snapshot):
+    """/api/getGameState response body for a snapshot."""
+    return {
+        "tcorvax": snapshot["tcorvax"],
+        "catNips": snapshot["catNips"],
+        "energy": snapshot["energy"],
+        "eggs": snapshot["eggs"],
+        "machines": [machine_json(m) for m in snapshot["machines"]],
+        "roomsUnlocked": snapshot["rooms_unlocked"],
+        "seenRoomUnlock": snapshot["seen_room_unlock"],
+        "pets": [pet_json(p) for p in snapshot["pets"]]
+    }
+
+
+def snapshot_ttl(snapshot, now_ms, ttl):
+    """
+    Seconds a snapshot may be served for: `ttl`, cut short by the next
+    amplifier upkeep due time (upkeep changes energy and is_offline without
+    a mutating request).
+    """
+    for m in snapshot["machines"]:
+        due = m["next_cost_time"] or 0
+        if m["machine_type"] == "amplifier" and due > now_ms:
+            ttl = min(ttl, (due - now_ms) / 1000.0)
+    return ttl
+
+
+class SnapshotCache:
+    """
+    Per-user game snapshots kept in process memory.
+
+    Every invalidate() moves the user to a new, higher generation; a
+    snapshot loaded before an invalidation is dropped instead of stored, so
+    a read racing a write cannot put the pre-write state back into the
+    cache.  Only the `maxsize` most recently invalidated users keep their
+    own generation; the rest share `_floor`, the highest one forgotten, so
+    forgetting a user can only make a racing read miss the cache.
+    """
+
+    def __init__(self, maxsize, ttl):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._generations = OrderedDict()   # user_id -> generation, LRU order
+        self._counter = 0
+        self._floor = 0
+        self._lock = threading.Lock()
+
+    def get(self, user_id):
+        return self._cache.get(user_id)
+
+    def generation(self, user_id):
+        with self._lock:
+            return self._generations.get(user_id, self._floor)
+
+    def store(self, user_id, snapshot, generation):
+        if self.ttl <= 0:
+            return
+        ttl = snapshot_ttl(snapshot, int(time.time() * 1000), self.ttl)
+        with self._lock:
+            if self._generations.get(user_id, self._floor) == generation and ttl > 0:
+                self._cache.set(user_id, snapshot, ttl=ttl)
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._counter += 1
+            self._generations[user_id] = self._counter
+            self._generations.move_to_end(user_id)
+            while len(self._generations) > max(1, self.maxsize):
+                _, forgotten = self._generations.popitem(last=False)
+                self._floor = max(self._floor, forgotten)
+            self._cache.pop(user_id)
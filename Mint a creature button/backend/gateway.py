@@ -0,0 +1,650 @@
+# gateway.py
+#
+# Shared HTTP client for the Radix Babylon Gateway API.  Every helper that
+# talks to the Gateway (balance lookups, NFID / NFT data reads, transaction
+# status, RadixClient build/submit) goes through the single `gateway`
+# instance below so that TLS connections are pooled and kept alive instead of
+# being re-established on every call.  `gateway_async` is the asyncio
+# counterpart used by routes that fan out several lookups at once, and
+# `ledger` pins one ledger state_version per request for consistent reads.
+#
+# All calls share one token bucket (client-side rate limit), one circuit
+# breaker and one bounded retry policy for reads; helpers no longer retry
+# or sleep on their own.  While the breaker is open calls fail fast with
+# GatewayUnavailable so callers can serve cached data instead.
+import asyncio
+import contextvars
+import json
+import threading
+import time
+from functools import partial
+
+import requests
+from requests.adapters import HTTPAdapter
+
+try:
+    import httpx
+except ImportError:  # async client falls back to the pooled sync session
+    httpx = None
+
+from config import (RADIX_GATEWAY_API, GATEWAY_POOL_SIZE, GATEWAY_TIMEOUT,
+                    GATEWAY_RATE_LIMIT, GATEWAY_BURST, GATEWAY_RETRIES,
+                    GATEWAY_BREAKER_THRESHOLD, GATEWAY_BREAKER_COOLDOWN,
+                    GATEWAY_MAX_THROTTLE_WAIT)
+
+DEFAULT_HEADERS = {
+    "Content-Type": "application/json",
+    "User-Agent": "CorvaxLab Game/2.0"
+}
+
+# Seconds to wait for the TCP/TLS connection to be established
+CONNECT_TIMEOUT = 3.05
+
+# Read timeouts (seconds) per Gateway endpoint; anything not listed here
+# falls back to GATEWAY_TIMEOUT.
+ENDPOINT_TIMEOUTS = {
+    "/status/gateway-status": 10,
+    "/state/version": 10,
+    "/transaction/status": 10,
+    "/state/entity/details": 15,
+    "/state/entity/page/fungibles/": 15,
+    "/state/entity/page/non-fungible-vaults/": 15,
+    "/transaction/committed-details": 15,
+    "/state/non-fungible/data": 20,
+    "/transaction/build": 20,
+    "/transaction/submit": 20,
+}
+
+# Read-only endpoints whose identical concurrent requests may share one
+# in-flight call.  Transaction build/submit are never coalesced.
+COALESCED_PREFIXES = ("/status/", "/state/",
+                      "/transaction/status", "/transaction/committed-details")
+
+
+# Longest a caller may wait for a rate-limit token (or a retry backoff)
+# before the call fails fast instead of holding a worker thread
+MAX_LIMITER_WAIT = 0.5
+
+# While the Gateway's Retry-After (429) is in force, callers may instead
+# wait up to this long for their slot
+MAX_THROTTLE_WAIT = GATEWAY_MAX_THROTTLE_WAIT
+
+# Base delay (s) of the exponential backoff between read retries
+RETRY_BACKOFF = 0.1
+
+
+class GatewayUnavailable(requests.RequestException):
+    """Raised instead of calling the Gateway while it is rate limited or down."""
+
+
+class GatewayThrottled(GatewayUnavailable):
+    """The rate limiter has no slot within the allowed wait."""
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def coalesce_key(path, payload):
+    """Single-flight key for a Gateway call, or None if it must not be shared."""
+    if not path.startswith(COALESCED_PREFIXES):
+        return None
+    return (path, json.dumps(payload, sort_keys=True, default=str))
+
+
+class _Call:
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Collapse concurrent calls that share a key into one execution.
+
+    The first caller for a key runs `fn`; callers arriving while it is in
+    flight block until it finishes and receive the same result (or error).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, fn):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket: `rate` calls per second with bursts of up to
+    `burst`.  A 429 empties the bucket until the server's Retry-After; until
+    then callers queue for up to `throttle_wait` instead of `max_wait`.
+    """
+
+    def __init__(self, rate, burst, throttle_wait=MAX_THROTTLE_WAIT):
+        self.rate = float(rate)
+        self.burst = float(max(1, burst))
+        self.throttle_wait = throttle_wait
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._throttled_until = 0.0
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        if now > self._updated:
+            self._tokens = min(self.burst,
+                               self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+
+    def reserve(self, max_wait=MAX_LIMITER_WAIT):
+        """
+        Take one token and return how long the caller must wait before using
+        it.  Raises GatewayThrottled (taking nothing) if that exceeds
+        `max_wait` (or `throttle_wait` while a Retry-After is in force).
+        """
+        if self.rate <= 0:
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            wait = max(0.0, (1 - self._tokens) / self.rate)
+            if now < self._throttled_until:
+                max_wait = max(max_wait, self.throttle_wait)
+            if wait > max_wait:
+                raise GatewayThrottled(
+                    f"Gateway rate limit reached (next slot in {wait:.1f}s)", wait)
+            self._tokens -= 1
+            return wait
+
+    def penalize(self, seconds):
+        """Hold back all callers for `seconds` (server asked us to slow down)."""
+        if self.rate <= 0:
+            return
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            self._tokens = min(self._tokens, -seconds * self.rate)
+            self._throttled_until = max(self._throttled_until, now + seconds)
+
+
+class CircuitBreaker:
+    """
+    Opens after `threshold` consecutive Gateway failures (network errors,
+    429s and 5xx).  While open every call fails fast; after `cooldown`
+    seconds a single trial call is let through and its outcome closes or
+    re-opens the breaker.
+    """
+
+    def __init__(self, threshold, cooldown):
+        self.threshold = max(1, threshold)
+        self.cooldown = cooldown
+        self._failures = 0
+        self._opened_at = None
+        self._trial = False
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self):
+        with self._lock:
+            return (self._opened_at is not None and
+                    (self._trial or time.monotonic() - self._opened_at < self.cooldown))
+
+    def allow(self):
+        """Raise GatewayUnavailable unless a call may be made now."""
+        with self._lock:
+            if self._opened_at is None:
+                return
+            if not self._trial and time.monotonic() - self._opened_at >= self.cooldown:
+                self._trial = True              # half-open: this caller probes
+                return
+        raise GatewayUnavailable("Gateway circuit open – failing fast")
+
+    def cancel_trial(self):
+        """The half-open probe was never sent; let the next caller probe."""
+        with self._lock:
+            self._trial = False
+
+    def record_success(self):
+        with self._lock:
+            if self._opened_at is not None:
+                print("[gateway] circuit closed")
+            self._failures = 0
+            self._opened_at = None
+            self._trial = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._trial or (self._opened_at is None and
+                               self._failures >= self.threshold):
+                print(f"[gateway] circuit open for {self.cooldown}s "
+                      f"after {self._failures} failures")
+                self._opened_at = time.monotonic()
+                self._trial = False
+
+
+def is_failure(response):
+    """Responses that count against the breaker and may be retried."""
+    return response.status_code == 429 or response.status_code >= 500
+
+
+class GatewayClient:
+    """Pooled, keep-alive client for the Radix Gateway API."""
+
+    def __init__(self, base_url=RADIX_GATEWAY_API, pool_size=GATEWAY_POOL_SIZE):
+        self.base_url = base_url.rstrip("/")
+        self.pool_size = pool_size
+
+        self.session = requests.Session()
+        self.session.headers.update(DEFAULT_HEADERS)
+
+        # One pool per host; pool_maxsize bounds the number of sockets kept
+        # alive for the Gateway host across all worker threads.
+        adapter = HTTPAdapter(pool_connections=4,
+                              pool_maxsize=pool_size,
+                              max_retries=0)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+        self.inflight = SingleFlight()
+        self.limiter = TokenBucket(GATEWAY_RATE_LIMIT, GATEWAY_BURST)
+        self.breaker = CircuitBreaker(GATEWAY_BREAKER_THRESHOLD,
+                                      GATEWAY_BREAKER_COOLDOWN)
+
+    def url(self, path):
+        return f"{self.base_url}{path}"
+
+    def timeout_for(self, path):
+        """Return the (connect, read) timeout tuple for `path`."""
+        return (CONNECT_TIMEOUT, ENDPOINT_TIMEOUTS.get(path, GATEWAY_TIMEOUT))
+
+    def attempts_for(self, path):
+        """Reads are retried up to GATEWAY_RETRIES times; writes never."""
+        return 1 + (GATEWAY_RETRIES if coalesce_key(path, None) else 0)
+
+    def after_response(self, response):
+        """Feed a response's outcome to the breaker and rate limiter."""
+        if is_failure(response):
+            self.breaker.record_failure()
+            if response.status_code == 429:
+                self.limiter.penalize(retry_after_seconds(response))
+        else:
+            self.breaker.record_success()
+
+    def backoff(self, attempt, response=None):
+        # After a 429 the limiter already holds the retry until Retry-After
+        if response is not None and response.status_code == 429:
+            return 0.0
+        return min(MAX_LIMITER_WAIT, RETRY_BACKOFF * (2 ** attempt))
+
+    def admit(self):
+        """
+        Pass the circuit breaker and take a rate-limit token; returns how
+        long to wait before sending.  A half-open probe that gets no token
+        is handed back so the breaker does not stay half-open forever.
+        """
+        self.breaker.allow()
+        try:
+            return self.limiter.reserve()
+        except GatewayUnavailable:
+            self.breaker.cancel_trial()
+            raise
+
+    def _guarded(self, path, send):
+        """
+        Run `send()` behind the breaker and rate limiter, retrying failed
+        reads a bounded number of times.  The last failed response is
+        returned to the caller; GatewayUnavailable is raised instead of
+        waiting whenever the Gateway is known to be unavailable.
+        """
+        attempts = self.attempts_for(path)
+        response = None
+        for attempt in range(attempts):
+            try:
+                wait = self.admit()
+            except GatewayThrottled:
+                # No slot before the cap: hand back the last reply, if any
+                if response is None:
+                    raise
+                return response
+            if wait:
+                time.sleep(wait)
+            try:
+                response = send()
+            except requests.RequestException:
+                response = None
+                self.breaker.record_failure()
+                if attempt == attempts - 1:
+                    raise
+            else:
+                self.after_response(response)
+                if not is_failure(response) or attempt == attempts - 1:
+                    return response
+            time.sleep(self.backoff(attempt, response))
+
+    def post(self, path, payload=None, timeout=None):
+        """
+        POST `payload` as JSON to a Gateway endpoint and return the response.
+        Identical concurrent reads share a single request (and response).
+        """
+        payload = payload if payload is not None else {}
+
+        def send():
+            return self._guarded(path, lambda: self.session.post(
+                self.url(path), json=payload,
+                timeout=timeout or self.timeout_for(path)))
+
+        key = coalesce_key(path, payload)
+        if key is None:
+            return send()
+        return self.inflight.do(key, send)
+
+    def get(self, path, timeout=None):
+        """GET a Gateway endpoint and return the response."""
+        return self._guarded(path, lambda: self.session.get(
+            self.url(path), timeout=timeout or self.timeout_for(path)))
+
+    def close(self):
+        self.session.close()
+
+
+class AsyncGatewayClient:
+    """
+    asyncio Gateway client.
+
+    Coroutines run on one background event loop owned by this client, so a
+    single httpx.AsyncClient (and its keep-alive pool) is shared by every
+    Flask worker thread.  Routes call `run()` with a coroutine that gathers
+    several lookups; the worker waits once for the slowest of them instead
+    of once per round-trip.  Without httpx installed, requests are handed to
+    the sync client on the loop's thread pool.
+    """
+
+    def __init__(self, sync_client, pool_size=GATEWAY_POOL_SIZE):
+        self.sync_client = sync_client
+        self.pool_size = pool_size
+        self._loop = None
+        self._client = None
+        self._lock = threading.Lock()
+        self._inflight = {}                 # coalesce key -> asyncio.Task
+
+    def _ensure_loop(self):
+        with self._lock:
+            if self._loop is None:
+                loop = asyncio.new_event_loop()
+                thread = threading.Thread(target=loop.run_forever,
+                                          name="gateway-async",
+                                          daemon=True)
+                thread.start()
+                self._loop = loop
+        return self._loop
+
+    def _http(self):
+        # Created lazily so it is bound to the gateway loop
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                base_url=self.sync_client.base_url,
+                headers=DEFAULT_HEADERS,
+                limits=httpx.Limits(max_connections=self.pool_size,
+                                    max_keepalive_connections=self.pool_size)
+            )
+        return self._client
+
+    async def post(self, path, payload=None, timeout=None):
+        """
+        POST `payload` as JSON to a Gateway endpoint and return the response.
+        Identical concurrent reads share a single request (and response).
+        """
+        payload = payload if payload is not None else {}
+
+        key = coalesce_key(path, payload)
+        if key is None:
+            return await self._send(path, payload, timeout)
+
+        # Everything runs on the gateway loop, so no lock is needed here
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._send(path, payload, timeout))
+            self._inflight[key] = task
+            task.add_done_callback(lambda _t: self._inflight.pop(key, None))
+        # shield: one caller being cancelled must not cancel the others
+        return await asyncio.shield(task)
+
+    async def _send(self, path, payload, timeout):
+        if httpx is None:
+            # The sync client applies the breaker, limiter and retries
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(
+                None, partial(self.sync_client.post, path, payload, timeout))
+
+        client = self.sync_client
+        connect, read = client.timeout_for(path)
+        attempts = client.attempts_for(path)
+        response = None
+        for attempt in range(attempts):
+            try:
+                wait = client.admit()
+            except GatewayThrottled:
+                if response is None:
+                    raise
+                return response
+            if wait:
+                await asyncio.sleep(wait)
+            try:
+                response = await self._http().post(
+                    path,
+                    json=payload,
+                    timeout=httpx.Timeout(timeout or read, connect=connect))
+            except httpx.HTTPError as e:
+                response = None
+                client.breaker.record_failure()
+                if attempt == attempts - 1:
+                    raise GatewayUnavailable(f"Gateway request failed: {e}") from e
+            else:
+                client.after_response(response)
+                if not is_failure(response) or attempt == attempts - 1:
+                    return response
+            await asyncio.sleep(client.backoff(attempt, response))
+
+    def run(self, coro, timeout=None):
+        """
+        Run `coro` on the gateway loop and block until it completes.
+        The caller's context variables (e.g. the pinned ledger state) are
+        visible to the coroutine and every task it spawns.
+        """
+        ctx = contextvars.copy_context()
+        future = asyncio.run_coroutine_threadsafe(_in_context(ctx, coro),
+                                                  self._ensure_loop())
+        return future.result(timeout)
+
+
+async def _in_context(ctx, coro):
+    return await ctx.run(asyncio.ensure_future, coro)
+
+
+class AdaptiveConcurrency:
+    """
+    AIMD cap on concurrent async Gateway calls.
+
+    Used as `async with limiter:` around each call.  A 429 halves the limit
+    and pauses new calls for the server's Retry-After; every success raises
+    the limit by one again, up to `max_limit`.  Must only be used from the
+    gateway loop.
+    """
+
+    def __init__(self, max_limit, min_limit=1):
+        self.max_limit = max(1, max_limit)
+        self.min_limit = max(1, min(min_limit, self.max_limit))
+        self.limit = self.max_limit
+        self.active = 0
+        self._resume_at = 0.0
+        self._cond = None                   # created on the gateway loop
+
+    def _condition(self):
+        if self._cond is None:
+            self._cond = asyncio.Condition()
+        return self._cond
+
+    async def __aenter__(self):
+        cond = self._condition()
+        async with cond:
+            await cond.wait_for(lambda: self.active < self.limit)
+            self.active += 1
+        delay = self._resume_at - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        return self
+
+    async def __aexit__(self, *exc):
+        cond = self._condition()
+        async with cond:
+            self.active -= 1
+            cond.notify_all()
+
+    def on_success(self):
+        if self.limit < self.max_limit:
+            self.limit += 1
+
+    def on_throttled(self, retry_after=1.0):
+        self.limit = max(self.min_limit, self.limit // 2)
+        self._resume_at = max(self._resume_at, time.monotonic() + retry_after)
+        print(f"[gateway] 429 – concurrency limit now {self.limit}, "
+              f"pausing {retry_after:.1f}s")
+
+
+def retry_after_seconds(response, default=1.0):
+    """Seconds to wait from a 429's Retry-After header (delta-seconds only)."""
+    try:
+        return max(0.0, float(response.headers.get("Retry-After", default)))
+    except (TypeError, ValueError):
+        return default
+
+
+# How long a /status/gateway-status answer is reused across requests
+LEDGER_STATE_TTL = 1.0
+
+
+class LedgerStateCache:
+    """
+    Shared, short-lived cache of the Gateway's current ledger state, plus a
+    per-request pin.
+
+    Between `begin_request()` and `end_request()` the first helper that
+    needs a state version pins one; every later Gateway read in the same
+    request reuses it, so the request sees one consistent ledger state and
+    pays for at most one status round-trip (none if the shared cache is
+    warm).
+    """
+
+    def __init__(self, client, async_client, ttl=LEDGER_STATE_TTL):
+        self.client = client
+        self.async_client = async_client
+        self.ttl = ttl
+        self._state = None
+        self._expires = 0.0
+        self._lock = threading.Lock()
+        self._pin = contextvars.ContextVar("gateway_ledger_pin", default=None)
+
+    def _fresh(self):
+        with self._lock:
+            if self._state is not None and time.monotonic() < self._expires:
+                return self._state
+        return None
+
+    def _remember(self, response):
+        response.raise_for_status()
+        state = response.json()["ledger_state"]
+        with self._lock:
+            self._state = state
+            self._expires = time.monotonic() + self.ttl
+        return state
+
+    def _last_known(self, error):
+        # Gateway unavailable: keep reading at the last state we saw
+        if self._state is None:
+            raise error
+        return self._state
+
+    def current(self):
+        """
+        The Gateway's ledger_state, at most `ttl` seconds old (or the last
+        known one while the Gateway is unavailable).
+        """
+        state = self._fresh()
+        if state is not None:
+            return state
+        try:
+            return self._remember(self.client.post("/status/gateway-status", {}))
+        except GatewayUnavailable as e:
+            return self._last_known(e)
+
+    async def current_async(self):
+        state = self._fresh()
+        if state is not None:
+            return state
+        try:
+            return self._remember(
+                await self.async_client.post("/status/gateway-status", {}))
+        except GatewayUnavailable as e:
+            return self._last_known(e)
+
+    def begin_request(self):
+        """Open a pin scope; returns a token for `end_request()`."""
+        return self._pin.set([None])
+
+    def end_request(self, token):
+        self._pin.reset(token)
+
+    def pinned(self):
+        """The state pinned for this request (or the current one outside a request)."""
+        holder = self._pin.get()
+        if holder is None:
+            return self.current()
+        if holder[0] is None:
+            holder[0] = self.current()
+        return holder[0]
+
+    async def pinned_async(self):
+        holder = self._pin.get()
+        if holder is None:
+            return await self.current_async()
+        if holder[0] is None:
+            holder[0] = await self.current_async()
+        return holder[0]
+
+    def selector(self):
+        """`at_ledger_state` selector for the pinned state version."""
+        return {"state_version": self.pinned()["state_version"]}
+
+    async def selector_async(self):
+        return {"state_version": (await self.pinned_async())["state_version"]}
+
+
+# Process-wide clients shared by app.py and radix_client.py
+gateway = GatewayClient()
+gateway_async = AsyncGatewayClient(gateway)
+ledger = LedgerStateCache(gateway, gateway_async)
@@ -0,0 +1,184 @@
+# machine_catalog.py
+#
+# Build and upgrade rules for every machine type, as data.  MACHINES is
+# compiled once at import into flat lookup tables:
+#
+#   (machine_type, machines already built)  -> CostRule   (building)
+#   (machine_type, next level, is second)   -> CostRule   (upgrading)
+#
+# so a cost check is a dict lookup plus the rule's prerequisites, which are
+# evaluated against a MachineInventory without touching the database.
+# MACHINE_CATALOG_PATH may point at a JSON file with the same structure to
+# rebalance the game without a code change.
+import json
+from typing import NamedTuple
+
+from config import MACHINE_CATALOG_PATH
+
+# Prerequisites are lists of tuples:
+#   ("has", type)                        at least one built
+#   ("all_at_least", type, level)        at least one built, all at >= level
+#   ("any_at_least", type, level)        at least one at >= level
+#   ("first_at_least", type, n, level)   the first n built are at >= level
+MACHINES = {
+    "catLair": {
+        "build": [
+            {"cost": {"tcorvax": 10}},
+            {"cost": {"tcorvax": 40}},
+        ],
+        "max_level": 3,
+        # Level n costs base × growth^(n-1); the second machine of the type × 4
+        "upgrade": {"base": {"tcorvax": 10}, "growth": 2, "second_multiplier": 4},
+    },
+    "reactor": {
+        "build": [
+            {"cost": {"tcorvax": 10, "catNips": 10}},
+            {"cost": {"tcorvax": 40, "catNips": 40}},
+            {"cost": {"tcorvax": 640, "catNips": 640},
+             "requires": [("has", "incubator"), ("has", "fomoHit")],
+             "error": "You need to build both Incubator and FOMO HIT before building a third Reactor."},
+        ],
+        "max_level": 3,
+        "upgrade": {"base": {"tcorvax": 10, "catNips": 10}, "growth": 2, "second_multiplier": 4},
+    },
+    "amplifier": {
+        "build": [
+            {"cost": {"tcorvax": 10, "catNips": 10, "energy": 10}},
+        ],
+        "max_level": 5,
+        "upgrade": {
+            "base": {"tcorvax": 10, "catNips": 10, "energy": 10}, "growth": 2,
+            "requires": {
+                4: [("first_at_least", "catLair", 1, 3), ("first_at_least", "reactor", 1, 3)],
+                5: [("first_at_least", "catLair", 2, 3), ("first_at_least", "reactor", 2, 3)],
+            },
+        },
+    },
+    "incubator": {
+        "build": [
+            {"cost": {"tcorvax": 320, "catNips": 320, "energy": 320},
+             "requires": [("all_at_least", "catLair", 3), ("all_at_least", "reactor", 3),
+                          ("any_at_least", "amplifier", 5)],
+             "error": "All machines must be at max level to build Incubator."},
+        ],
+        "max_level": 2,
+        # Flat per-level costs instead of base × growth
+        "upgrade": {"costs": {2: {"tcorvax": 640, "catNips": 640, "energy": 640}}},
+    },
+    "fomoHit": {
+        "build": [
+            {"cost": {"tcorvax": 640, "catNips": 640, "energy": 640},
+             "requires": [("has", "catLair"), ("has", "reactor"),
+                          ("has", "amplifier"), ("has", "incubator")],
+             "error": "Must build {machine_type} first."},
+        ],
+        "max_level": 1,
+    },
+}
+
+
+def _requirement_met(requirement, inventory):
+    kind, machine_type = requirement[0], requirement[1]
+    machines = inventory.of_type(machine_type)
+    if kind == "has":
+        return bool(machines)
+    if kind == "all_at_least":
+        return bool(machines) and all(m["level"] >= requirement[2] for m in machines)
+    if kind == "any_at_least":
+        return any(m["level"] >= requirement[2] for m in machines)
+    if kind == "first_at_least":
+        n, level = requirement[2], requirement[3]
+        return len(machines) >= n and all(m["level"] >= level for m in machines[:n])
+    raise ValueError(f"Unknown machine requirement: {kind}")
+
+
+class CostRule(NamedTuple):
+    cost: dict
+    requires: tuple = ()
+    error: str = ""
+
+    def unmet(self, inventory):
+        """The first prerequisite `inventory` does not satisfy, or None."""
+        for requirement in self.requires:
+            if not _requirement_met(requirement, inventory):
+                return requirement
+        return None
+
+    def error_for(self, requirement):
+        return self.error.format(machine_type=requirement[1])
+
+
+class MachineCatalog:
+    """MACHINES compiled into (type, count) and (type, level, second) tables."""
+
+    def __init__(self, machines):
+        self.machines = machines
+        self._build = {}
+        self._upgrade = {}
+        for machine_type, spec in machines.items():
+            for count, entry in enumerate(spec.get("build", [])):
+                self._build[(machine_type, count)] = CostRule(
+                    cost=dict(entry["cost"]),
+                    requires=tuple(tuple(r) for r in entry.get("requires", ())),
+                    error=entry.get("error", ""))
+            self._compile_upgrades(machine_type, spec)
+
+    def _compile_upgrades(self, machine_type, spec):
+        upgrade = spec.get("upgrade")
+        if not upgrade:
+            return
+        # JSON object keys are strings
+        requires = {int(level): tuple(tuple(r) for r in reqs)
+                    for level, reqs in upgrade.get("requires", {}).items()}
+        flat = {int(level): cost for level, cost in upgrade.get("costs", {}).items()}
+
+        for level in range(2, spec["max_level"] + 1):
+            if flat:
+                if level not in flat:
+                    continue
+                base_cost = dict(flat[level])
+            else:
+                mult = upgrade["growth"] ** (level - 1)
+                base_cost = {res: val * mult for res, val in upgrade["base"].items()}
+
+            second_mult = upgrade.get("second_multiplier", 1)
+            for second in (False, True):
+                cost = base_cost if not second else {
+                    res: val * second_mult for res, val in base_cost.items()}
+                self._upgrade[(machine_type, level, second)] = CostRule(
+                    cost=cost, requires=requires.get(level, ()))
+
+    def build_rule(self, machine_type, how_many_already):
+        """Rule for building one more `machine_type`, or None if not allowed."""
+        return self._build.get((machine_type, how_many_already))
+
+    def upgrade_rule(self, machine_type, next_level, second=False):
+        """Rule for upgrading to `next_level`, or None past the max level."""
+        return self._upgrade.get((machine_type, next_level, second))
+
+    def to_json(self):
+        """The compiled tables in the shape /api/machineCatalog serves."""
+        catalog = {}
+        for machine_type, spec in self.machines.items():
+            catalog[machine_type] = {
+                "maxLevel": spec["max_level"],
+                "build": [{"cost": rule.cost, "requires": rule.requires}
+                          for (t, _), rule in sorted(self._build.items()) if t == machine_type],
+                "upgrade": [{"level": level, "second": second,
+                             "cost": rule.cost, "requires": rule.requires}
+                            for (t, level, second), rule in sorted(self._upgrade.items())
+                            if t == machine_type],
+            }
+        return catalog
+
+
+def load_machine_definitions(path=MACHINE_CATALOG_PATH):
+    """MACHINES, or the JSON definitions at `path` when one is configured."""
+    if not path:
+        return MACHINES
+    with open(path) as f:
+        print(f"Loading machine catalog from {path}")
+        return json.load(f)
+
+
+MACHINE_CATALOG = MachineCatalog(load_machine_definitions())
@@ -0,0 +1,62 @@
+# machine_inventory.py
+#
+# A player's machines loaded with one SELECT and indexed by type, so the
+# build/upgrade gating rules (counts, levels, "the second cat lair", ...)
+# are answered in memory instead of with a COUNT/MAX query each.
+from schema import schema
+
+
+class MachineInventory:
+    """All machines of one player; each type's list is in id (build) order."""
+
+    def __init__(self, machines):
+        self.machines = sorted(machines, key=lambda m: m["id"])
+        self._by_id = {m["id"]: m for m in self.machines}
+        self._by_type = {}
+        for m in self.machines:
+            self._by_type.setdefault(m["machine_type"], []).append(m)
+
+    @classmethod
+    def load(cls, cur, user_id):
+        cur.execute(schema.select_machines, (user_id,))
+        return cls([dict(r) for r in cur.fetchall()])
+
+    def get(self, machine_id):
+        """The machine row for `machine_id` (int or numeric string), or None."""
+        try:
+            return self._by_id.get(int(machine_id))
+        except (TypeError, ValueError):
+            return None
+
+    def of_type(self, machine_type):
+        return self._by_type.get(machine_type, [])
+
+    def count(self, machine_type, min_level=None):
+        machines = self.of_type(machine_type)
+        if min_level is None:
+            return len(machines)
+        return sum(1 for m in machines if m["level"] >= min_level)
+
+    def has(self, machine_type):
+        return bool(self._by_type.get(machine_type))
+
+    def max_level(self, machine_type):
+        """Highest level of `machine_type`, or None when there is none."""
+        machines = self.of_type(machine_type)
+        return max(m["level"] for m in machines) if machines else None
+
+    def position(self, machine_type, machine_id):
+        """0-based build order of `machine_id` among its type, or None."""
+        for index, m in enumerate(self.of_type(machine_type)):
+            if m["id"] == machine_id:
+                return index
+        return None
+
+    def counts(self):
+        """{machine_type: count}, as rooms_unlocked() expects."""
+        return {machine_type: len(machines) for machine_type, machines in self._by_type.items()}
+
+    def collides(self, x, y, room, size):
+        """True if a size×size machine at (x, y) overlaps one in `room`."""
+        return any(m["room"] == room and abs(m["x"] - x) < size and abs(m["y"] - y) < size
+                   for m in self.machines)
@@ -0,0 +1,211 @@
+# migrations.py
+#
+# Versioned schema migrations for bot.db.  Applied versions are recorded in
+# the schema_version table; on boot migrate() reads the current version and
+# returns straight away when it is up to date, so worker start-up costs one
+# query instead of a table scan per check.  Each migration is idempotent (it
+# checks before it alters) and runs in its own IMMEDIATE transaction, so
+# workers booting together apply it exactly once.
+import time
+
+from accrual import MACHINE_COOLDOWN_MS
+
+
+def _columns(cur, table):
+    cur.execute(f"PRAGMA table_info({table})")
+    return {row[1] for row in cur.fetchall()}
+
+
+def _add_column(cur, table, column, definition):
+    if column not in _columns(cur, table):
+        print(f"Adding {column} column to {table} table")
+        cur.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+
+
+# ──────────────────────────────────────────────────────────────
+# Migrations – append only; never renumber or edit an applied one
+# ──────────────────────────────────────────────────────────────
+def baseline_tables(cur):
+    # Normally created by the Telegram bot; needed for a fresh database
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS users (
+            user_id INTEGER PRIMARY KEY,
+            first_name TEXT,
+            corvax_count INTEGER DEFAULT 0
+        )
+    """)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS resources (
+            user_id INTEGER NOT NULL,
+            resource_name TEXT NOT NULL,
+            amount REAL DEFAULT 0
+        )
+    """)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS user_machines (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            machine_type TEXT NOT NULL,
+            x INTEGER DEFAULT 0,
+            y INTEGER DEFAULT 0,
+            level INTEGER DEFAULT 1,
+            last_activated INTEGER DEFAULT 0,
+            is_offline INTEGER DEFAULT 0,
+            next_cost_time INTEGER DEFAULT 0
+        )
+    """)
+
+
+def machines_provisional_mint(cur):
+    _add_column(cur, "user_machines", "provisional_mint", "INTEGER DEFAULT 0")
+
+
+def machines_room(cur):
+    _add_column(cur, "user_machines", "room", "INTEGER DEFAULT 1")
+
+
+def users_seen_room_unlock(cur):
+    _add_column(cur, "users", "seen_room_unlock", "INTEGER DEFAULT 0")
+
+
+def users_radix_account_address(cur):
+    _add_column(cur, "users", "radix_account_address", "TEXT")
+
+
+def pets_table(cur):
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS pets (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            x INTEGER NOT NULL,
+            y INTEGER NOT NULL,
+            room INTEGER DEFAULT 1,
+            type TEXT DEFAULT 'cat',
+            parent_machine INTEGER DEFAULT NULL
+        )
+    """)
+
+
+def backfill_eggs_resource(cur):
+    # One set-based statement instead of a lookup per user
+    cur.execute("""
+        INSERT INTO resources (user_id, resource_name, amount)
+        SELECT u.user_id, 'eggs', 0
+        FROM users u
+        WHERE NOT EXISTS (
+            SELECT 1 FROM resources r
+            WHERE r.user_id = u.user_id AND r.resource_name = 'eggs'
+        )
+    """)
+    if cur.rowcount > 0:
+        print(f"Added eggs resource for {cur.rowcount} users")
+
+
+def dedupe_resources(cur):
+    # Keep the first row per (user_id, resource_name) – the one reads saw
+    cur.execute("""
+        DELETE FROM resources
+        WHERE rowid NOT IN (
+            SELECT MIN(rowid) FROM resources GROUP BY user_id, resource_name
+        )
+    """)
+    if cur.rowcount > 0:
+        print(f"Removed {cur.rowcount} duplicate resource rows")
+    cur.execute("""
+        CREATE UNIQUE INDEX IF NOT EXISTS ux_resources_user_name
+        ON resources (user_id, resource_name)
+    """)
+
+
+def hot_query_indexes(cur):
+    # Covers the per-type COUNT / MAX(level) gating queries without
+    # touching the table; (user_id, id) lookups already use the rowid.
+    cur.execute("""
+        CREATE INDEX IF NOT EXISTS ix_user_machines_user_type_level
+        ON user_machines (user_id, machine_type, level)
+    """)
+    cur.execute("""
+        CREATE INDEX IF NOT EXISTS ix_pets_user_type
+        ON pets (user_id, type)
+    """)
+    cur.execute("ANALYZE")
+
+
+def machines_next_available_at(cur):
+    # Activation cooldown end, so cooldown checks and "what can I activate"
+    # are index lookups instead of per-row arithmetic on last_activated
+    _add_column(cur, "user_machines", "next_available_at", "INTEGER DEFAULT 0")
+    cur.execute("""
+        UPDATE user_machines
+        SET next_available_at = last_activated + ?
+        WHERE last_activated > 0 AND next_available_at = 0
+    """, (MACHINE_COOLDOWN_MS,))
+    cur.execute("""
+        CREATE INDEX IF NOT EXISTS ix_user_machines_user_next_available
+        ON user_machines (user_id, next_available_at)
+    """)
+
+
+MIGRATIONS = [
+    (1, "baseline tables", baseline_tables),
+    (2, "user_machines.provisional_mint", machines_provisional_mint),
+    (3, "user_machines.room", machines_room),
+    (4, "users.seen_room_unlock", users_seen_room_unlock),
+    (5, "users.radix_account_address", users_radix_account_address),
+    (6, "pets table", pets_table),
+    (7, "eggs resource backfill", backfill_eggs_resource),
+    (8, "resources unique (user_id, resource_name)", dedupe_resources),
+    (9, "user_machines / pets indexes", hot_query_indexes),
+    (10, "user_machines.next_available_at", machines_next_available_at),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+# ──────────────────────────────────────────────────────────────
+# Runner
+# ──────────────────────────────────────────────────────────────
+def current_version(conn):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            description TEXT,
+            applied_at INTEGER
+        )
+    """)
+    row = conn.execute("SELECT MAX(version) FROM schema_version").fetchone()
+    return row[0] or 0
+
+
+def migrate(conn):
+    """Apply pending migrations; returns the schema version afterwards."""
+    version = current_version(conn)
+    if version >= LATEST_VERSION:
+        return version
+
+    for number, description, apply in MIGRATIONS:
+        if number <= version:
+            continue
+
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # Another worker may have applied it while we waited for the lock
+            applied = conn.execute(
+                "SELECT 1 FROM schema_version WHERE version=?", (number,)).fetchone()
+            if not applied:
+                print(f"Applying migration {number}: {description}")
+                cur = conn.cursor()
+                apply(cur)
+                cur.execute("""
+                    INSERT INTO schema_version (version, description, applied_at)
+                    VALUES (?, ?, ?)
+                """, (number, description, int(time.time())))
+                cur.close()
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        version = number
+
+    print(f"Database schema at version {version}")
+    return version
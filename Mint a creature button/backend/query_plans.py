@@ -0,0 +1,134 @@
+# query_plans.py
+#
+# EXPLAIN QUERY PLAN check for the hot user_machines / resources / pets
+# queries.  Fails (exit status 1) when one of them falls back to a full
+# table scan, e.g. because an index migration is missing.
+#
+# The statements are the ones the app actually issues: every query compiled
+# in schema.py, plus whatever resource_ledger, amplifier_upkeep and the
+# game-state snapshot execute (captured with a trace callback, bound values
+# inlined).  test_query_plans.py runs the same check under pytest.
+#
+#   python query_plans.py              # scratch DB built from migrations.py
+#   python query_plans.py /path/bot.db # a real database
+import sqlite3
+import sys
+
+from migrations import migrate
+from schema import schema
+from resource_ledger import (TCORVAX, get_resource, get_balances, set_resource,
+                             credit, apply_changes)
+from amplifier_upkeep import _due_amplifiers
+from game_state import load_game_snapshot
+
+# Sample parameters for every statement compiled in schema.py; a new
+# statement without an entry here fails the check
+SCHEMA_PARAMS = {
+    "select_machines": lambda: (1,),
+    "select_machine": lambda: (1, 1),
+    "select_machine_cooldown": lambda: (1, 1),
+    "select_ready_machines": lambda: (1, 0),
+    "claim_activation": lambda: (0, 0, 1, 1, 0),
+    "select_user_snapshot": lambda: (1,),
+    "count_pets_by_type": lambda: (1, "cat"),
+    "insert_machine": lambda: (1, "catLair", 0, 0, 0, *schema.room_param(1)),
+    "update_machine_position": lambda: (0, 0, *schema.room_param(1), 1, 1),
+}
+
+# Helpers whose SQL is built at call time; run against the scratch rows
+TRACED_CALLS = [
+    ("resource amount", lambda cur: get_resource(cur, 1, "catNips")),
+    ("tcorvax amount", lambda cur: get_resource(cur, 1, TCORVAX)),
+    ("balances", lambda cur: get_balances(cur, 1)),
+    ("resource set", lambda cur: set_resource(cur, 1, "catNips", 5)),
+    ("resource credit", lambda cur: credit(cur, 1, "energy", 1)),
+    ("tcorvax credit", lambda cur: credit(cur, 1, TCORVAX, 1)),
+    ("conditional debit", lambda cur: apply_changes(
+        cur, 1, {TCORVAX: -1, "catNips": -1, "energy": -1})),
+    ("due amplifiers", lambda cur: _due_amplifiers(cur, 1, 0)),
+    ("game snapshot", lambda cur: load_game_snapshot(cur, 1)),
+]
+
+# Transaction control and the like have no plan to check
+_PLANNED = ("SELECT", "UPDATE", "INSERT", "DELETE")
+
+
+def schema_queries(conn):
+    """(name, sql, params) for every statement schema.py compiles."""
+    schema.refresh(conn)
+    queries = []
+    for name, sql in sorted(vars(schema).items()):
+        if not isinstance(sql, str):
+            continue
+        if name not in SCHEMA_PARAMS:
+            raise KeyError(f"query_plans.SCHEMA_PARAMS has no sample for schema.{name}")
+        queries.append((f"schema.{name}", sql, SCHEMA_PARAMS[name]()))
+    return queries
+
+
+def traced_queries(conn):
+    """(name, sql, ()) for the statements each of TRACED_CALLS executes."""
+    conn.execute("INSERT OR IGNORE INTO users (user_id, corvax_count) VALUES (1, 10)")
+    conn.executemany("""
+        INSERT OR IGNORE INTO resources (user_id, resource_name, amount) VALUES (1, ?, 10)
+    """, [("catNips",), ("energy",)])
+
+    queries = []
+    try:
+        for name, call in TRACED_CALLS:
+            issued = []
+            conn.set_trace_callback(issued.append)
+            try:
+                call(conn.cursor())
+            finally:
+                conn.set_trace_callback(None)
+            planned = [sql for sql in issued if sql.lstrip().upper().startswith(_PLANNED)]
+            queries += [(f"{name} #{i}", sql, ()) for i, sql in enumerate(planned, 1)]
+    finally:
+        conn.rollback()
+    return queries
+
+
+def hot_queries(conn):
+    conn.row_factory = sqlite3.Row
+    return schema_queries(conn) + traced_queries(conn)
+
+
+def table_scans(conn, sql, params):
+    """Plan lines that scan a whole table (covering-index scans are fine)."""
+    plan = conn.execute(f"EXPLAIN QUERY PLAN {sql}", params).fetchall()
+    details = [row[-1] for row in plan]
+    return [d for d in details
+            if d.startswith("SCAN") and "USING" not in d and "CONSTANT ROW" not in d]
+
+
+def check_query_plans(conn, queries=None):
+    """Return [(name, [scan detail, …])] for every hot query that scans a table."""
+    failures = []
+    for name, sql, params in queries if queries is not None else hot_queries(conn):
+        scans = table_scans(conn, sql, params)
+        if scans:
+            failures.append((name, scans))
+    return failures
+
+
+def scratch_database():
+    """In-memory bot.db at the latest migration."""
+    conn = sqlite3.connect(":memory:")
+    migrate(conn)
+    return conn
+
+
+def main(argv):
+    conn = sqlite3.connect(argv[1]) if len(argv) > 1 else scratch_database()
+
+    queries = hot_queries(conn)
+    failures = check_query_plans(conn, queries)
+    for name, scans in failures:
+        print(f"FAIL {name}: {'; '.join(scans)}")
+    print(f"{len(queries) - len(failures)}/{len(queries)} hot queries use an index")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
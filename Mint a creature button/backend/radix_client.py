@@ -1,11 +1,8 @@
-import requests
-import json
-import hashlib
 import time
-import base64
 from binascii import hexlify, unhexlify
 from ecdsa import SigningKey, SECP256k1
-from config import RADIX_PRIVATE_KEY, RADIX_ACCOUNT_ADDRESS, RADIX_GATEWAY_API
+from config import RADIX_PRIVATE_KEY, RADIX_ACCOUNT_ADDRESS
+from gateway import gateway
 
 class RadixClient:
     def __init__(self):
@@ -14,7 +11,7 @@ class RadixClient:
             self.private_key_bytes = unhexlify(RADIX_PRIVATE_KEY)
             self.signing_key = SigningKey.from_string(self.private_key_bytes, curve=SECP256k1)
             self.account_address = RADIX_ACCOUNT_ADDRESS
-            self.gateway_api = RADIX_GATEWAY_API
+            self.gateway = gateway
         except Exception as e:
             print(f"Error initializing RadixClient: {e}")
             raise
@@ -22,7 +19,7 @@ class RadixClient:
     def get_current_epoch(self):
         """Get the current network epoch for transaction headers"""
         try:
-            response = requests.get(f"{self.gateway_api}/state/version")
+            response = self.gateway.get("/state/version")
             if response.status_code == 200:
                 data = response.json()
                 return data.get("epoch", 0)
@@ -55,11 +52,7 @@ class RadixClient:
             }
             
             # Send to the Gateway API
-            response = requests.post(
-                f"{self.gateway_api}/transaction/build", 
-                json=payload,
-                headers={"Content-Type": "application/json"}
-            )
+            response = self.gateway.post("/transaction/build", payload)
             
             if response.status_code != 200:
                 raise Exception(f"Failed to build transaction: {response.text}")
@@ -103,11 +96,7 @@ class RadixClient:
         """Submit a signed transaction to the network"""
         try:
             # Submit to Gateway API
-            response = requests.post(
-                f"{self.gateway_api}/transaction/submit", 
-                json=signed_intent,
-                headers={"Content-Type": "application/json"}
-            )
+            response = self.gateway.post("/transaction/submit", signed_intent)
             
             if response.status_code != 200:
                 raise Exception(f"Failed to submit transaction: {response.text}")
@@ -121,11 +110,8 @@ class RadixClient:
     def check_transaction_status(self, intent_hash):
         """Check the status of a submitted transaction"""
         try:
-            response = requests.post(
-                f"{self.gateway_api}/transaction/status",
-                json={"intent_hash": intent_hash},
-                headers={"Content-Type": "application/json"}
-            )
+            response = self.gateway.post("/transaction/status",
+                                         {"intent_hash": intent_hash})
             
             if response.status_code != 200:
                 raise Exception(f"Failed to get transaction status: {response.text}")
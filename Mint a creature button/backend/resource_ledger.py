@@ -0,0 +1,135 @@
+# resource_ledger.py
+#
+# Atomic reads and writes of player resources.  Amounts are changed in SQL
+# (amount = amount + ?) instead of being read into Python, modified and
+# written back, so concurrent requests for the same player cannot overwrite
+# each other's changes.  Debits only apply if every resource involved is
+# sufficient; a multi-resource change is all-or-nothing.
+#
+# "tcorvax" lives in users.corvax_count; every other resource is a row in
+# resources, unique on (user_id, resource_name) since migration 8.
+
+TCORVAX = "tcorvax"
+
+GAME_RESOURCES = (TCORVAX, "catNips", "energy", "eggs")
+
+
+def get_resource(cur, user_id, resource_name):
+    """Current amount of one resource (0 if the player has none yet)."""
+    if resource_name == TCORVAX:
+        cur.execute("SELECT corvax_count FROM users WHERE user_id=?", (user_id,))
+    else:
+        cur.execute("SELECT amount FROM resources WHERE user_id=? AND resource_name=?",
+                    (user_id, resource_name))
+    row = cur.fetchone()
+    return (row[0] or 0) if row else 0
+
+
+def get_balances(cur, user_id, names=GAME_RESOURCES):
+    """{name: amount} for `names`, read with at most two statements."""
+    balances = {name: 0.0 for name in names}
+
+    if TCORVAX in balances:
+        cur.execute("SELECT corvax_count FROM users WHERE user_id=?", (user_id,))
+        row = cur.fetchone()
+        balances[TCORVAX] = float(row[0] or 0) if row else 0.0
+
+    others = [name for name in names if name != TCORVAX]
+    if others:
+        cur.execute(f"""
+            SELECT resource_name, amount FROM resources
+            WHERE user_id=? AND resource_name IN ({", ".join("?" * len(others))})
+        """, (user_id, *others))
+        for name, amount in cur.fetchall():
+            balances[name] = float(amount or 0)
+
+    return balances
+
+
+def set_resource(cur, user_id, resource_name, amount):
+    """Overwrite one resource (prefer credit/apply_changes for relative updates)."""
+    if resource_name == TCORVAX:
+        cur.execute("UPDATE users SET corvax_count=? WHERE user_id=?", (amount, user_id))
+        return
+    cur.execute("""
+        INSERT INTO resources (user_id, resource_name, amount) VALUES (?, ?, ?)
+        ON CONFLICT (user_id, resource_name) DO UPDATE SET amount = excluded.amount
+    """, (user_id, resource_name, amount))
+
+
+def credit(cur, user_id, resource_name, amount):
+    """Atomically add `amount` to one resource, creating the row if needed."""
+    if resource_name == TCORVAX:
+        cur.execute("UPDATE users SET corvax_count = corvax_count + ? WHERE user_id=?",
+                    (amount, user_id))
+        return
+    cur.execute("""
+        INSERT INTO resources (user_id, resource_name, amount) VALUES (?, ?, ?)
+        ON CONFLICT (user_id, resource_name) DO UPDATE SET amount = amount + excluded.amount
+    """, (user_id, resource_name, amount))
+
+
+def _debit(cur, user_id, costs):
+    """Subtract `costs` only if every balance covers it; returns success."""
+    if costs.get(TCORVAX, 0) > 0:
+        cost = costs[TCORVAX]
+        cur.execute("""
+            UPDATE users SET corvax_count = corvax_count - ?
+            WHERE user_id=? AND corvax_count >= ?
+        """, (cost, user_id, cost))
+        if cur.rowcount != 1:
+            return False
+
+    others = {name: cost for name, cost in costs.items()
+              if name != TCORVAX and cost > 0}
+    if not others:
+        return True
+
+    # One statement for every resources row: the subquery checks that all
+    # of them are sufficient before any is touched.
+    names = list(others)
+    case = "CASE resource_name " + " ".join("WHEN ? THEN ?" for _ in names) + " END"
+    case_params = [p for name in names for p in (name, others[name])]
+    in_list = ", ".join("?" * len(names))
+    cur.execute(f"""
+        UPDATE resources
+        SET amount = amount - {case}
+        WHERE user_id=? AND resource_name IN ({in_list})
+          AND (SELECT COUNT(*) FROM resources
+               WHERE user_id=? AND resource_name IN ({in_list})
+                 AND amount >= {case}) = ?
+    """, (*case_params, user_id, *names, user_id, *names, *case_params, len(names)))
+    return cur.rowcount == len(names)
+
+
+def apply_changes(cur, user_id, changes):
+    """
+    Apply {resource_name: delta} atomically.  Negative deltas are debits and
+    only succeed if the balance covers them; if any debit fails nothing is
+    changed and False is returned.
+    """
+    debits = {name: -delta for name, delta in changes.items() if delta < 0}
+    credits = {name: delta for name, delta in changes.items() if delta > 0}
+
+    # Open the caller's transaction first so RELEASE does not commit it
+    if not cur.connection.in_transaction:
+        cur.execute("BEGIN")
+    cur.execute("SAVEPOINT resource_ledger")
+    try:
+        ok = _debit(cur, user_id, debits)
+        if ok:
+            for name, amount in credits.items():
+                credit(cur, user_id, name, amount)
+        else:
+            cur.execute("ROLLBACK TO resource_ledger")
+        cur.execute("RELEASE resource_ledger")
+        return ok
+    except Exception:
+        cur.execute("ROLLBACK TO resource_ledger")
+        cur.execute("RELEASE resource_ledger")
+        raise
+
+
+def debit_if_sufficient(cur, user_id, costs):
+    """Debit every resource in `costs` ({name: amount}) or none of them."""
+    return apply_changes(cur, user_id, {name: -amount for name, amount in costs.items()})
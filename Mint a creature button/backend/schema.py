@@ -0,0 +1,131 @@
+# schema.py
+#
+# Schema capabilities of bot.db, resolved once at startup (and again after
+# migrations) instead of running PRAGMA table_info on every request.  Routes
+# read the flags and use the query variant compiled for the live schema;
+# optional columns that are missing are selected as constants so every
+# variant returns the same row shape.
+
+
+# resources rows loaded by the game-state snapshot
+SNAPSHOT_RESOURCES = ("catNips", "energy", "eggs")
+
+
+def _columns(cur, table):
+    cur.execute(f"PRAGMA table_info({table})")
+    return {row[1] for row in cur.fetchall()}
+
+
+class SchemaCapabilities:
+    """Optional-column flags plus the SQL compiled for them."""
+
+    def __init__(self):
+        self.resolved = False
+        self.has_provisional_mint = False   # user_machines.provisional_mint
+        self.has_room = False               # user_machines.room
+        self.has_seen_room_unlock = False   # users.seen_room_unlock
+        self.has_radix_account = False      # users.radix_account_address
+        self._compile()
+
+    def refresh(self, conn):
+        """Re-read the live schema and recompile the query variants."""
+        cur = conn.cursor()
+        machine_cols = _columns(cur, "user_machines")
+        user_cols = _columns(cur, "users")
+        cur.close()
+
+        self.has_provisional_mint = "provisional_mint" in machine_cols
+        self.has_room = "room" in machine_cols
+        self.has_seen_room_unlock = "seen_room_unlock" in user_cols
+        self.has_radix_account = "radix_account_address" in user_cols
+        self._compile()
+        self.resolved = True
+        print(f"Schema capabilities: provisional_mint={self.has_provisional_mint}, "
+              f"room={self.has_room}, seen_room_unlock={self.has_seen_room_unlock}")
+
+    def _compile(self):
+        provisional = "provisional_mint" if self.has_provisional_mint else "0 AS provisional_mint"
+        room = "room" if self.has_room else "1 AS room"
+
+        # All machines of a user (next_available_at always exists: migration 10)
+        self.select_machines = f"""
+            SELECT id, machine_type, x, y, level, last_activated, is_offline,
+                   next_cost_time, next_available_at, {provisional}, {room}
+            FROM user_machines
+            WHERE user_id=?
+        """
+
+        # One machine of a user
+        self.select_machine = f"""
+            SELECT machine_type, level, last_activated, is_offline, {provisional}, {room}
+            FROM user_machines
+            WHERE user_id=? AND id=?
+        """
+
+        # Type and cooldown end of one machine (activation's early exit)
+        self.select_machine_cooldown = """
+            SELECT machine_type, next_available_at FROM user_machines
+            WHERE user_id=? AND id=?
+        """
+
+        # Machines off cooldown at `now`: params (user_id, now); a range
+        # scan on (user_id, next_available_at), amplifiers have nothing to
+        # activate
+        self.select_ready_machines = f"""
+            SELECT id, machine_type, {room}
+            FROM user_machines
+            WHERE user_id=? AND next_available_at<=? AND machine_type!='amplifier'
+            ORDER BY id
+        """
+
+        # Start a machine's cooldown only if it has finished: params
+        # (last_activated, next_available_at, user_id, id, now); rowcount 1
+        # means this request won the activation
+        self.claim_activation = """
+            UPDATE user_machines
+            SET last_activated=?, next_available_at=?
+            WHERE user_id=? AND id=? AND COALESCE(next_available_at, 0)<=?
+        """
+
+        # User row and every game resource pivoted into one row
+        u_seen = "u.seen_room_unlock" if self.has_seen_room_unlock else "0 AS seen_room_unlock"
+        resource_cols = ",\n                   ".join(
+            f"COALESCE((SELECT amount FROM resources r WHERE r.user_id=u.user_id "
+            f"AND r.resource_name='{name}'), 0) AS {name}"
+            for name in SNAPSHOT_RESOURCES)
+        self.select_user_snapshot = f"""
+            SELECT u.corvax_count, {u_seen},
+                   {resource_cols}
+            FROM users u
+            WHERE u.user_id=?
+        """
+
+        # Pets of one type: params (user_id, type)
+        self.count_pets_by_type = """
+            SELECT COUNT(*) FROM pets
+            WHERE user_id=? AND type=?
+        """
+
+        # New machine: params (user_id, machine_type, x, y, is_offline[, room])
+        cols = "user_id, machine_type, x, y, level, last_activated, is_offline, next_cost_time"
+        vals = "?, ?, ?, ?, 1, 0, ?, 0"
+        if self.has_provisional_mint:
+            cols += ", provisional_mint"
+            vals += ", 0"
+        if self.has_room:
+            cols += ", room"
+            vals += ", ?"
+        self.insert_machine = f"INSERT INTO user_machines ({cols}) VALUES ({vals})"
+
+        # Layout update: params (x, y[, room], user_id, id)
+        self.update_machine_position = f"""
+            UPDATE user_machines SET x=?, y=?{", room=?" if self.has_room else ""}
+            WHERE user_id=? AND id=?
+        """
+
+    def room_param(self, room):
+        """The `room` parameter tuple for insert/update variants."""
+        return (room,) if self.has_room else ()
+
+
+schema = SchemaCapabilities()
@@ -0,0 +1,31 @@
+# test_query_plans.py
+#
+# No hot query may fall back to a full table scan on a freshly migrated
+# database (see query_plans.py).
+import pytest
+
+from query_plans import check_query_plans, hot_queries, scratch_database
+
+
+@pytest.fixture
+def conn():
+    conn = scratch_database()
+    yield conn
+    conn.close()
+
+
+def test_hot_queries_use_an_index(conn):
+    assert check_query_plans(conn) == []
+
+
+def test_every_ledger_and_snapshot_statement_is_checked(conn):
+    names = {name.split(" #")[0] for name, _, _ in hot_queries(conn)}
+    assert {"conditional debit", "game snapshot", "schema.select_ready_machines",
+            "schema.claim_activation"} <= names
+
+
+def test_missing_index_is_reported(conn):
+    conn.execute("DROP INDEX ix_user_machines_user_type_level")
+    conn.execute("DROP INDEX ix_user_machines_user_next_available")
+    failed = {name for name, _ in check_query_plans(conn)}
+    assert "schema.select_machines" in failed
@@ -178,7 +178,8 @@ const EvolvingCreatureMinter = ({ onClose }) => {
               'Content-Type': 'application/json',
             },
             body: JSON.stringify({
-              intentHash
+              intentHash,
+              accountAddress: accounts[0]?.address
             }),
             credentials: 'same-origin'
           });
@@ -230,7 +231,7 @@ const EvolvingCreatureMinter = ({ onClose }) => {
       
       setTimeout(checkStatus, 3000);
     }
-  }, [intentHash, mintingStage, statusCheckCount]);
+  }, [intentHash, mintingStage, statusCheckCount, accounts]);
 
   // Handle the minting process
   const handleMint = async () => {
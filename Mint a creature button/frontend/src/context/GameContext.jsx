@@ -1113,8 +1113,17 @@ export const GameProvider = ({ children }) => {
         room: machine.room || 1
       }));
 
+      const petsToSave = pets.map(pet => ({
+        id: pet.id,
+        x: pet.x,
+        y: pet.y,
+        room: pet.room || 1
+      }));
+
+      // The server only writes the rows whose position changed
       await axios.post('/api/syncLayout', {
-        machines: machinesToSave
+        machines: machinesToSave,
+        pets: petsToSave
       });
     } catch (error) {
       console.error('Error saving layout:', error);